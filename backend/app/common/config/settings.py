@@ -10,12 +10,35 @@ class Settings(BaseSettings):
     mssql_db_name: str | None = None
     mssql_password: str | None = None
     mssql_driver: str = 'pymssql'  # 'pymssql' | 'pyodbc' second options
+    mssql_bulk_insert: bool = False  # opt-in: bound parameters insert (pyodbc: fast_executemany)
+    mssql_bulk_chunk_rows: int = 10000  # rows per executemany call
+    mssql_fetch_size: int = 1000  # rows per fetchmany call of iter_index / iter_rows
+    mssql_count_cache_ttl: float = 60.  # sec, total of filter reused by next pages
+    mssql_count_cache_size: int = 1024  # filters per repository
+    mssql_view_cache_size: int = 10000  # rows per repository with cache_view
+    mssql_view_cache_ttl: float = 300.  # sec, rows changed by other processes are seen after it
+    mssql_known_keys_max: int = 200000  # keys per repository with known_keys_index, seeded if table is smaller
+    mssql_in_chunk_size: int = 1024  # $in values per query, longer lists are split (MSSQL parameters limit)
+    mssql_in_table_min: int = 8192  # longer $in lists: values staged in session temp table, one join query
+    mssql_param_sql: bool = False  # opt-in: CRUD by sp_executesql templates, not SQL text literals
+    mssql_pool_min_size: int = 1
+    mssql_pool_max_size: int = 8  # >= number of parallel DB writers (threads)
+    mssql_pool_max_age: float = 1800.  # sec, connection is reopened after it
+    mssql_pool_check_idle: float = 30.  # sec, ping connection idle longer on checkout
+    mssql_pool_timeout: float = 30.  # sec, wait for free connection
+    mssql_retry_attempts: int = 5  # retries of connect / operation on disconnect
+    mssql_retry_base: float = 0.5  # sec, backoff: random(0, base * 2^n) capped
+    mssql_retry_cap: float = 30.
+    mssql_retry_budget: float = 120.  # sec, no retry started after it
+    mssql_breaker_failures: int = 5  # failed connects in row: fail fast
+    mssql_breaker_reset: float = 30.  # sec, then one probe connect
 
     # Azure
     az_managed_identity_client_id: str | None = None
     az_system_assigned_managed_identity: str | None = None
     az_key_vault_name: str | None = None
     az_key_vault_key_name: str | None = None
+    az_token_refresh_before: float = 300.  # sec before expiry to refresh cached Entra token
 
     # AWS
     aws_kms_access_key_id: str | None = None
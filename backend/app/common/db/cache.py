@@ -0,0 +1,84 @@
+"""
+Read-through cache of repository view() by primary key: LRU + TTL,
+invalidated by writes of the same repository (in this process)
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional, Tuple
+
+MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+
+class EntityCache:
+    """ usage:
+
+        if (data := cache.get(key)) is MISSING:
+            data = read_from_db(key)
+            cache.put(key, data)
+
+    :param max_size: LRU entries, least recently used one is evicted
+    :param ttl: sec, entry is not used after it (other processes may change the row)
+    """
+
+    def __init__(self, name: str, max_size: int = 10000, ttl: float = 300.):
+        self.name = name
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        """ :return: MISSING if not cached or expired """
+
+        with self._lock:
+            if (entry := self._data.get(key)) is None or entry[0] < time.monotonic():
+                self.stats.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """ key None: whole cache (write of not known rows) """
+
+        with self._lock:
+            self.stats.invalidations += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __str__(self):
+        return (
+            f"{self.name}: size={len(self._data)}/{self.max_size} hits={self.stats.hits} "
+            f"misses={self.stats.misses} ({self.stats.hit_ratio:.0%} hits) "
+            f"evictions={self.stats.evictions} invalidations={self.stats.invalidations}"
+        )
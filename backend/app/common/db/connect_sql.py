@@ -1,12 +1,22 @@
+from __future__ import annotations
+
 import struct
+import threading
+import time
+from collections import defaultdict
 from functools import lru_cache
-from typing import Optional, Union
-
-import pymssql
-import pyodbc
-from azure.identity import ManagedIdentityCredential, DefaultAzureCredential
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Union
 
 from common.config.settings import settings
+from common.db.drivers import get_driver, driver_errors
+from common.db.pool import ConnectionPool
+from common.db.retry import CircuitBreaker, RetryPolicy, retry_call
+
+if TYPE_CHECKING:
+    # drivers & Azure SDK are imported on first connection: see get_driver
+    import pymssql
+    import pyodbc
+    from azure.core.credentials import AccessToken
 
 # QAT1 DB connection by default: do not work for local host
 AZURE_ENTRA_CONNECTION = (
@@ -32,54 +42,119 @@ SQL_COPT_SS_ACCESS_TOKEN = 1256  # This connection option is defined by microsof
 TOKEN_URL = "https://database.windows.net/.default"
 
 
-def get_azure_entra_token() -> bytes:
+class EntraTokenCache:
+    """ Process wide access tokens by scope, one credential for all of them.
+
+    Token is refreshed refresh_before sec ahead of expiry by one thread
+    (single flight), other threads keep using still valid token meanwhile.
+    """
+
+    def __init__(self, credential_factory: Callable[[], Any], refresh_before: float = 300.):
+        self.credential_factory = credential_factory
+        self.refresh_before = refresh_before
+        self._credential = None
+        self._tokens: Dict[str, AccessToken] = {}
+        self._locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    @property
+    def credential(self):
+        with self._lock:
+            if self._credential is None:
+                self._credential = self.credential_factory()
+
+        return self._credential
+
+    def _scope_lock(self, scope: str) -> threading.Lock:
+        with self._lock:
+            return self._locks[scope]
+
+    def get_token(self, scope: str) -> AccessToken:
+        token = self._tokens.get(scope)
+        if token and token.expires_on - time.time() > self.refresh_before:
+            return token
+
+        lock = self._scope_lock(scope)
+        valid = token is not None and token.expires_on > time.time()
+        # refresh in progress: use current token while it is valid
+        if not lock.acquire(blocking=not valid):
+            return token
+        try:
+            token = self._tokens.get(scope)
+            if token and token.expires_on - time.time() > self.refresh_before:
+                return token  # refreshed by other thread
+            try:
+                token = self.credential.get_token(scope)
+            except Exception as e:
+                if not valid:
+                    raise
+                print(f"Token refresh failed, current token used: {e}")
+                return self._tokens[scope]
+            self._tokens[scope] = token
+        finally:
+            lock.release()
+
+        return token
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+def get_azure_credential():
+    """ for user assigned mi: ManagedIdentityCredential(client_id) """
+    from azure.identity import ManagedIdentityCredential, DefaultAzureCredential
+
+    if settings.az_managed_identity_client_id:
+        return ManagedIdentityCredential(client_id=settings.az_managed_identity_client_id)
+    if settings.az_system_assigned_managed_identity:
+        return ManagedIdentityCredential()
+
+    return DefaultAzureCredential(exclude_interactive_browser_credential=False)
+
+
+entra_tokens = EntraTokenCache(get_azure_credential, refresh_before=settings.az_token_refresh_before)
+
+
+def get_azure_entra_token(scope: str = TOKEN_URL) -> bytes:
     """ Connect to Azure Entra default over MS ODBC python
 
     :param sami - system-assigned managed identity
     :raise CredentialUnavailableError
     """
 
-    # for user assigned mi:
-    if settings.az_managed_identity_client_id:
-        credential = ManagedIdentityCredential(client_id=settings.az_managed_identity_client_id)
-    elif settings.az_system_assigned_managed_identity:
-        credential = ManagedIdentityCredential()
-    else:
-        credential = DefaultAzureCredential(exclude_interactive_browser_credential=False)
-
-    token_bytes = credential.get_token(TOKEN_URL).token.encode("UTF-16-LE")
+    token_bytes = entra_tokens.get_token(scope).token.encode("UTF-16-LE")
     token_struct = struct.pack(f'<I{len(token_bytes)}s', len(token_bytes), token_bytes)
 
     return token_struct
 
 
 def get_odbc_connection(connection_string: Optional[str] = None):
-    """ AZURE_SQL_CONNECTION - does not work for Uid & Pass """
-
-    while True:
-        try:
-            if ((connection_string and "localhost" in connection_string) or
-                    (not connection_string and settings.mssql_server in ["mssql", "localhost"])):
-                with pyodbc.connect(
-                    connection_string or AZURE_SQL_CONNECTION,
-                    autocommit=False
-                ) as conn:
-                    yield conn
-            else:
-                token_struct = get_azure_entra_token()
-                with pyodbc.connect(
-                    connection_string or AZURE_ENTRA_CONNECTION,
-                    attrs_before={SQL_COPT_SS_ACCESS_TOKEN: token_struct},
-                    autocommit=False
-                ) as conn:
-                    yield conn
-        except (pyodbc.OperationalError, pyodbc.Error) as e:
-            print(str(e))
-            pass
+    """ AZURE_SQL_CONNECTION - does not work for Uid & Pass
+    :raise pyodbc.Error: retries are up to caller (see create_connection)
+    """
+    pyodbc = get_driver("pyodbc")
+
+    if ((connection_string and "localhost" in connection_string) or
+            (not connection_string and settings.mssql_server in ["mssql", "localhost"])):
+        with pyodbc.connect(
+            connection_string or AZURE_SQL_CONNECTION,
+            autocommit=False
+        ) as conn:
+            yield conn
+    else:
+        token_struct = get_azure_entra_token()
+        with pyodbc.connect(
+            connection_string or AZURE_ENTRA_CONNECTION,
+            attrs_before={SQL_COPT_SS_ACCESS_TOKEN: token_struct},
+            autocommit=False
+        ) as conn:
+            yield conn
 
 
 def get_mssql_connection(as_dict: bool = True, **kwargs):
     """ Does not yield using 'with' keyword """
+    pymssql = get_driver("pymssql")
 
     try:
         connection = pymssql.connect(
@@ -91,18 +166,56 @@ def get_mssql_connection(as_dict: bool = True, **kwargs):
             **kwargs
         )
         yield connection
-    except pymssql.Error:
-        pass
+    except pymssql.Error as e:
+        print(str(e))
+        raise
     else:
         connection.close()
 
 
-@lru_cache(maxsize=5)
-def get_connection() -> Union[pyodbc.Connection, pymssql.Connection]:
-    """ using next() to return connection itself """
+db_retry = RetryPolicy(
+    attempts=settings.mssql_retry_attempts,
+    base=settings.mssql_retry_base,
+    cap=settings.mssql_retry_cap,
+    budget=settings.mssql_retry_budget
+)
+db_breaker = CircuitBreaker(
+    failures=settings.mssql_breaker_failures,
+    reset_timeout=settings.mssql_breaker_reset
+)
+
+
+def create_connection() -> Union[pyodbc.Connection, pymssql.Connection]:
+    """ using next() to return connection itself; retried with backoff,
+    fails fast (CircuitOpen) while DB is down
+    """
+
+    return retry_call(
+        lambda: (
+            next(get_odbc_connection())
+            if settings.mssql_driver == 'pyodbc'
+            else next(get_mssql_connection(as_dict=False))  # tuples: see common.db.rows
+        ),
+        retry_on=driver_errors(),
+        policy=db_retry,
+        breaker=db_breaker
+    )
+
+
+@lru_cache(maxsize=1)
+def get_pool() -> ConnectionPool:
+    """ one pool per process (first borrow opens min_size connections):
+    pool resets itself in forked child
+    """
 
-    return (
-        next(get_odbc_connection())
-        if settings.mssql_driver == 'pyodbc'
-        else next(get_mssql_connection())
+    pool = ConnectionPool(
+        create_connection,
+        min_size=settings.mssql_pool_min_size,
+        max_size=settings.mssql_pool_max_size,
+        max_age=settings.mssql_pool_max_age,
+        check_idle=settings.mssql_pool_check_idle,
+        timeout=settings.mssql_pool_timeout
     )
+    pool.fill()
+
+    return pool
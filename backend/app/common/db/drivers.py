@@ -0,0 +1,55 @@
+"""
+MSSQL driver chosen by settings.mssql_driver is imported on first use only:
+importing repositories must not load pyodbc (unixODBC) or pymssql (FreeTDS)
+"""
+import importlib
+import re
+from functools import lru_cache
+from types import ModuleType
+from typing import Any, Tuple
+
+from common.config.settings import settings
+
+PYODBC = "pyodbc"
+PYMSSQL_DISCONNECT = {20003, 20006, 20009, 20047}  # DB-Lib: timeout, write / read failed, dead connection
+PYODBC_DISCONNECT = {"08S01", "08001"}  # SQLSTATE: communication link failure, unable to connect
+DB_LIB_ERROR = re.compile(r"DB-Lib error message (\d+)")
+
+
+@lru_cache(maxsize=None)
+def get_driver(name: str = settings.mssql_driver) -> ModuleType:
+    return importlib.import_module(name)
+
+
+def is_pyodbc(obj: Any) -> bool:
+    """ pyodbc object (Connection, Cursor, Row) w/o importing pyodbc: its C types live in 'pyodbc' module """
+
+    return type(obj).__module__ == PYODBC
+
+
+def driver_errors() -> Tuple[type, ...]:
+    """ usage: except driver_errors() as e: (evaluated when exception raised) """
+
+    return get_driver().Error,
+
+
+def disconnect_errors() -> Tuple[type, ...]:
+    """ error classes of lost connection: see is_disconnect (OperationalError covers deadlocks too) """
+
+    return get_driver().OperationalError,
+
+
+def is_disconnect(e: BaseException) -> bool:
+    """ lost / refused connection only: deadlock, truncation, conversion errors are not retried
+
+    pymssql: (DB-Lib error number, message), pyodbc: (SQLSTATE, message)
+    """
+
+    code = e.args[0] if e.args else None
+    if isinstance(code, int):
+        return code in PYMSSQL_DISCONNECT
+    if isinstance(code, str) and code in PYODBC_DISCONNECT:
+        return True
+    text = " ".join(a.decode(errors="replace") if isinstance(a, bytes) else str(a) for a in e.args)
+
+    return any(int(n) in PYMSSQL_DISCONNECT for n in DB_LIB_ERROR.findall(text))
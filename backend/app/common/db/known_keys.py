@@ -0,0 +1,150 @@
+"""
+Process level set of primary keys known to exist in table: existence checks of
+lookup entities (persons, places) resolve in memory, DB is asked for new keys only.
+
+Keys written in transaction are added after its commit (rolled back keys are never
+known); deleted keys are removed at once. Table is seeded once if it is not bigger
+than max_size, otherwise keys are learned from writes only.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Callable, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+_tx = threading.local()
+
+
+class PendingKeys(list):
+    """ (KnownKeys, keys) written by current transaction of thread & callbacks run after its commit """
+
+    def __init__(self):
+        super().__init__()
+        self.callbacks: List[Callable[[], None]] = []
+
+    def keys_of(self, known: "KnownKeys") -> Set[Hashable]:
+        return {k for owner, keys in self if owner is known for k in keys}
+
+    def on_commit(self, callback: Callable[[], None]):
+        """ ex. cache invalidation: readers do not see written rows before commit """
+
+        self.callbacks.append(callback)
+
+    def commit(self):
+        for known, keys in self:
+            known.add(keys)
+        for callback in self.callbacks:
+            callback()
+        self.rollback()
+
+    def rollback(self):
+        self.clear()
+        self.callbacks.clear()
+
+
+@contextmanager
+def transaction_keys() -> Iterator[PendingKeys]:
+    """ nested transaction joins outer one: every commit publishes keys written so far """
+
+    if (pending := getattr(_tx, "pending", None)) is not None:
+        yield pending
+        return
+
+    _tx.pending = pending = PendingKeys()
+    try:
+        yield pending
+    finally:
+        _tx.pending = None
+
+
+def current_pending() -> Optional[PendingKeys]:
+    return getattr(_tx, "pending", None)
+
+
+class KnownKeys:
+    """ usage:
+
+        known.seed(count=count_rows, load=keys_from_table)
+        new_keys = known.unknown(keys)          # DB is checked / written for new_keys only
+        known.add_after_commit(new_keys)
+    """
+
+    def __init__(self, name: str, max_size: int = 200000):
+        self.name = name
+        self.max_size = max_size
+        self.seeded = False
+        self.hits = 0
+        self.misses = 0
+        self._keys: Set[Hashable] = set()
+        self._seed_tried = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._keys
+
+    def seed(self, count: Callable[[], int], load: Callable[[], Iterable[Hashable]]):
+        """ once per process: all keys of table if it has at most max_size rows;
+        failed count / load (ex. transient DB error) is tried again by next call
+        """
+
+        with self._lock:
+            if self._seed_tried:
+                return
+            self._seed_tried = True
+
+        try:
+            if (rows := count()) > self.max_size:
+                print(f"{self.name}: {rows} rows > {self.max_size}, keys are learned from writes only")
+                return
+            keys = set(load())
+        except BaseException:
+            with self._lock:
+                self._seed_tried = False
+            raise
+
+        if (pending := current_pending()) is not None:
+            keys -= pending.keys_of(self)  # own not committed rows
+        with self._lock:
+            self._keys |= keys
+            self.seeded = True
+
+    def unknown(self, keys: Iterable[Hashable]) -> List[Hashable]:
+        keys = list(keys)
+        res = [k for k in keys if k not in self._keys]
+        self.misses += len(res)
+        self.hits += len(keys) - len(res)
+
+        return res
+
+    def add(self, keys: Iterable[Hashable]):
+        with self._lock:
+            for key in keys:
+                if len(self._keys) >= self.max_size:
+                    break
+                self._keys.add(key)
+
+    def add_after_commit(self, keys: Iterable[Hashable]):
+        """ outside transaction scope keys are not learned (commit is not seen) """
+
+        if (pending := current_pending()) is not None:
+            pending.append((self, [k for k in keys if k is not None]))
+
+    def discard(self, key: Optional[Hashable] = None):
+        """ key None: rows not known (delete by filter) """
+
+        with self._lock:
+            if key is None:
+                self._keys.clear()
+                self._seed_tried = self.seeded = False
+            else:
+                self._keys.discard(key)
+
+    def stats(self) -> Tuple[int, int]:
+        return self.hits, self.misses
+
+    def __str__(self):
+        return (
+            f"{self.name}: keys={len(self._keys)}/{self.max_size} seeded={self.seeded} "
+            f"hits={self.hits} misses={self.misses}"
+        )
@@ -1,16 +1,31 @@
+from __future__ import annotations
+
 import functools
+import json
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Generic, get_args, Union, Tuple, Optional, Dict, List, Any
+from typing import TYPE_CHECKING, Generic, get_args, Union, Tuple, Optional, Dict, List, Any, Callable, Iterator, NamedTuple
 
-import pymssql
-import pyodbc
 from fastapi_utils.api_model import PYDANTIC_VERSION, APIModel
 from fastapi_utils.camelcase import camel2snake
 from pydantic.tools import parse_obj_as
 
 from common.config import T
-from common.db.connect_sql import get_connection
+from common.config.settings import settings
+from common.db.cache import EntityCache, MISSING
+from common.db.known_keys import KnownKeys, current_pending, transaction_keys
+from common.db.connect_sql import get_pool, db_retry
+from common.db.pool import NoConnectionBorrowed
+from common.db.drivers import is_pyodbc, is_disconnect, driver_errors, disconnect_errors
 from common.db.json_to_sql import JsonToSQL
+from common.db.retry import retry_call
+from common.db.rows import RowSet, concat_rows, cursor_columns
+from common.db.sql_params import (
+    ParamSQL, ParamStatement, param_marker, param_value, annotation_sql_type, chunk_rows, chunk_size, quote_name,
+    largest_in, split_in, ACTION_FIELD, KEYS_TABLE, MERGE_INSERT, MERGE_UPDATE, TOTAL_FIELD
+)
 from common.db.utils import (
     get_repository_for_model, APIModelSQL, COUNT_FIELD, NUM_UPDATE_FIELD,
     DB_PRIMARY_KEY, SQL_REPOSITORY_POSTFIX, DEFAULT_DB_NAME_SPACE
@@ -19,6 +34,14 @@ from common.db.utils import (
 FOREIGN_KEY = "foreign_key"
 PRIMARY_KEY = "primary_key"
 QUERY_FIELD = "filter"
+INSERTED_FIELD = "inserted"
+UPDATED_FIELD = "updated"
+
+_registry_lock = threading.Lock()
+
+if TYPE_CHECKING:
+    import pymssql
+    import pyodbc
 
 
 def reconnect_on_exception(func):
@@ -41,34 +64,41 @@ def reconnect_on_exception(func):
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         """ it wrapped method of class: self always present """
-        while True:
-            try:
-                data = func(self, *args, **kwargs)
-            except pyodbc.OperationalError as e:
-                # must be wrapper with @lru_cache decorator
-                get_connection.cache_clear()
-                self.client = get_connection()
-            else:
-                break
-
-        return data
+        with self.borrow():
+            # only connection of this thread is replaced; backoff between attempts
+            return retry_call(
+                lambda: func(self, *args, **kwargs),
+                retry_on=disconnect_errors(),
+                retry_if=is_disconnect,
+                policy=db_retry,
+                on_retry=lambda e: get_pool().replace()
+            )
 
     return wrapper
 
 
 def with_transaction(func):
-    """ Decorator for wrap DB transaction with rollback()/commit() """
+    """ Decorator for wrap DB transaction with rollback()/commit()
+    keys written by transaction are known (known_keys_index) after commit only
+    """
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
-        try:
-            data = func(self, *args, **kwargs)
-        except (pymssql.Error, pyodbc.Error) as e:
-            self.client.rollback()
-            print(str(e))
-            raise CrudDataMSSQLError(str(e)) from e
-        else:
-            self.client.commit()
-            return data
+        with self.borrow(), transaction_keys() as pending:
+            try:
+                data = func(self, *args, **kwargs)
+            except driver_errors() as e:
+                try:
+                    self.client.rollback()
+                except (NoConnectionBorrowed, *driver_errors()) as rollback_error:
+                    # connection was not replaced (reconnect failed): original error is reported
+                    print(f"Rollback failed: {rollback_error}")
+                pending.rollback()
+                print(str(e))
+                raise CrudDataMSSQLError(str(e)) from e
+            else:
+                self.client.commit()
+                pending.commit()
+                return data
 
     return wrapper
 
@@ -77,22 +107,113 @@ class CrudDataMSSQLError(Exception):
     """ raise this exception for all CRUD data incompatibility """
 
 
+class KeysetPage(NamedTuple):
+    data: List
+    count: int
+    after: Optional[Tuple]  # cursor of next page, None: last page
+
+
+@dataclass(frozen=True)
+class ModelPlan:
+    """ per model class metadata: write path does not scan model_fields per row
+
+    foreign_keys: 1:M field -> foreign key field of child model (excluded on create)
+    converted: field with nested model -> its primary key (stored as value)
+    """
+
+    foreign_keys: Dict[str, str]
+    converted: Dict[str, str]
+
+
+@functools.lru_cache(maxsize=None)
+def get_model_plan(model: type) -> ModelPlan:
+    foreign_keys, converted = {}, {}
+    for field, info in model.model_fields.items():
+        if not info.json_schema_extra:
+            continue
+        if fk := info.json_schema_extra.get(FOREIGN_KEY, None):
+            foreign_keys[field] = fk
+        if pk := info.json_schema_extra.get(PRIMARY_KEY, None):
+            converted[field] = pk
+
+    return ModelPlan(foreign_keys=foreign_keys, converted=converted)
+
+
+@functools.lru_cache(maxsize=None)
+def get_repository_for_model_class(model: type) -> RepositoryMSSQL:
+    """ shared repository instance of model class (ex. nested / 1:M field data) """
+
+    repository = get_repository_for_model(
+        model_type=model.__name__,
+        prefix='',
+        plugin=model.__module__.replace("_sql", "")
+    )
+
+    return repository.shared()
+
+
 class RepositoryMSSQL(Generic[T]):
-    """ base model for MS SQL DB: pip install pymssql """
+    """ base model for MS SQL DB: pip install pymssql
+
+    Model, columns & statements are resolved once per class (__init_subclass__);
+    shared() returns one instance per class: repository keeps no connection state
+    """
 
     model: APIModelSQL
+    plan: ModelPlan
+    param_sql: ParamSQL
 
     excluded_fields: set = {}
     name_space: str = DEFAULT_DB_NAME_SPACE
     table_prefix: str = ''
     primary_key = DB_PRIMARY_KEY
     pk_remove_on_create = True  # if pk is incremental / not defined externally
+    bulk_insert: bool = settings.mssql_bulk_insert  # create_many_with_cursor engine
+    param_queries: bool = settings.mssql_param_sql  # CRUD by ParamSQL templates
+    cache_view: bool = False  # view() by primary key through EntityCache (reference data)
+    cache: Optional[EntityCache] = None
+    known_keys_index: bool = False  # existing primary keys in memory: upsert w/o update sends new rows only
+    known_keys: Optional[KnownKeys] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        for base in cls.__dict__.get("__orig_bases__", ()):
+            if (args := get_args(base)) and isinstance(args[0], type):
+                cls.model = args[0]  # Magic
+                break
+        if not isinstance(getattr(cls, "model", None), type):
+            return  # generic intermediate class
+
+        cls.plan = get_model_plan(cls.model)
+        cls.param_sql = ParamSQL(
+            table=cls.full_table_name(),
+            primary_key=cls.primary_key,
+            columns=cls.sql_columns(),
+            types=cls.sql_column_types()
+        )
+        if cls.cache_view:
+            cls.cache = EntityCache(
+                cls.__name__,
+                max_size=settings.mssql_view_cache_size,
+                ttl=settings.mssql_view_cache_ttl
+            )
+        if cls.known_keys_index:
+            cls.known_keys = KnownKeys(cls.__name__, max_size=settings.mssql_known_keys_max)
+
+    @classmethod
+    def shared(cls) -> RepositoryMSSQL:
+        if (instance := cls.__dict__.get("_shared")) is None:
+            with _registry_lock:
+                if (instance := cls.__dict__.get("_shared")) is None:
+                    instance = cls()
+                    cls._shared = instance
+
+        return instance
 
     def __init__(self):
         super(RepositoryMSSQL, self).__init__()
 
-        self.client: Union[pyodbc.Connection, pymssql.Connection] = get_connection()
-        self.model = get_args(self.__orig_bases__[0])[0]  # Magic
         self.json_to_sql = JsonToSQL(
             self,
             name_space=self.name_space,
@@ -101,6 +222,56 @@ class RepositoryMSSQL(Generic[T]):
             primary_key=self.primary_key,
             pk_remove_on_create=self.pk_remove_on_create
         )
+        self._counts: Dict[str, Tuple[float, int]] = {}  # filter -> (expires_at, count)
+        self._counts_lock = threading.Lock()  # shared() instance is used by all threads
+
+    @classmethod
+    def sql_columns(cls) -> List[str]:
+        """ table columns: model fields w/o excluded (1:M) fields & auto increment pk """
+
+        return [
+            field for field in cls.model.model_fields
+            if field not in cls.excluded_fields
+            and not (cls.pk_remove_on_create and field == cls.primary_key)
+        ]
+
+    @property
+    def client(self) -> Union[pyodbc.Connection, pymssql.Connection]:
+        """ connection borrowed by current thread: see borrow() """
+
+        return get_pool().current()
+
+    @staticmethod
+    def borrow():
+        """ with self.borrow() as client: same connection for nested repository calls in thread """
+
+        return get_pool().borrow()
+
+    @classmethod
+    def sql_column_types(cls) -> Dict[str, str]:
+        """ sp_executesql parameter types of columns """
+
+        return {
+            field: annotation_sql_type(info.annotation)
+            for field, info in cls.model.model_fields.items()
+            if field not in cls.excluded_fields
+        }
+
+    def param_statement(self, operation: str, *args, **kwargs) -> Optional[ParamStatement]:
+        """ ParamSQL statement: select / insert / update / delete
+
+        :return: None if disabled or query not supported: JsonToSQL must be used
+        """
+        if not self.param_queries:
+            return None
+
+        return getattr(self.param_sql, operation)(*args, marker=self.driver_param_marker(), **kwargs)
+
+    @staticmethod
+    def driver_param_marker() -> str:
+        """ driver paramstyle: without borrowing connection """
+
+        return "?" if settings.mssql_driver == "pyodbc" else "%s"
 
     @staticmethod
     def _set_context(user_id: int, stp_exec: str = 'story_api_set_context') -> str:
@@ -135,26 +306,34 @@ class RepositoryMSSQL(Generic[T]):
     @staticmethod
     def _fetch_one(cursor: Union[pymssql.Cursor, pyodbc.Cursor]) -> Optional[Dict]:
         data = cursor.fetchone()
-        if data and isinstance(data, pyodbc.Row):
-            columns = [c[0] for c in cursor.description]
-            data = dict(zip(columns, data))
+        if data and not isinstance(data, dict):
+            data = dict(zip(cursor_columns(cursor), data))
 
         return data
 
     @staticmethod
-    def _fetch_all(cursor: Union[pymssql.Cursor, pyodbc.Cursor]) -> Optional[List]:
+    def _fetch_all(cursor: Union[pymssql.Cursor, pyodbc.Cursor]) -> Optional[Union[RowSet, List[Dict]]]:
+        """ RowSet: rows as fetched (pyodbc.Row, pymssql tuple), as_dict connection: list of dicts """
+
         data = cursor.fetchall()
-        if data and isinstance(data, list) and isinstance(data[0], pyodbc.Row):
-            columns = [c[0] for c in cursor.description]
-            data = [dict(zip(columns, dt)) for dt in data]
+        if data and not isinstance(data[0], dict):
+            data = RowSet.from_cursor(cursor, data)
 
         return data
 
+    def _parse_all(self, data: Optional[Union[RowSet, List[Dict]]]) -> List[T]:
+        if isinstance(data, RowSet):
+            return data.models(self.model)
+
+        return parse_obj_as(list[self.model], data or [])
+
     @staticmethod
-    def _cursor_execute(sql_query, cursor, multi=False, sql_div=';'):
-        """ pyodbc can't execute multiple query at a time """
+    def _cursor_execute(sql_query, cursor, multi=False, sql_div=';', params: Optional[Tuple] = None):
+        """ pyodbc can't execute multiple query at a time: except one sp_executesql call """
 
-        if (isinstance(cursor.connection, pyodbc.Connection) and multi
+        if params is not None:
+            cursor.execute(sql_query, params)
+        elif (is_pyodbc(cursor.connection) and multi
                 and sql_div in sql_query):
 
             # TODO: try find better solution
@@ -168,7 +347,7 @@ class RepositoryMSSQL(Generic[T]):
     @staticmethod
     def _get_foreign_key(data: APIModelSQL, field: str) -> str:
         if PYDANTIC_VERSION[0] == "2":
-            return data.model_fields[field].json_schema_extra.get(FOREIGN_KEY, None)
+            return get_model_plan(type(data)).foreign_keys.get(field, None)
         else:
             # deprecated
             return data.__fields__[field].field_info.extra.get(FOREIGN_KEY, None)
@@ -182,13 +361,7 @@ class RepositoryMSSQL(Generic[T]):
     def _get_excluded_fields_data(data: T) -> Dict:
         """ helper for get APIModelSQL from fields """
 
-        exclude_fields = {
-            field for field, val in data.model_fields.items()
-            if val.json_schema_extra and val.json_schema_extra.get(FOREIGN_KEY, None)
-        }
-        exclude_data = {key: getattr(data, key) for key in exclude_fields}
-
-        return exclude_data  # ignore
+        return {key: getattr(data, key) for key in get_model_plan(type(data)).foreign_keys}
 
     def _apply_excluded_fields_data(
             self,
@@ -209,16 +382,11 @@ class RepositoryMSSQL(Generic[T]):
                 ex_data_elem = ex_data[0]
             else:
                 ex_data = [ex_data]
-            repository = get_repository_for_model(
-                model_type=ex_data_elem.__class__.__name__,
-                prefix='',
-                plugin=self._get_field_plugin(ex_data_elem)
-            )
+            repos = get_repository_for_model_class(type(ex_data_elem))
             foreign_key = self._get_foreign_key(source_data, field)
 
             # ex_data does not have fk objects
-            if self._get_excluded_fields_data(ex_data_elem):
-                repos = repository()
+            if get_model_plan(type(ex_data_elem)).foreign_keys:
                 for data in ex_data:
                     e_data = self._get_excluded_fields_data(data)
                     setattr(data, foreign_key, res[self.primary_key] or getattr(source_data, foreign_key))
@@ -231,7 +399,7 @@ class RepositoryMSSQL(Generic[T]):
                             cursor=cursor
                         )
             else:
-                result = repository().create_many_with_cursor(
+                result = repos.create_many_with_cursor(
                     data=ex_data,
                     query={foreign_key: res[self.primary_key] or getattr(source_data, foreign_key)},
                     cursor=cursor
@@ -256,15 +424,9 @@ class RepositoryMSSQL(Generic[T]):
                 continue
 
             ex_data_elem = ex_data[0] if isinstance(ex_data, list) else ex_data
-            repository = get_repository_for_model(
-                model_type=ex_data_elem.__class__.__name__,
-                prefix='',
-                plugin=self._get_field_plugin(ex_data_elem)
-            )
-
+            repos = get_repository_for_model_class(type(ex_data_elem))
             foreign_key = self._get_foreign_key(source_data, field)
             query = {foreign_key: res[self.primary_key]}
-            repos = repository()
             if isinstance(ex_data, list):
                 repos.delete_with_cursor(query=query, cursor=cursor)
                 result = repos.create_many_with_cursor(
@@ -296,21 +458,15 @@ class RepositoryMSSQL(Generic[T]):
     def _get_converted_fields_data(data: T) -> Dict:
         """ helper for get APIModelSQL from fields """
 
-        exclude_fields = {
-            field for field, val in data.model_fields.items()
-            if val.json_schema_extra and val.json_schema_extra.get(PRIMARY_KEY)
-        }
-        exclude_data = {key: getattr(data, key) for key in exclude_fields}
-
-        return exclude_data  # ignore
+        return {key: getattr(data, key) for key in get_model_plan(type(data)).converted}
 
     @staticmethod
     def _set_converted_field_data(data: T, convert_data: Dict):
+        converted = get_model_plan(type(data)).converted
         for field, c_d in convert_data.items():
             if c_d is None or isinstance(c_d, (int, str)):
                 continue
-            key = data.model_fields.get(field).json_schema_extra.get(PRIMARY_KEY)
-            setattr(data, field, getattr(c_d, key))
+            setattr(data, field, getattr(c_d, converted[field]))
 
     def select_insert_with_cursor(self, data: T, cursor: Union[pymssql.Cursor, pyodbc.Cursor]):
         res = self.view({self.primary_key: getattr(data, self.primary_key)})
@@ -360,45 +516,42 @@ class RepositoryMSSQL(Generic[T]):
         for key, c_data in convert_data.items():
             if isinstance(c_data, (str, int)):
                 continue
-            repository = get_repository_for_model(
-                model_type=c_data.__class__.__name__,
-                prefix='',
-                plugin=self._get_field_plugin(c_data)
-            )
-            repos = repository()
+            repos = get_repository_for_model_class(type(c_data))
             rs = repos.select_insert_with_cursor(c_data, cursor)
             res.append(rs)
 
         return res
 
     @reconnect_on_exception
-    def exec_fetch_one(self, sql_query: str) -> Dict:
+    def exec_fetch_one(self, sql_query: str, params: Optional[Tuple] = None) -> Dict:
         """ for pymssql.Connection client """
 
         with self.client.cursor() as cursor:
             self._cursor_execute(
                 sql_query,
                 cursor,
-                multi=True
+                multi=True,
+                params=params
             )
             data = self._fetch_one(cursor)
 
         return data  # ignore
 
-    def exec_fetch_one_parse(self, sql_query: str) -> Optional[T]:
-        data = self.exec_fetch_one(sql_query=sql_query)
+    def exec_fetch_one_parse(self, sql_query: str, params: Optional[Tuple] = None) -> Optional[T]:
+        data = self.exec_fetch_one(sql_query=sql_query, params=params)
 
         return self.model.model_validate(data) if data else None
 
     @reconnect_on_exception
-    def exec_fetch_all(self, sql_query: str) -> List[Dict]:
+    def exec_fetch_all(self, sql_query: str, params: Optional[Tuple] = None) -> List[Dict]:
         """ for pymssql.Connection client """
 
         with self.client.cursor() as cursor:
             self._cursor_execute(
                 sql_query,
                 cursor,
-                multi=True
+                multi=True,
+                params=params
             )
             data = self._fetch_all(cursor)
 
@@ -407,14 +560,35 @@ class RepositoryMSSQL(Generic[T]):
     def index(self, **kwargs) -> Union[list[T], Tuple]:
         """ change kwargs[QUERY_FIELD] to kwargs["query"] """
 
+        if set(kwargs) <= {QUERY_FIELD} and (rows := self.select_large_in(kwargs.get(QUERY_FIELD) or {})) is not None:
+            return self._parse_all(rows)
+
+        if set(kwargs) <= {QUERY_FIELD} and (
+                statement := self.param_statement("select", kwargs.get(QUERY_FIELD) or {})
+        ):
+            return self._parse_all(self.exec_fetch_all(*statement))
+
+        if {'skip', 'limit'} <= set(kwargs) <= {QUERY_FIELD, 'skip', 'limit'} and (
+                statement := self.param_statement(
+                    "page", kwargs.get(QUERY_FIELD) or {},
+                    limit=kwargs['limit'], skip=kwargs['skip'], total=True
+                )
+        ):
+            # page & total in one round trip
+            rows = self.exec_fetch_all(*statement) or []
+            count = self._get_total(rows)
+            if count is None:
+                count = self.total(kwargs.get(QUERY_FIELD) or {}) if kwargs['skip'] else 0
+
+            return self._parse_all(rows), count
+
         sql_query, sl_count_query = self.json_to_sql.get_mssql_select_count(
             query=kwargs.get(QUERY_FIELD, {}),
             **{k: v for k, v in kwargs.items() if k != QUERY_FIELD},
             primary_key=self.primary_key
         )
 
-        data = self.exec_fetch_all(sql_query)
-        data = parse_obj_as(list[self.model], data)
+        data = self._parse_all(self.exec_fetch_all(sql_query))
 
         if 'skip' in kwargs and 'limit' in kwargs:
             result = self.exec_fetch_one(sl_count_query)
@@ -423,6 +597,200 @@ class RepositoryMSSQL(Generic[T]):
 
         return data
 
+    def select_large_in(
+            self,
+            query: Dict,
+            count: bool = False,
+            columns: Tuple[str, ...] = ()
+    ) -> Optional[Union[RowSet, List[Dict]]]:
+        """ filter with $in list longer than mssql_in_chunk_size (MSSQL parameters limit):
+        longer than mssql_in_table_min - values staged in session temp table & one join query,
+        otherwise one query per chunk of values. count: COUNT_FIELD row per query
+
+        Parameterized even if param_queries is off: JsonToSQL literal list does not scale
+        :return: None if query has no long $in list or it is not supported (JsonToSQL)
+        """
+
+        if (largest := largest_in(query)) is None:
+            return None
+        field, values = largest
+        if len(values) <= settings.mssql_in_chunk_size:
+            return None
+        if len(values) > settings.mssql_in_table_min:
+            return self._select_in_table(query, field, values, count=count, columns=columns)
+
+        marker = self.driver_param_marker()
+        statements = [
+            self.param_sql.select(sub_query, marker, count=count, columns=columns)
+            for sub_query in split_in(query, field, values, settings.mssql_in_chunk_size)
+        ]
+        if None in statements:
+            return None
+
+        return concat_rows(self.exec_fetch_all(*statement) for statement in statements)
+
+    @reconnect_on_exception
+    def _select_in_table(
+            self,
+            query: Dict,
+            field: str,
+            values: List,
+            count: bool = False,
+            columns: Tuple[str, ...] = ()
+    ) -> Optional[Union[RowSet, List[Dict]]]:
+        """ $in values of field in KEYS_TABLE: pyodbc - one fast_executemany insert,
+        pymssql - multi rows insert chunked by MSSQL limits. Temp table lives in borrowed connection
+        """
+
+        marker = self.driver_param_marker()
+        if (statement := self.param_sql.select(query, marker, count=count, columns=columns, in_table=field)) is None:
+            return None
+
+        rows = [(param_value(v),) for v in values]
+        with self.client.cursor() as cursor:
+            cursor.execute(self.param_sql.keys_table(field))
+            if is_pyodbc(cursor):
+                cursor.fast_executemany = True
+                cursor.executemany(ParamSQL.keys_insert(1, marker), rows)
+            else:
+                for chunk in chunk_rows(rows, 1):
+                    cursor.execute(ParamSQL.keys_insert(len(chunk), marker), tuple(row[0] for row in chunk))
+            cursor.execute(*statement)
+            data = self._fetch_all(cursor)
+            cursor.execute(f"DROP TABLE {KEYS_TABLE};")
+
+        return data
+
+    def iter_rows(
+            self,
+            sql_query: str,
+            params: Optional[Tuple] = None,
+            array_size: int = settings.mssql_fetch_size
+    ) -> Iterator[Dict]:
+        """ rows read by fetchmany() on own pool connection: memory does not depend on result size,
+        repositories may be used by consumer meanwhile (borrowed connection is not busy).
+
+        Connection is released when iterator is exhausted or closed; if consumer stops early
+        the rest of result set is not read: connection is closed instead of reused.
+        """
+
+        pool = get_pool()
+        pooled = pool.acquire()
+        exhausted = False
+        try:
+            with pooled.connection.cursor() as cursor:
+                self._cursor_execute(sql_query, cursor, multi=True, params=params)
+                columns = None
+                while rows := cursor.fetchmany(array_size):
+                    if not isinstance(rows[0], dict):
+                        columns = columns or cursor_columns(cursor)
+                        rows = (dict(zip(columns, row)) for row in rows)
+                    yield from rows
+            exhausted = True
+        finally:
+            pool.release(pooled, broken=not exhausted)
+
+    def iter_index(
+            self,
+            query: Optional[Dict] = None,
+            array_size: int = settings.mssql_fetch_size
+    ) -> Iterator[T]:
+        """ same as index(filter=query), model by model: usage
+
+            for bill in BillsRepositorySQL.shared().iter_index({"place_id": place_id}):
+                if ...:
+                    break   # not read rows are not fetched
+        """
+
+        query = query or {}
+        if not (statement := self.param_statement("select", query)):
+            sql_query, _ = self.json_to_sql.get_mssql_select_count(query=query, primary_key=self.primary_key)
+            statement = ParamStatement(sql_query)
+
+        return (self.model.model_validate(row) for row in self.iter_rows(*statement, array_size=array_size))
+
+    @staticmethod
+    def _get_total(rows: Union[RowSet, List[Dict]]) -> Optional[int]:
+        """ window count of page query: same value in every row (extra field for model) """
+
+        return rows[0][TOTAL_FIELD] if rows else None
+
+    @staticmethod
+    def _count_key(query: Dict) -> str:
+        return json.dumps(query, sort_keys=True, default=str)
+
+    def cached_count(self, query: Dict) -> Optional[int]:
+        key = self._count_key(query)
+        with self._counts_lock:
+            cached = self._counts.get(key)
+        if cached is None or cached[0] < time.monotonic():
+            return None
+
+        return cached[1]
+
+    def cache_count(self, query: Dict, count: int):
+        key = self._count_key(query)
+        with self._counts_lock:
+            if len(self._counts) >= settings.mssql_count_cache_size:
+                self._counts.pop(next(iter(self._counts), None), None)
+            self._counts[key] = (time.monotonic() + settings.mssql_count_cache_ttl, count)
+
+    def total(self, query: Optional[Dict] = None) -> int:
+        """ count() of filter, cached for mssql_count_cache_ttl sec: pages of the same filter """
+
+        query = query or {}
+        if (count := self.cached_count(query)) is None:
+            count = self.count(**{QUERY_FIELD: query})
+            self.cache_count(query, count)
+
+        return count
+
+    def index_keyset(
+            self,
+            query: Optional[Dict] = None,
+            limit: int = 100,
+            after: Optional[Tuple] = None,
+            sort_key: Optional[str] = None,
+            descending: bool = False
+    ) -> KeysetPage:
+        """ seek pagination: every page costs the same (index seek), no matter how deep it is. usage:
+
+            page = repos.index_keyset(query, limit=1000)
+            while page.after is not None:
+                page = repos.index_keyset(query, limit=1000, after=page.after)
+
+        :param sort_key: order by (sort_key, primary_key) instead of primary_key
+        :return: page.count: total of filter by window count of the first page, cached for next ones
+        :raise ValueError: filter is not supported by parameterized query
+        """
+
+        query = query or {}
+        keys = (self.primary_key,) if sort_key in (None, self.primary_key) else (sort_key, self.primary_key)
+        count = self.cached_count(query)
+        statement = self.param_sql.page(
+            query,
+            marker=self.driver_param_marker(),
+            limit=limit,
+            after=after or (),
+            keys=keys,
+            descending=descending,
+            total=count is None and not after
+        )
+        if statement is None:
+            raise ValueError(f"{query=} is not supported by keyset pagination")
+
+        rows = self.exec_fetch_all(*statement) or []
+        if (total := self._get_total(rows)) is not None:
+            self.cache_count(query, count := total)
+        elif count is None:
+            count = 0 if not after and not rows else self.total(query)
+
+        return KeysetPage(
+            data=self._parse_all(rows),
+            count=count,
+            after=tuple(rows[-1][k] for k in keys) if len(rows) == limit else None
+        )
+
     def _get_key_dict(self, query: Union[str, int, dict]) -> Dict:
         """ convert key as syt or dict to dict with one key """
 
@@ -433,10 +801,83 @@ class RepositoryMSSQL(Generic[T]):
 
         return query
 
+    def _cache_key(self, query: Dict) -> Optional[Union[str, int]]:
+        """ primary key value if query is by primary key only """
+
+        if len(query) == 1 and isinstance(value := query.get(self.primary_key), (str, int)):
+            return value
+
+        return None
+
+    def invalidate_cache(self, data: Optional[Union[T, Dict]] = None, query: Optional[Union[str, int, Dict]] = None):
+        """ write of the row(s): key of query / data, whole cache if row is not known.
+        Invalidated again after commit: concurrent reader may cache old row before it
+        """
+
+        if self.cache is None:
+            return
+        key = None
+        if query is not None:
+            query = self._get_key_dict(query)
+            key = self._cache_key(query) if isinstance(query, dict) else getattr(query, self.primary_key, None)
+        elif data is not None:
+            key = data.get(self.primary_key) if isinstance(data, dict) else getattr(data, self.primary_key, None)
+        self.cache.invalidate(key)
+        if (pending := current_pending()) is not None:
+            pending.on_commit(functools.partial(self.cache.invalidate, key))
+
+    def _data_key(self, data: Union[T, Dict]) -> Any:
+        return data.get(self.primary_key) if isinstance(data, dict) else getattr(data, self.primary_key, None)
+
+    def seed_known_keys(self):
+        """ once per process: all primary keys of table if it is not bigger than mssql_known_keys_max """
+
+        if self.known_keys is None:
+            return
+        sql_query = f"SELECT {quote_name(self.primary_key)} FROM {self.full_table_name()}"
+        self.known_keys.seed(
+            count=self.count,
+            load=lambda: (row[self.primary_key] for row in self.exec_fetch_all(sql_query) or [])
+        )
+
+    def learn_keys(self, data: List[Union[T, Dict]]):
+        """ written rows: keys are known after commit of current transaction """
+
+        if self.known_keys is not None:
+            self.known_keys.add_after_commit(self._data_key(d) for d in data)
+
+    def forget_keys(self, data: Optional[Union[T, Dict]] = None, query: Optional[Union[str, int, Dict]] = None):
+        """ deleted row(s): key of query / data, all keys if rows are not known """
+
+        if self.known_keys is None:
+            return
+        key = None
+        if query is not None:
+            query = self._get_key_dict(query)
+            key = self._cache_key(query) if isinstance(query, dict) else getattr(query, self.primary_key, None)
+        elif data is not None:
+            key = self._data_key(data)
+        self.known_keys.discard(key)
+
     def view(self, query: Union[str, int, dict]) -> Optional[T]:
-        """ if primary key _id - str; if primary other than _id: dict """
+        """ if primary key _id - str; if primary other than _id: dict
+        cache_view: read through cache by primary key (copy of cached model)
+        """
 
         query = self._get_key_dict(query)
+        if self.cache is None or (key := self._cache_key(query)) is None:
+            return self._view(query)
+        if (data := self.cache.get(key)) is MISSING:
+            if (data := self._view(query)) is None:
+                return None  # not cached: row may be created by other process
+            self.cache.put(key, data)
+
+        return data.model_copy()
+
+    def _view(self, query: Dict) -> Optional[T]:
+        if statement := self.param_statement("select", query):
+            return self.exec_fetch_one_parse(*statement)
+
         sql_query, _ = self.json_to_sql.get_mssql_select_count(
             query=query,
             primary_key=self.primary_key
@@ -456,12 +897,20 @@ class RepositoryMSSQL(Generic[T]):
 
         return sql_query
 
+    def _create_statement(self, data: Union[T, Dict]) -> ParamStatement:
+        raw_data = data if isinstance(data, dict) else data.model_dump()
+
+        return self.param_statement("insert", raw_data) or ParamStatement(self._create_sql_query(data))
+
     def create_with_cursor(self, data: Union[T, Dict], cursor: Union[pymssql.Cursor, pyodbc.Cursor]):
-        sql_query = self._create_sql_query(data)
+        self.invalidate_cache(data)
+        self.learn_keys([data])
+        sql_query, params = self._create_statement(data)
         self._cursor_execute(
             sql_query,
             cursor,
-            multi=True
+            multi=True,
+            params=params
         )
         data = self._fetch_one(cursor)
 
@@ -469,9 +918,10 @@ class RepositoryMSSQL(Generic[T]):
 
     @with_transaction
     def create(self, data: Union[T, Dict]) -> Dict:
-        sql_query = self._create_sql_query(data)
-        sql_query = self.sql_before_execute(sql_query)
-        data = self.exec_fetch_one(sql_query=sql_query)
+        self.invalidate_cache(data)
+        self.learn_keys([data])
+        sql_query, params = self._before_execute(self._create_statement(data))
+        data = self.exec_fetch_one(sql_query=sql_query, params=params)
 
         return data
 
@@ -481,44 +931,33 @@ class RepositoryMSSQL(Generic[T]):
         return exclude_data
 
     def converted_select_insert_batch(self, converted_data: Dict, cursor):
+        """ insert not existing pk objects (ex. persons): one statement, existing skipped
+        (known_keys_index: keys stored by previous pages are not sent at all)
+        """
         # from field to class name
         res = {}
         for class_name, c_data_list in converted_data.items():
             c_data = c_data_list[0]
-            repository = get_repository_for_model(
-                model_type=c_data.__class__.__name__,
-                prefix='',
-                plugin=self._get_field_plugin(c_data)
+            rs = get_repository_for_model_class(type(c_data)).upsert_many_with_cursor(
+                data=c_data_list,
+                cursor=cursor,
+                update=False
             )
-            repos = repository()
-            pk = repos.primary_key
-            c_data_list_unique_ids = {getattr(c_d, pk) for c_d in c_data_list}
-            ids_in_db = repos._batch_exists_ids(c_data_list_unique_ids)
-            c_data_list_unique_ids = c_data_list_unique_ids.difference(set(ids_in_db))
-
-            # check if keys in DB by select
-            if c_data_list_unique_ids:
-                c_data_list_unique = []
-                c_data_list_unique_added = set()
-                for c_d in c_data_list:
-                    if (pk_v := getattr(c_d, pk)) and pk_v in c_data_list_unique_added:
-                        continue
-                    c_data_list_unique_added.add(pk_v)
-                    c_data_list_unique.append(c_d)
-                rs = repos.create_many_with_cursor(
-                    data=c_data_list_unique,
-                    query={},  # nothing to update
-                    cursor=cursor
-                )
-                res.update({class_name: rs})
+            res.update({class_name: rs})
 
         return res
 
     def _batch_exists_ids(self, ids: List[Union[int, str]]) -> List[Any]:
-        list_res: List[T] = self.index(filter={self.primary_key: {'$in': ids}})
-        ids = [getattr(t, self.primary_key) for t in list_res]
+        """ existing keys of ids: key column only, long lists chunked / joined with temp table """
+
+        query = {self.primary_key: {'$in': ids}}
+        columns = (self.primary_key,)
+        if (rows := self.select_large_in(query, columns=columns)) is None:
+            if not (statement := self.param_sql.select(query, self.driver_param_marker(), columns=columns)):
+                return [getattr(t, self.primary_key) for t in self.index(filter=query)]
+            rows = self.exec_fetch_all(*statement) or []
 
-        return ids
+        return [row[self.primary_key] for row in rows]
 
     def create_batch_with_cursor(self, data_batch_list: List[T], cursor):
         """ Return num rows inserted """
@@ -562,7 +1001,14 @@ class RepositoryMSSQL(Generic[T]):
 
     @with_transaction
     @reconnect_on_exception
-    def create_batch_data_apply_excluded(self, data_batch, converted_data, exclude_data):
+    def create_batch_data_apply_excluded(
+            self,
+            data_batch,
+            converted_data,
+            exclude_data,
+            with_cursor: Optional[Callable] = None
+    ):
+        """ with_cursor(cursor): extra statements in the same transaction (ex. checkpoint) """
         res = {}
         with self.client.cursor() as cursor:
             # next line keep outside of SQL API: apps specific
@@ -578,10 +1024,17 @@ class RepositoryMSSQL(Generic[T]):
                     cursor=cursor
                 )
                 res.update(rs)
+            if with_cursor is not None:
+                with_cursor(cursor)
 
         return res
 
-    def create_batch_with_fk(self, data_batch: List[T], excluded: bool = False):
+    def create_batch_with_fk(
+            self,
+            data_batch: List[T],
+            excluded: bool = False,
+            with_cursor: Optional[Callable] = None
+    ):
         exclude_data = []
         converted_data = {}
         for i, data in enumerate(data_batch):
@@ -591,10 +1044,106 @@ class RepositoryMSSQL(Generic[T]):
             self._set_converted_field_data(data_batch[i], convert_data)
             self._update_converted_data(converted_data, convert_data)
 
-        res = self.create_batch_data_apply_excluded(data_batch, converted_data, exclude_data)
+        res = self.create_batch_data_apply_excluded(
+            data_batch, converted_data, exclude_data, with_cursor=with_cursor
+        )
+
+        return res
+
+    def upsert_many_with_cursor(
+            self,
+            data: List[Union[T, Dict]],
+            cursor: Union[pymssql.Cursor, pyodbc.Cursor],
+            update: bool = False
+    ) -> Dict:
+        """ Set based insert by primary key: new rows inserted, existing skipped or updated.
+        Rows are staged & merged with HOLDLOCK: no race between concurrent workers.
+        One statement per chunk of MSSQL parameters limit.
+        known_keys_index & not update: rows with known keys are not sent (they exist)
+
+        :return: {INSERTED_FIELD: [pk, ...], UPDATED_FIELD: [pk, ...], NUM_UPDATE_FIELD: n}
+        """
+
+        # same pk twice in one MERGE is not allowed: last one wins
+        rows = list({
+            raw.get(self.primary_key): self.param_sql.row_params(raw)
+            for raw in (d if isinstance(d, dict) else d.model_dump() for d in data)
+        }.values())
+
+        result = {INSERTED_FIELD: [], UPDATED_FIELD: [], NUM_UPDATE_FIELD: 0}
+        if self.known_keys is not None and not update and self.primary_key in self.param_sql.columns:
+            self.seed_known_keys()
+            pk_index = self.param_sql.columns.index(self.primary_key)
+            unknown = set(self.known_keys.unknown(row[pk_index] for row in rows))
+            rows = [row for row in rows if row[pk_index] in unknown]
+            self.known_keys.add_after_commit(unknown)
+        marker = param_marker(cursor)
+        for chunk in chunk_rows(rows, len(self.param_sql.columns)):
+            sql_query = self.param_sql.merge_many(len(chunk), marker, update=update)
+            cursor.execute(sql_query, tuple(v for row in chunk for v in row))
+            for row in self._fetch_all(cursor) or []:
+                if row[ACTION_FIELD] == MERGE_INSERT:
+                    result[INSERTED_FIELD].append(row[self.primary_key])
+                elif row[ACTION_FIELD] == MERGE_UPDATE:
+                    result[UPDATED_FIELD].append(row[self.primary_key])
+                    self.invalidate_cache(query={self.primary_key: row[self.primary_key]})
+                result[NUM_UPDATE_FIELD] += 1
+
+        return result
+
+    @with_transaction
+    @reconnect_on_exception
+    def upsert_batch_data_apply_converted(
+            self,
+            data_batch: List[T],
+            converted_data: Dict,
+            update: bool = False,
+            with_cursor: Optional[Callable] = None
+    ) -> Dict:
+        res = {}
+        with self.client.cursor() as cursor:
+            rs = self.converted_select_insert_batch(converted_data, cursor)
+            res.update(rs)
+            rs = self.upsert_many_with_cursor(data_batch, cursor, update=update)
+            res.update(rs)
+            if with_cursor is not None:
+                with_cursor(cursor)
+
+        return res
+
+    def upsert_batch_with_fk(
+            self,
+            data_batch: List[T],
+            update: bool = False,
+            with_cursor: Optional[Callable] = None
+    ) -> Dict:
+        """ Idempotent batch create: page with already stored objects does not fail.
+        1:M (excluded) fields are not stored, same as create_batch_with_fk
+
+        :param update: update existing objects, otherwise skip them
+        :return: see upsert_many_with_cursor
+        """
+        converted_data = {}
+        for data in data_batch:
+            convert_data = self._get_converted_fields_data(data)  # primary keys
+            self._set_converted_field_data(data, convert_data)
+            self._update_converted_data(converted_data, convert_data)
+
+        res = self.upsert_batch_data_apply_converted(
+            data_batch, converted_data, update=update, with_cursor=with_cursor
+        )
 
         return res
 
+    def insert_update_batch_with_fk(self, data_batch: List[T]) -> Tuple[List, List]:
+        """ Create new objects, update existing ones by one set based statement
+
+        :return: (created primary keys, updated primary keys)
+        """
+        res = self.upsert_batch_with_fk(data_batch, update=True)
+
+        return res[INSERTED_FIELD], res[UPDATED_FIELD]
+
     @with_transaction
     @reconnect_on_exception
     def create_data_apply_excluded(self, data, exclude_data):
@@ -627,6 +1176,9 @@ class RepositoryMSSQL(Generic[T]):
             query: Dict,
             cursor: Union[pymssql.Cursor, pyodbc.Connection]
     ) -> Dict:
+        if self.bulk_insert:
+            return self.bulk_insert_with_cursor(data=data, query=query, cursor=cursor)
+
         # ODBC driver has limitation 1000 row at a time
         sql_set_list = [d.model_dump() for d in data]
         sql_query = self.json_to_sql.get_mssql_insert_many(
@@ -643,6 +1195,42 @@ class RepositoryMSSQL(Generic[T]):
 
         return result
 
+    def bulk_insert_with_cursor(
+            self,
+            data: List[Union[T, Dict]],
+            query: Dict,
+            cursor: Union[pymssql.Cursor, pyodbc.Cursor]
+    ) -> Dict:
+        """ Insert rows as typed parameters: no SQL text rendering.
+        pyodbc: one INSERT template sent with fast_executemany (binary parameter array);
+        pymssql: multi rows INSERT chunked by MSSQL rows & parameters limits.
+
+        :param query: fields & values same for all rows (ex. foreign key)
+        :return: {NUM_UPDATE_FIELD: num rows inserted}
+        """
+
+        rows = [
+            self.param_sql.row_params((d if isinstance(d, dict) else d.model_dump()) | query)
+            for d in data
+        ]
+        num_rows = 0
+        marker = param_marker(cursor)
+        if is_pyodbc(cursor):
+            cursor.fast_executemany = True
+            sql_query = self.param_sql.insert_many(1, marker)
+            for chunk in chunk_size(rows, settings.mssql_bulk_chunk_rows):
+                cursor.executemany(sql_query, chunk)
+                num_rows += len(chunk)
+        else:
+            for chunk in chunk_rows(rows, len(self.param_sql.columns)):
+                cursor.execute(
+                    self.param_sql.insert_many(len(chunk), marker),
+                    tuple(v for row in chunk for v in row)
+                )
+                num_rows += len(chunk)
+
+        return {NUM_UPDATE_FIELD: num_rows}
+
     @with_transaction
     def create_many(self, data: List[T], query: Dict) -> Dict:
         # ODBC driver has limitation 1000 row at a time
@@ -654,7 +1242,7 @@ class RepositoryMSSQL(Generic[T]):
 
         return result
 
-    def _update_sql_query(self, data: T, query: Union[dict, str]) -> str:
+    def _update_set_data(self, data: T, query: Union[dict, str]) -> Tuple[Dict, Dict]:
         if query is None:
             raise Exception(f'Unknown {QUERY_FIELD}')
 
@@ -665,6 +1253,11 @@ class RepositoryMSSQL(Generic[T]):
 
         set_data = data.dict(exclude_unset=True)
         set_data.pop(self.primary_key, None)
+
+        return set_data, query
+
+    def _update_sql_query(self, data: T, query: Union[dict, str]) -> str:
+        set_data, query = self._update_set_data(data, query)
         sql_query = self.json_to_sql.get_mssql_update(
             query=query,
             sql_set=set_data
@@ -672,17 +1265,26 @@ class RepositoryMSSQL(Generic[T]):
 
         return sql_query
 
+    def _update_statement(self, data: T, query: Union[dict, str]) -> ParamStatement:
+        set_data, key_query = self._update_set_data(data, query)
+        if statement := self.param_statement("update", set_data, key_query):
+            return statement
+
+        return ParamStatement(self.json_to_sql.get_mssql_update(query=key_query, sql_set=set_data))
+
     def update_with_cursor(
             self,
             data: T,
             cursor: Union[pymssql.Cursor, pyodbc.Cursor],
             query: Union[dict, str, int, T] = None
     ):
-        sql_query = self._update_sql_query(data, query)
+        self.invalidate_cache(data, query)
+        sql_query, params = self._update_statement(data, query)
         self._cursor_execute(
             sql_query,
             cursor,
-            multi=True
+            multi=True,
+            params=params
         )
         data = self._fetch_one(cursor)
 
@@ -690,9 +1292,9 @@ class RepositoryMSSQL(Generic[T]):
 
     @with_transaction
     def update(self, data: T, query: Union[dict, str]) -> Dict:
-        sql_query = self._update_sql_query(data, query)
-        sql_query = self.sql_before_execute(sql_query)
-        data = self.exec_fetch_one(sql_query=sql_query)  # return num rows updated (1)
+        self.invalidate_cache(data, query)
+        sql_query, params = self._before_execute(self._update_statement(data, query))
+        data = self.exec_fetch_one(sql_query=sql_query, params=params)  # return num rows updated (1)
 
         return data
 
@@ -723,19 +1325,27 @@ class RepositoryMSSQL(Generic[T]):
 
         return num_count
 
+    def _delete_statement(self, data: Optional[Union[T, dict]] = None, query: Dict = None) -> ParamStatement:
+        query = query or {self.primary_key: getattr(data, self.primary_key)}
+        if statement := self.param_statement("delete", query):
+            return statement
+
+        return ParamStatement(self.json_to_sql.get_mssql_delete_one(query=query))
+
     def delete_with_cursor(
             self,
             cursor: pymssql.Cursor,
             data: Optional[Union[T, dict]] = None,
             query: Dict = None
     ):
-        sql_query = self.json_to_sql.get_mssql_delete_one(
-            query=query or {self.primary_key: getattr(data, self.primary_key)}
-        )
+        self.invalidate_cache(data, query)
+        self.forget_keys(data, query)
+        sql_query, params = self._delete_statement(data, query)
         self._cursor_execute(
             sql_query,
             cursor,
-            multi=True
+            multi=True,
+            params=params
         )
         result = self._fetch_one(cursor)
 
@@ -745,15 +1355,20 @@ class RepositoryMSSQL(Generic[T]):
     def delete(self, data: Optional[Union[T, dict]] = None, query: Dict = None):
         """ query for delete many rows """
 
-        sql_query = self.json_to_sql.get_mssql_delete_one(
-            query=query or {self.primary_key: getattr(data, self.primary_key)}
-        )
-        sql_query = self.sql_before_execute(sql_query)
-        result = self.exec_fetch_one(sql_query=sql_query)   # return num rows deleted (1)
+        self.invalidate_cache(data, query)
+        self.forget_keys(data, query)
+        sql_query, params = self._before_execute(self._delete_statement(data, query))
+        result = self.exec_fetch_one(sql_query=sql_query, params=params)   # return num rows deleted (1)
 
         return result
 
     def count(self, **kwargs) -> int:
+        if (rows := self.select_large_in(kwargs.get(QUERY_FIELD) or {}, count=True)) is not None:
+            return sum(row[COUNT_FIELD] for row in rows)  # chunks of distinct values: disjoint
+
+        if statement := self.param_statement("select", kwargs.get(QUERY_FIELD) or {}, count=True):
+            return self.exec_fetch_one(*statement)[COUNT_FIELD]
+
         _, sql_count_query = self.json_to_sql.get_mssql_select_count(
             query=kwargs.get(QUERY_FIELD, {}),
             primary_key=self.primary_key
@@ -773,6 +1388,19 @@ class RepositoryMSSQL(Generic[T]):
 
         return sql_query
 
+    def _before_execute(self, statement: ParamStatement) -> ParamStatement:
+        """ sql_before_execute gets the statement itself, not sp_executesql call around it """
+
+        sql_query, params = statement
+        if params is None:
+            return ParamStatement(self.sql_before_execute(sql_query))
+
+        return ParamStatement(sql_query, (self.sql_before_execute(params[0]),) + params[1:])
+
+    @classmethod
+    def full_table_name(cls) -> str:
+        return f"[{cls.name_space}].[{cls.table_prefix}{cls.table_name()}]"
+
     @classmethod
     def table_name(cls):
         # ClientsAndAuth -> clients_and_auth conversion
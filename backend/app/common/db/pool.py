@@ -0,0 +1,248 @@
+"""
+Thread safe DB connection pool (pyodbc & pymssql connections)
+
+Thread borrows one connection at a time: nested borrow() in the same thread
+returns the same connection (transaction decorators inside repository calls).
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Iterator, Optional
+
+PING_QUERY = "SELECT 1"
+
+
+class PoolTimeout(Exception):
+    """ no connection returned to the pool in time """
+
+
+class NoConnectionBorrowed(Exception):
+    """ current thread did not borrow connection """
+
+
+@dataclass
+class PoolStats:
+    created: int = 0
+    reused: int = 0
+    closed: int = 0
+    expired: int = 0
+    checks_failed: int = 0
+    waits: int = 0
+
+
+@dataclass
+class PooledConnection:
+    connection: Any
+    created_at: float = field(default_factory=time.monotonic)
+    released_at: float = field(default_factory=time.monotonic)
+
+
+class _Borrowed(threading.local):
+    pooled: Optional[PooledConnection] = None
+    depth: int = 0
+
+
+class ConnectionPool:
+    """ usage:
+
+        pool = ConnectionPool(create_connection, max_size=8)
+        with pool.borrow() as connection:
+            ...
+
+    :param factory: create new connection, may raise driver error
+    :param max_age: sec, older connection is closed on checkout / return
+    :param check_idle: sec, connection idle longer is pinged on checkout (0: always)
+    :param timeout: sec to wait for a free connection when max_size reached
+    """
+
+    def __init__(
+            self,
+            factory: Callable[[], Any],
+            min_size: int = 1,
+            max_size: int = 8,
+            max_age: float = 1800.,
+            check_idle: float = 30.,
+            timeout: float = 30.
+    ):
+        self.factory = factory
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.check_idle = check_idle
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        """ forked child must not use parent sockets: forget them without close """
+
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle: Deque[PooledConnection] = deque()
+        self._size = 0
+        self._borrowed = _Borrowed()
+        self.stats = PoolStats()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def _expired(self, pooled: PooledConnection) -> bool:
+        return bool(self.max_age) and time.monotonic() - pooled.created_at > self.max_age
+
+    def _healthy(self, pooled: PooledConnection) -> bool:
+        if time.monotonic() - pooled.released_at < self.check_idle:
+            return True
+        try:
+            cursor = pooled.connection.cursor()
+            cursor.execute(PING_QUERY)
+            cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            print(f"Pool: connection check failed ({e})")
+            self.stats.checks_failed += 1
+            return False
+
+        return True
+
+    def _close(self, pooled: PooledConnection):
+        """ called without lock: close may block on dead socket """
+
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self.stats.closed += 1
+            self._cond.notify()
+
+    def _create(self) -> PooledConnection:
+        """ slot (self._size) must be reserved by caller """
+
+        try:
+            pooled = PooledConnection(self.factory())
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self.stats.created += 1
+
+        return pooled
+
+    def acquire(self) -> PooledConnection:
+        """ idle connection (checked) or new one if max_size not reached, else wait """
+
+        self._check_pid()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    self.stats.waits += 1
+                    if (left := deadline - time.monotonic()) <= 0 or not self._cond.wait(left):
+                        raise PoolTimeout(f"No DB connection available in {self.timeout}s")
+                pooled = self._idle.pop() if self._idle else None  # LIFO: warm connection
+                if pooled is None:
+                    self._size += 1
+
+            if pooled is None:
+                return self._create()
+            if self._expired(pooled):
+                self.stats.expired += 1
+                self._close(pooled)
+            elif self._healthy(pooled):
+                self.stats.reused += 1
+                return pooled
+            else:
+                self._close(pooled)
+
+    def release(self, pooled: PooledConnection, broken: bool = False):
+        """ uncommitted work is rolled back: next borrower starts clean """
+
+        if not broken and not self._expired(pooled):
+            try:
+                pooled.connection.rollback()
+            except Exception:
+                broken = True
+        if broken or self._expired(pooled) or os.getpid() != self._pid:
+            self._close(pooled)
+            return
+
+        pooled.released_at = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def fill(self):
+        """ open min_size connections ahead """
+
+        self._check_pid()
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            pooled = self._create()
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    @contextmanager
+    def borrow(self) -> Iterator[Any]:
+        """ reentrant: nested borrow in the same thread yields the same connection """
+
+        self._check_pid()
+        borrowed = self._borrowed
+        if borrowed.pooled is None:
+            borrowed.pooled = self.acquire()
+        borrowed.depth += 1
+        try:
+            yield borrowed.pooled.connection
+        finally:
+            borrowed.depth -= 1
+            if not borrowed.depth and borrowed.pooled is not None:
+                pooled, borrowed.pooled = borrowed.pooled, None
+                self.release(pooled)
+
+    def current(self) -> Any:
+        """ connection borrowed by current thread
+        :raise NoConnectionBorrowed
+        """
+
+        if self._borrowed.pooled is None:
+            raise NoConnectionBorrowed("Use borrow() (or repository decorators) to get connection")
+
+        return self._borrowed.pooled.connection
+
+    def replace(self) -> Any:
+        """ dead connection of current thread is closed & replaced (other threads not affected) """
+
+        borrowed = self._borrowed
+        if borrowed.pooled is None:
+            raise NoConnectionBorrowed("Nothing to replace")
+        pooled, borrowed.pooled = borrowed.pooled, None
+        self._close(pooled)
+        with self._cond:
+            self._size += 1
+        borrowed.pooled = self._create()
+
+        return borrowed.pooled.connection
+
+    def close(self):
+        """ close idle connections: borrowed ones are closed on return """
+
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for pooled in idle:
+            self._close(pooled)
@@ -0,0 +1,142 @@
+"""
+Retry policy for DB operations: exponential backoff with full jitter,
+retry budget per operation and circuit breaker shared by the process
+"""
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, Tuple, Type, TypeVar
+
+R = TypeVar("R")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """ DB considered down: fail fast until reset_timeout passed """
+
+
+@dataclass
+class RetryPolicy:
+    """ :param attempts: retries per operation (budget), after the first call
+    :param budget: sec, no retry is started after it (time budget of operation)
+    """
+
+    attempts: int = 5
+    base: float = 0.5
+    cap: float = 30.
+    budget: float = 120.
+
+    def delays(self) -> Iterator[float]:
+        """ full jitter: random delay up to base * 2^n, capped; stops when budget spent """
+
+        deadline = time.monotonic() + self.budget
+        for n in range(self.attempts):
+            delay = random.uniform(0, min(self.cap, self.base * 2 ** n))
+            if time.monotonic() + delay > deadline:
+                return
+            yield delay
+
+
+class CircuitBreaker:
+    """ closed -> open after failures in row; open -> half_open after reset_timeout:
+    one probe call goes to DB, others fail fast; probe success closes circuit
+    """
+
+    def __init__(self, failures: int = 5, reset_timeout: float = 30.):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failed = 0
+        self._opened_at = 0.
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """ :raise CircuitOpen """
+
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpen(f"DB circuit {self.state}: retry in {self.retry_in():.1f}s")
+
+    def retry_in(self) -> float:
+        return max(0., self._opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        if self.state == CLOSED and not self._failed:
+            return
+        with self._lock:
+            self.state = CLOSED
+            self._failed = 0
+            self._probing = False
+
+    def record_error(self):
+        """ not retried error (ex. credential, config): ends probe like a failure,
+        otherwise circuit would stay half open with probe in flight forever
+        """
+        if self.state == HALF_OPEN:
+            self.record_failure()
+
+    def record_failure(self):
+        with self._lock:
+            self._failed += 1
+            if self.state == HALF_OPEN or self._failed >= self.failures:
+                if self.state != OPEN:
+                    print(f"DB circuit open after {self._failed} failures")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+def retry_call(
+        func: Callable[[], R],
+        retry_on: Tuple[Type[BaseException], ...],
+        policy: RetryPolicy,
+        breaker: Optional[CircuitBreaker] = None,
+        on_retry: Optional[Callable[[BaseException], None]] = None,
+        retry_if: Optional[Callable[[BaseException], bool]] = None
+) -> R:
+    """ func() retried on retry_on exceptions with policy delays
+
+    :param on_retry: called with error after backoff sleep (ex. replace connection)
+    :param retry_if: retry_on error is raised at once if False (ex. not a disconnect)
+    :raise: last error when budget spent; CircuitOpen while DB is down
+    """
+
+    delays = policy.delays()
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = func()
+        except retry_on as e:
+            if retry_if is not None and not retry_if(e):
+                if breaker is not None:
+                    breaker.record_error()
+                raise
+            if breaker is not None:
+                breaker.record_failure()
+            if (delay := next(delays, None)) is None:
+                raise
+            print(f"Retry in {delay:.2f}s: {e}")
+            time.sleep(delay)
+            if on_retry is not None:
+                on_retry(e)
+        except BaseException:
+            if breaker is not None:
+                breaker.record_error()
+            raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
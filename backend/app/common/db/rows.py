@@ -0,0 +1,104 @@
+"""
+Compact query result: one column index shared by result set + rows as fetched
+(pyodbc.Row / pymssql tuple). Row dicts are built on demand only
+"""
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Type, Union
+
+from common.config import T
+
+
+def cursor_columns(cursor) -> Tuple[str, ...]:
+    return tuple(c[0] for c in cursor.description)
+
+
+def concat_rows(parts: Iterable[Union["RowSet", List[Dict]]]) -> Union["RowSet", List[Dict]]:
+    """ results of the same query split by chunks (same columns): one result """
+
+    data = []
+    for part in parts:
+        if not part:
+            continue
+        if not data:
+            data = part
+        elif isinstance(data, RowSet):
+            data.rows.extend(part.rows)
+        else:
+            data.extend(part)
+
+    return data
+
+
+class Row(Mapping):
+    """ read only dict-like row: row["bill_id"], row.bill_id, dict(row) """
+
+    __slots__ = ("_values", "_index")
+
+    def __init__(self, values: Sequence, index: Dict[str, int]):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        return self._values[self._index[key]]
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self):
+        return f"Row({dict(self)})"
+
+
+class RowSet(Sequence):
+    """ usage:
+
+        rows = RowSet.from_cursor(cursor, cursor.fetchall())
+        rows[0]["bill_id"], [row.bill_id for row in rows]
+        models = rows.models(BillsSQL)   # fast path: no Row objects, one temporary dict per row
+    """
+
+    __slots__ = ("columns", "index", "rows")
+
+    def __init__(self, columns: Sequence[str], rows: List[Sequence]):
+        self.columns = tuple(columns)
+        self.index = {c: i for i, c in enumerate(self.columns)}
+        self.rows = rows
+
+    @classmethod
+    def from_cursor(cls, cursor, rows: List[Sequence]) -> "RowSet":
+        return cls(cursor_columns(cursor), rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return RowSet(self.columns, self.rows[i])
+        return Row(self.rows[i], self.index)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Row]:
+        index = self.index
+        return (Row(values, index) for values in self.rows)
+
+    def __repr__(self):
+        return f"RowSet(columns={self.columns}, rows={len(self.rows)})"
+
+    def column(self, name: str) -> List:
+        i = self.index[name]
+        return [values[i] for values in self.rows]
+
+    def dicts(self) -> Iterator[Dict]:
+        columns = self.columns
+        return (dict(zip(columns, values)) for values in self.rows)
+
+    def models(self, model: Type[T]) -> List[T]:
+        validate = model.model_validate
+        return [validate(d) for d in self.dicts()]
@@ -0,0 +1,496 @@
+"""
+Parameterized SQL statements for RepositoryMSSQL: values are bound by the driver,
+not rendered into SQL text like JsonToSQL does.
+
+CRUD statements are templates with named parameters (@p1, @p2, ...) executed by
+sp_executesql: one plan in MSSQL plan cache per (table, operation, columns, filter shape)
+"""
+import functools
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from types import UnionType
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union, get_args, get_origin
+
+from common.db.drivers import is_pyodbc
+from common.db.utils import COUNT_FIELD, NUM_UPDATE_FIELD
+
+MAX_PARAMS = 2100 - 1  # MSSQL limit of parameters per request
+MAX_ROWS = 1000  # MSSQL limit of rows in table value constructor
+ACTION_FIELD = "action"
+TOTAL_FIELD = "__total"  # window count of page query
+MERGE_INSERT = "INSERT"
+MERGE_UPDATE = "UPDATE"
+
+TEMPLATE_CACHE_SIZE = 1024
+PARAM_PREFIX = "@p"
+OPERATORS = {"$eq": "=", "$ne": "<>", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+IN_OPERATOR = "$in"
+IN_TABLE = "IN #"  # $in values staged in session temp table
+KEYS_TABLE = "#in_keys"
+KEY_COLUMN = "key"
+IS_NULL = {"=": "IS NULL", "<>": "IS NOT NULL"}
+ANY_TYPE = "nvarchar(max)"
+SCALAR_TYPES = {
+    bool: "bit",
+    int: "bigint",
+    float: "float",
+    Decimal: "decimal(38, 10)",
+    datetime: "datetime2",
+    date: "date",
+}
+
+# ((field, operator, number of parameters), ...): hashable filter key of templates cache
+WhereShape = Tuple[Tuple[str, str, int], ...]
+
+
+class ParamStatement(NamedTuple):
+    """ params=None: SQL text without parameters (JsonToSQL) """
+
+    sql: str
+    params: Optional[Tuple] = None
+
+
+def param_marker(cursor) -> str:
+    """ pyodbc: qmark paramstyle; pymssql: format paramstyle (cursor or connection) """
+
+    connection = getattr(cursor, "connection", cursor)
+
+    return "?" if is_pyodbc(connection) else "%s"
+
+
+def param_value(value: Any) -> Any:
+    """ python value to driver bound value """
+
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        # MSSQL datetime column has no time zone: naive UTC (same as to_naive_utc of JsonToSQL path)
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+
+    return value
+
+
+def chunk_rows(rows: Sequence[Tuple], columns_count: int) -> Iterator[Sequence[Tuple]]:
+    """ split rows to fit both MAX_PARAMS & MAX_ROWS per statement """
+
+    yield from chunk_size(rows, max(1, min(MAX_ROWS, MAX_PARAMS // max(1, columns_count))))
+
+
+def chunk_size(rows: Sequence[Tuple], size: int) -> Iterator[Sequence[Tuple]]:
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def quote_name(name: str) -> str:
+    return f"[{name.replace(']', ']]')}]"
+
+
+def sql_type(value: Any) -> str:
+    """ parameter type by value: ASCII str as varchar, so varchar column index is used """
+
+    if (tp := SCALAR_TYPES.get(type(value))) is not None:
+        return tp
+    if isinstance(value, str) and value.isascii():
+        return "varchar(8000)" if len(value) <= 8000 else "varchar(max)"
+
+    return "nvarchar(4000)" if isinstance(value, str) and len(value) <= 4000 else ANY_TYPE
+
+
+def annotation_sql_type(annotation: Any) -> str:
+    """ parameter type by model field: same for every row, None values included """
+
+    args = get_args(annotation) if get_origin(annotation) in (Union, UnionType) else (annotation,)
+    args = [a for a in args if a is not type(None)]
+    if len(args) == 1 and args[0] in SCALAR_TYPES:
+        return SCALAR_TYPES[args[0]]
+
+    return ANY_TYPE
+
+
+def param_name(i: int) -> str:
+    return f"{PARAM_PREFIX}{i}"
+
+
+def where_shape(query: Dict, in_table: Optional[str] = None) -> Optional[Tuple[WhereShape, Tuple]]:
+    """ {field: value | {operator: value}} -> (shape, values)
+
+    $in list is padded to power of 2 size: few templates for any list size
+    :param in_table: field which $in values are in KEYS_TABLE (no parameters)
+    :return: None if query has unsupported operator (JsonToSQL fallback)
+    """
+
+    shape, values = [], []
+    for field, cond in query.items():
+        if field.startswith("$"):
+            return None
+        conditions = cond.items() if isinstance(cond, dict) else [("$eq", cond)]
+        for op, value in conditions:
+            if op == IN_OPERATOR and field == in_table:
+                shape.append((field, IN_TABLE, 0))
+            elif op == IN_OPERATOR:
+                if not isinstance(value, (list, tuple, set)):
+                    return None
+                value = list(value)
+                size = 1 << (len(value) - 1).bit_length() if value else 0
+                shape.append((field, "IN", size))
+                values.extend(value + value[-1:] * (size - len(value)))
+            elif op not in OPERATORS:
+                return None
+            elif value is None:
+                if OPERATORS[op] not in IS_NULL:
+                    return None
+                shape.append((field, IS_NULL[OPERATORS[op]], 0))
+            else:
+                shape.append((field, OPERATORS[op], 1))
+                values.append(value)
+    if len(values) > MAX_PARAMS - 2:  # sp_executesql statement & declaration
+        return None
+
+    return tuple(shape), tuple(param_value(v) for v in values)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def where_template(shape: WhereShape, start: int = 1) -> str:
+    """ start: number of the first parameter """
+
+    clauses, i = [], start
+    for field, op, size in shape:
+        if op == "IN":
+            names = ", ".join(param_name(i + k) for k in range(size))
+            clauses.append(f"{quote_name(field)} IN ({names})" if size else "1 = 0")
+        elif op == IN_TABLE:
+            clauses.append(f"{quote_name(field)} IN (SELECT {quote_name(KEY_COLUMN)} FROM {KEYS_TABLE})")
+        elif size:
+            clauses.append(f"{quote_name(field)} {op} {param_name(i)}")
+        else:
+            clauses.append(f"{quote_name(field)} {op}")
+        i += size
+
+    return " AND ".join(clauses) or "1 = 1"
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def declare_template(types: Tuple[str, ...]) -> str:
+    return ", ".join(f"{param_name(i)} {tp}" for i, tp in enumerate(types, start=1))
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def executesql_template(marker: str, params_count: int) -> str:
+    """ statement & parameters declaration are bound too: no quoting of SQL text """
+
+    if not params_count:
+        return f"EXEC sp_executesql {marker}"
+
+    return f"EXEC sp_executesql {marker}, {marker}, {', '.join([marker] * params_count)}"
+
+
+def executesql(statement: str, types: Sequence[str], params: Tuple, marker: str) -> ParamStatement:
+    """ sp_executesql call: statement text does not depend on values """
+
+    if not params:
+        return ParamStatement(executesql_template(marker, 0), (statement,))
+
+    return ParamStatement(
+        executesql_template(marker, len(params)),
+        (statement, declare_template(tuple(types))) + tuple(params)
+    )
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def select_template(table: str, shape: WhereShape, count: bool = False, columns: Tuple[str, ...] = ()) -> str:
+    """ columns: projection (ex. key only existence check), all columns by default """
+
+    fields = f"COUNT(*) AS {quote_name(COUNT_FIELD)}" if count else ", ".join(map(quote_name, columns)) or "*"
+
+    return f"SELECT {fields} FROM {table} WHERE {where_template(shape)}"
+
+
+def largest_in(query: Dict) -> Optional[Tuple[str, List]]:
+    """ (field, distinct values) of the longest $in list of query """
+
+    res = None
+    for field, cond in query.items():
+        if isinstance(cond, dict) and isinstance(values := cond.get(IN_OPERATOR), (list, tuple, set)):
+            if res is None or len(values) > len(res[1]):
+                res = (field, values)
+    if res is None:
+        return None
+
+    return res[0], list(dict.fromkeys(res[1]))
+
+
+def split_in(query: Dict, field: str, values: Sequence, size: int) -> Iterator[Dict]:
+    """ same query for every chunk of $in values of field """
+
+    for chunk in chunk_size(values, size):
+        yield query | {field: query[field] | {IN_OPERATOR: list(chunk)}}
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def seek_template(keys: Tuple[str, ...], start: int, descending: bool = False) -> str:
+    """ rows after cursor in keys order: (k1 > @a OR (k1 = @a AND k2 > @b)) """
+
+    op = "<" if descending else ">"
+    clauses = []
+    for j, key in enumerate(keys):
+        equals = [f"{quote_name(k)} = {param_name(start + m)}" for m, k in enumerate(keys[:j])]
+        clauses.append(f"({' AND '.join(equals + [f'{quote_name(key)} {op} {param_name(start + j)}'])})")
+
+    return f"({' OR '.join(clauses)})"
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def page_template(
+        table: str,
+        shape: WhereShape,
+        keys: Tuple[str, ...],
+        seek: bool = False,
+        descending: bool = False,
+        total: bool = False,
+        offset: bool = False
+) -> str:
+    """ page in keys order: after cursor (seek) or OFFSET; last parameter(s): [skip,] limit.
+    total: COUNT(*) OVER() of the filter, computed before TOP / OFFSET (same round trip)
+    """
+
+    start = sum(size for *_, size in shape) + 1
+    where = where_template(shape)
+    if seek:
+        where = f"{where} AND {seek_template(keys, start, descending)}"
+        start += len(keys)
+    fields = f"*, COUNT(*) OVER() AS {quote_name(TOTAL_FIELD)}" if total else "*"
+    order = ", ".join(f"{quote_name(k)}{' DESC' if descending else ''}" for k in keys)
+    if offset:
+        return (
+            f"SELECT {fields} FROM {table} WHERE {where} ORDER BY {order} "
+            f"OFFSET {param_name(start)} ROWS FETCH NEXT {param_name(start + 1)} ROWS ONLY"
+        )
+
+    return f"SELECT TOP ({param_name(start)}) {fields} FROM {table} WHERE {where} ORDER BY {order}"
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def insert_template(table: str, primary_key: str, columns: Tuple[str, ...]) -> str:
+    """ result: num rows & primary key (identity or bound one) """
+
+    if primary_key in columns:
+        pk_value = param_name(columns.index(primary_key) + 1)
+    else:
+        pk_value = "CAST(SCOPE_IDENTITY() AS bigint)"
+
+    return (
+        "SET NOCOUNT ON; "
+        f"INSERT INTO {table} ({', '.join(quote_name(c) for c in columns)}) "
+        f"VALUES ({', '.join(param_name(i) for i in range(1, len(columns) + 1))}); "
+        f"SELECT @@ROWCOUNT AS {quote_name(NUM_UPDATE_FIELD)}, {pk_value} AS {quote_name(primary_key)};"
+    )
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def update_template(table: str, columns: Tuple[str, ...], shape: WhereShape) -> str:
+    sets = ", ".join(f"{quote_name(c)} = {param_name(i)}" for i, c in enumerate(columns, start=1))
+
+    return (
+        f"SET NOCOUNT ON; UPDATE {table} SET {sets} "
+        f"WHERE {where_template(shape, start=len(columns) + 1)}; "
+        f"SELECT @@ROWCOUNT AS {quote_name(NUM_UPDATE_FIELD)};"
+    )
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def delete_template(table: str, shape: WhereShape) -> str:
+    return (
+        f"SET NOCOUNT ON; DELETE FROM {table} WHERE {where_template(shape)}; "
+        f"SELECT @@ROWCOUNT AS {quote_name(NUM_UPDATE_FIELD)};"
+    )
+
+
+class ParamSQL:
+    """ statements for one table: [name_space].[table_prefix + table_name]
+
+    select / insert / update / delete: None if query is not supported (use JsonToSQL)
+    """
+
+    def __init__(
+            self,
+            table: str,
+            primary_key: str,
+            columns: List[str],
+            types: Optional[Dict[str, str]] = None
+    ):
+        self.table = table
+        self.primary_key = primary_key
+        self.columns = columns
+        self.types = types or {}
+
+    def column_type(self, column: str, value: Any) -> str:
+        return self.types.get(column) or sql_type(value)
+
+    def select(
+            self,
+            query: Dict,
+            marker: str,
+            count: bool = False,
+            columns: Tuple[str, ...] = (),
+            in_table: Optional[str] = None
+    ) -> Optional[ParamStatement]:
+        """ in_table: field of query joined with KEYS_TABLE (see keys_table) """
+
+        if (where := where_shape(query, in_table)) is None:
+            return None
+        shape, params = where
+
+        return executesql(
+            select_template(self.table, shape, count, tuple(columns)),
+            [sql_type(v) for v in params],
+            params,
+            marker
+        )
+
+    def page(
+            self,
+            query: Dict,
+            marker: str,
+            limit: int,
+            after: Sequence = (),
+            keys: Optional[Tuple[str, ...]] = None,
+            descending: bool = False,
+            total: bool = False,
+            skip: Optional[int] = None
+    ) -> Optional[ParamStatement]:
+        """ keyset page: limit rows after cursor (values of keys, primary key by default);
+        skip: OFFSET page instead of keyset one
+        """
+
+        keys = keys or (self.primary_key,)
+        if after and len(after) != len(keys):
+            raise ValueError(f"{after=} must have value for every one of {keys=}")
+        if (where := where_shape(query)) is None:
+            return None
+        shape, params = where
+        seek = tuple(param_value(v) for v in after)
+        paging = (limit,) if skip is None else (skip, limit)
+
+        return executesql(
+            page_template(self.table, shape, keys, bool(seek), descending, total, skip is not None),
+            [sql_type(v) for v in params]
+            + [sql_type(v) for v in seek]  # varchar for ASCII: key column index seek, not scan
+            + [sql_type(v) for v in paging],
+            params + seek + paging,
+            marker
+        )
+
+    def insert(self, data: Dict, marker: str) -> ParamStatement:
+        """ columns with value (and primary key): NULL does not override column default,
+        one template per set of filled columns
+        """
+
+        columns = tuple(c for c in self.columns if data.get(c) is not None or c == self.primary_key)
+        params = tuple(param_value(data.get(c)) for c in columns)
+
+        return executesql(
+            insert_template(self.table, self.primary_key, columns),
+            [self.column_type(c, v) for c, v in zip(columns, params)],
+            params,
+            marker
+        )
+
+    def update(self, data: Dict, query: Dict, marker: str) -> Optional[ParamStatement]:
+        """ data: fields to set, unknown (ex. 1:M) fields are skipped """
+
+        columns = tuple(c for c in data if c in self.columns and c != self.primary_key)
+        if not columns or (where := where_shape(query)) is None:
+            return None
+        shape, where_params = where
+        set_params = tuple(param_value(data[c]) for c in columns)
+
+        return executesql(
+            update_template(self.table, columns, shape),
+            [self.column_type(c, v) for c, v in zip(columns, set_params)]
+            + [sql_type(v) for v in where_params],
+            set_params + where_params,
+            marker
+        )
+
+    def delete(self, query: Dict, marker: str) -> Optional[ParamStatement]:
+        if not query or (where := where_shape(query)) is None:
+            return None  # delete all rows: keep JsonToSQL behaviour
+        shape, params = where
+
+        return executesql(
+            delete_template(self.table, shape),
+            [sql_type(v) for v in params],
+            params,
+            marker
+        )
+
+    @property
+    def stage_table(self) -> str:
+        """ session temp table with same column types as target """
+        return f"#stage_{self.table.replace('[', '').replace(']', '').replace('.', '_')}"
+
+    def merge_many(self, rows_count: int, marker: str, update: bool = False) -> str:
+        """ Stage rows in temp table (target column types) & MERGE it by primary key.
+
+        update=False: existing rows are skipped (INSERT ... WHERE NOT EXISTS)
+        update=True: existing rows are updated (upsert)
+        Result set: action, primary key for every inserted / updated row.
+        """
+
+        if self.primary_key not in self.columns:
+            raise ValueError(f"{self.primary_key=} must be in columns for MERGE {self.table}")
+
+        cols = ", ".join(quote_name(c) for c in self.columns)
+        row = f"({', '.join([marker] * len(self.columns))})"
+        pk = quote_name(self.primary_key)
+        stage = self.stage_table
+        matched = ""
+        if update and (set_cols := [c for c in self.columns if c != self.primary_key]):
+            matched = (
+                "WHEN MATCHED THEN UPDATE SET "
+                + ", ".join(f"target.{quote_name(c)} = source.{quote_name(c)}" for c in set_cols)
+                + " "
+            )
+
+        return (
+            "SET NOCOUNT ON; "
+            f"IF OBJECT_ID('tempdb..{stage}') IS NOT NULL DROP TABLE {stage}; "
+            f"SELECT TOP 0 {cols} INTO {stage} FROM {self.table}; "
+            f"INSERT INTO {stage} ({cols}) VALUES {', '.join([row] * rows_count)}; "
+            f"MERGE {self.table} WITH (HOLDLOCK) AS target "
+            f"USING {stage} AS source ON target.{pk} = source.{pk} "
+            f"{matched}"
+            f"WHEN NOT MATCHED BY TARGET THEN INSERT ({cols}) "
+            f"VALUES ({', '.join(f'source.{quote_name(c)}' for c in self.columns)}) "
+            f"OUTPUT $action AS {quote_name(ACTION_FIELD)}, inserted.{pk} AS {pk};"
+        )
+
+    def keys_table(self, field: str) -> str:
+        """ session temp table KEYS_TABLE for $in values of field: same type as the column
+        (UNION: identity property of the column is not copied)
+        """
+
+        column = f"SELECT TOP 0 {quote_name(field)} FROM {self.table}"
+
+        return (
+            "SET NOCOUNT ON; "
+            f"IF OBJECT_ID('tempdb..{KEYS_TABLE}') IS NOT NULL DROP TABLE {KEYS_TABLE}; "
+            f"SELECT TOP 0 {quote_name(field)} AS {quote_name(KEY_COLUMN)} INTO {KEYS_TABLE} FROM {self.table} "
+            f"UNION ALL {column};"
+        )
+
+    @staticmethod
+    def keys_insert(rows_count: int, marker: str) -> str:
+        return f"INSERT INTO {KEYS_TABLE} ({quote_name(KEY_COLUMN)}) VALUES {', '.join([f'({marker})'] * rows_count)};"
+
+    def row_params(self, data: Dict) -> Tuple:
+        return tuple(param_value(data.get(c, None)) for c in self.columns)
+
+    def insert_many(self, rows_count: int, marker: str) -> str:
+        """ rows_count=1: template for cursor.executemany """
+
+        cols = ", ".join(quote_name(c) for c in self.columns)
+        row = f"({', '.join([marker] * len(self.columns))})"
+
+        return f"INSERT INTO {self.table} ({cols}) VALUES {', '.join([row] * rows_count)};"
@@ -1,5 +1,6 @@
 import importlib
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 
 from fastapi_utils.api_model import APIModel, PYDANTIC_VERSION
@@ -14,6 +15,7 @@ DB_PLUGIN_PATH_ADD = "repos"
 DEFAULT_DB_NAME_SPACE = 'storyous'
 
 
+@lru_cache(maxsize=None)
 def get_repository_for_model(
         model_type: str,
         prefix: str = '',
@@ -25,7 +27,7 @@ def get_repository_for_model(
     :parameter: model_type: Class.__name__
     :parameter::plugin: Class.__module__.rsplit('.', maxsplit=1)[1]
     :parameter::package: Class.__module__.rsplit('.', maxsplit=1)[0]
-    :raise: getattr Exception if not found
+    :raise: getattr Exception if not found (not cached)
     """
 
     if "." in plugin:
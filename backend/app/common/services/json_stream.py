@@ -0,0 +1,87 @@
+"""
+Incremental splitter of JSON object with large array member: array items are
+yielded as raw bytes while the body is read, the rest of object is kept (small).
+Every item is validated on its own (ex. Model.model_validate_json(item))
+"""
+import re
+from typing import Iterable, Iterator
+
+STRUCTURAL = re.compile(rb'[\[\]{}"\\]')
+OPEN = b'[{'
+QUOTE = ord('"')
+BACKSLASH = ord('\\')
+ARRAY_DEPTH = 2  # array is member of top level object
+ITEM_DEPTH = 3
+
+
+class ArrayItems:
+    """ usage:
+
+        items = ArrayItems("data")
+        for item in items.feed_all(response.iter_bytes()):
+            bill = Bills.model_validate_json(item)
+        rest = bytes(items.rest)  # b'{"data":[], "nextPage": ...}'
+
+    Array items must be objects or arrays, scalar items are skipped
+    """
+
+    def __init__(self, key: str):
+        self.key = re.compile(rb'"' + re.escape(key.encode()) + rb'"\s*:\s*$')
+        self.rest = bytearray()
+        self._item = bytearray()
+        self._depth = 0
+        self._in_string = False
+        self._skip = -1  # escaped byte is the first one of next chunk
+        self._in_array = False
+        self._found = False
+
+    def feed(self, chunk: bytes) -> Iterator[bytes]:
+        start = 0  # not stored part of chunk
+        skip, self._skip = self._skip, -1
+        for m in STRUCTURAL.finditer(chunk):
+            pos = m.start()
+            if pos == skip:
+                continue
+            c = chunk[pos]
+            if self._in_string:
+                if c == BACKSLASH:
+                    skip = pos + 1
+                elif c == QUOTE:
+                    self._in_string = False
+                continue
+
+            if c == QUOTE:
+                self._in_string = True
+            elif c in OPEN:
+                self._depth += 1
+                if self._in_array:
+                    if self._depth == ITEM_DEPTH:
+                        start = pos
+                elif self._depth == ARRAY_DEPTH and not self._found:
+                    self.rest += chunk[start:pos]
+                    start = pos
+                    self._in_array = self._found = self.key.search(self.rest) is not None
+                    if self._in_array:
+                        self.rest += b'['
+                        start = pos + 1
+            else:
+                if self._in_array and self._depth == ITEM_DEPTH:
+                    self._item += chunk[start:pos + 1]
+                    yield bytes(self._item)
+                    self._item.clear()
+                    start = pos + 1
+                elif self._in_array and self._depth == ARRAY_DEPTH:
+                    self._in_array = False
+                    start = pos
+                self._depth -= 1
+
+        if skip == len(chunk):
+            self._skip = 0
+        if not self._in_array:
+            self.rest += chunk[start:]
+        elif self._depth >= ITEM_DEPTH:
+            self._item += chunk[start:]
+
+    def feed_all(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            yield from self.feed(chunk)
@@ -0,0 +1,186 @@
+"""
+Staged pipeline: source -> stage -> ... -> stage, one thread per stage,
+connected by bounded queues (backpressure on put when the next stage is slow)
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+STOP = object()  # end of stream marker
+POLL_TIMEOUT = 0.5  # sec: how often blocked stage checks if pipeline aborted
+
+
+@dataclass
+class StageStats:
+    """ wait_in: stage starved (upstream slow); wait_out: stage blocked (downstream slow) """
+
+    name: str
+    items: int = 0
+    busy: float = 0.
+    wait_in: float = 0.
+    wait_out: float = 0.
+    depth_max: int = 0
+    depth_sum: int = 0
+
+    @property
+    def depth_avg(self) -> float:
+        return self.depth_sum / self.items if self.items else 0.
+
+    def __str__(self):
+        return (
+            f"{self.name}: items={self.items} busy={self.busy:.2f}s "
+            f"wait_in={self.wait_in:.2f}s wait_out={self.wait_out:.2f}s "
+            f"out_queue depth avg={self.depth_avg:.1f} max={self.depth_max}"
+        )
+
+
+@dataclass
+class PipelineStats:
+    stages: List[StageStats] = field(default_factory=list)
+
+    def __str__(self):
+        return "\n".join(str(s) for s in self.stages)
+
+
+class PipelineAborted(Exception):
+    """ raised inside stage thread when other stage failed """
+
+
+class Pipeline:
+    """ usage:
+
+        stats = Pipeline(maxsize=2).run(
+            pages_iterator,             # fetch stage (thread)
+            ("parse", parse_page),      # parse stage (thread)
+            ("write", write_page),      # DB writer stage (thread)
+        )
+        print(stats)
+
+    Stage function returns value for the next stage; None is dropped.
+    """
+
+    def __init__(self, maxsize: int = 2, report_every: Optional[float] = None):
+        self.maxsize = maxsize
+        self.report_every = report_every
+        self._abort = threading.Event()
+        self._errors: List[BaseException] = []
+        self._queues: List[queue.Queue] = []
+        self.stats = PipelineStats()
+
+    def _get(self, q: queue.Queue, stats: StageStats) -> Any:
+        started = time.monotonic()
+        while True:
+            try:
+                item = q.get(timeout=POLL_TIMEOUT)
+            except queue.Empty:
+                if self._abort.is_set():
+                    raise PipelineAborted()
+            else:
+                stats.wait_in += time.monotonic() - started
+                return item
+
+    def _put(self, q: queue.Queue, item: Any, stats: StageStats):
+        started = time.monotonic()
+        while True:
+            try:
+                q.put(item, timeout=POLL_TIMEOUT)
+            except queue.Full:
+                if self._abort.is_set():
+                    raise PipelineAborted()
+            else:
+                stats.wait_out += time.monotonic() - started
+                depth = q.qsize()
+                stats.depth_sum += depth
+                stats.depth_max = max(stats.depth_max, depth)
+                return
+
+    def _run_source(self, source: Iterable, out_q: queue.Queue, stats: StageStats):
+        try:
+            iterator = iter(source)
+            while True:
+                started = time.monotonic()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    stats.busy += time.monotonic() - started
+                stats.items += 1
+                self._put(out_q, item, stats)
+            self._put(out_q, STOP, stats)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _run_stage(
+            self,
+            func: Callable,
+            in_q: queue.Queue,
+            out_q: Optional[queue.Queue],
+            stats: StageStats
+    ):
+        try:
+            while (item := self._get(in_q, stats)) is not STOP:
+                started = time.monotonic()
+                res = func(item)
+                stats.busy += time.monotonic() - started
+                stats.items += 1
+                if out_q is not None and res is not None:
+                    self._put(out_q, res, stats)
+            if out_q is not None:
+                self._put(out_q, STOP, stats)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _fail(self, e: BaseException):
+        self._errors.append(e)
+        self._abort.set()
+
+    def depths(self) -> List[Tuple[str, int]]:
+        """ current queue depth after every stage except last one """
+        return [(s.name, q.qsize()) for s, q in zip(self.stats.stages, self._queues)]
+
+    def run(self, source: Iterable, *stages: Tuple[str, Callable]) -> PipelineStats:
+        """ :raise: first exception happened in any stage """
+
+        self.stats = PipelineStats(
+            stages=[StageStats(name="source")] + [StageStats(name=name) for name, _ in stages]
+        )
+        self._queues = [queue.Queue(maxsize=self.maxsize) for _ in stages]
+
+        threads = [threading.Thread(
+            target=self._run_source,
+            args=(source, self._queues[0], self.stats.stages[0]),
+            name="pipeline-source",
+            daemon=True
+        )]
+        for i, (name, func) in enumerate(stages):
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(
+                    func,
+                    self._queues[i],
+                    self._queues[i + 1] if i + 1 < len(stages) else None,
+                    self.stats.stages[i + 1]
+                ),
+                name=f"pipeline-{name}",
+                daemon=True
+            ))
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            while t.is_alive():
+                t.join(timeout=self.report_every)
+                if self.report_every and t.is_alive():
+                    print("pipeline queues: " + ", ".join(f"{n}->{d}" for n, d in self.depths()))
+
+        if self._errors:
+            raise self._errors[0]
+
+        return self.stats
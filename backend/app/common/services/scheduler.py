@@ -0,0 +1,102 @@
+"""
+Run independent tasks in parallel (processes or threads),
+every task is retried on failure independently of the others
+"""
+import multiprocessing
+from collections import defaultdict, deque
+from concurrent.futures import (
+    Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+)
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+
+@dataclass
+class TaskResult:
+    task: Any
+    result: Any = None
+    error: Optional[BaseException] = None
+    attempts: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def get_executor(max_workers: int, processes: bool = True) -> Executor:
+    """ spawn: child process must not inherit parent DB connections & sockets """
+
+    if processes:
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def run_parallel(
+        func: Callable,
+        tasks: Sequence[Any],
+        max_workers: int,
+        retries: int = 2,
+        processes: bool = True,
+        progress: Optional[Callable[[TaskResult, int, int], None]] = None,
+        key: Optional[Callable[[Any], Hashable]] = None,
+        max_per_key: Optional[int] = None
+) -> List[TaskResult]:
+    """ func(task) for every task, at most max_workers at a time.
+
+    :param func: module level function (picklable) if processes
+    :param retries: extra attempts for the failed task
+    :param progress: called with (task_result, done, total) when task finished
+    :param key: group of task (ex. merchant_id) for max_per_key running tasks cap
+    :return: TaskResult in tasks order; failed tasks keep last error
+    """
+
+    results = [TaskResult(task=task) for task in tasks]
+    pending = deque(range(len(results)))
+    per_key: Dict[Hashable, int] = defaultdict(int)
+    done = 0
+
+    def task_key(i: int) -> Hashable:
+        return key(results[i].task) if key else None
+
+    with get_executor(max_workers, processes) as executor:
+        running: Dict[Future, int] = {}
+
+        def submit_pending():
+            """ FIFO, but skip tasks of the key reached max_per_key """
+            for _ in range(len(pending)):
+                if len(running) >= max_workers:
+                    break
+                i = pending.popleft()
+                if max_per_key and per_key[task_key(i)] >= max_per_key:
+                    pending.append(i)
+                    continue
+                per_key[task_key(i)] += 1
+                results[i].attempts += 1
+                running[executor.submit(func, results[i].task)] = i
+
+        submit_pending()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                per_key[task_key(i)] -= 1
+                try:
+                    results[i].result = future.result()
+                    results[i].error = None
+                except Exception as e:
+                    results[i].error = e
+                    if results[i].attempts <= retries:
+                        print(f"Task {results[i].task} failed ({e}); retry {results[i].attempts}/{retries}")
+                        pending.append(i)
+                        continue
+
+                done += 1
+                if progress:
+                    progress(results[i], done, len(results))
+            submit_pending()
+
+    return results
@@ -1,42 +1,78 @@
 """
 Storyous API migration data to MSSQL
 """
+import asyncio
+import functools
+import itertools
+import operator
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Iterable, Tuple
 
-from common.db.mssql import CrudDataMSSQLError
+from common.db.mssql import CrudDataMSSQLError, INSERTED_FIELD
+from common.services.pipeline import Pipeline, PipelineStats
+from common.services.scheduler import run_parallel, TaskResult
+from storyapi.config import to_naive_utc
 from storyapi.config.settings import settings
 from storyapi.db import SourceId
+from storyapi.db.bills import Bills, BillsList
 from storyapi.db.repos.bills_sql import BillsRepositorySQL
 from storyapi.db.repos.marchants_sql import PlacesRepositorySQL, MerchantsRepositorySQL
+from storyapi.db.repos.sync_sql import SyncStateRepositorySQL, SyncCheckpointRepositorySQL
 from storyapi.service.bills import BillsListAPI, BillsAPI
+from storyapi.service.limiter import get_limiter
 from storyapi.service.merchants import MerchantsAPI
 
 
-def get_merchant(mid):
-    """take merchant from DB or API by ID"""
-    merch_repo_sql = MerchantsRepositorySQL()
+def get_merchant_places(mid) -> Tuple[str, List[str]]:
+    """take merchant with all its places from DB or API by ID"""
+    merch_repo_sql = MerchantsRepositorySQL.shared()
     if merchant := merch_repo_sql.view(mid):
-        places = PlacesRepositorySQL().index(
+        places = PlacesRepositorySQL.shared().index(
             filter={merch_repo_sql.primary_key: merchant.merchant_id}
         )
-        place = places.pop().place_id
 
-        return merchant.merchant_id, place
+        return merchant.merchant_id, [p.place_id for p in places]
 
     merchant = MerchantsAPI().get_story_api_data(mid)
     # story merchant to MSSQL DB
     merch_repo_sql.create_with_fk(merchant)
-    place = merchant.places.pop().place_id
 
-    return merchant.merchant_id, place
+    return merchant.merchant_id, [p.place_id for p in merchant.places]
+
+
+def get_merchant(mid):
+    """take merchant and its last place from DB or API by ID"""
+    merchant_id, places = get_merchant_places(mid)
+
+    return merchant_id, places[-1]
+
+
+def get_sources(merchant_ids: List[str], **kwargs) -> List[SourceId]:
+    """ SourceId for every place of every merchant and both refunded streams
+
+    :param kwargs: SourceId fields common for all streams: from_date, till_date, limit
+    """
+
+    sources = []
+    for mid in merchant_ids:
+        merchant_id, places = get_merchant_places(mid)
+        for place_id in places:
+            for refunded in (False, True):
+                sources.append(SourceId(**dict(
+                    merchant_id=merchant_id,
+                    place_id=place_id,
+                    refunded=refunded,
+                    **kwargs
+                )))
+
+    return sources
 
 
 def get_store_bills(source_id: SourceId):
     """ get BillsList from API & store in DB. Ignored if exists """
 
     bills_list_repo = BillsListAPI()
-    bills_repo = BillsRepositorySQL()
+    bills_repo = BillsRepositorySQL.shared()
 
     while True:
         bills_list = bills_list_repo.get_story_api_data(source_id)
@@ -63,31 +99,274 @@ def get_store_bills_batch(source_id: SourceId):
     """ get BillsList from API & store in DB. Ignored if exists """
 
     bills_list_repo = BillsListAPI()
-    bills_repo = BillsRepositorySQL()
+    bills_repo = BillsRepositorySQL.shared()
 
     while True:
         bills_list = bills_list_repo.get_story_api_data(source_id)
         bills_list.check_place_id(place_id=source_id.place_id)
-        message = "\n".join([f"{bll.bill_id} {bll.created_at} imported" for bll in bills_list.data])
-        try:
-            bills_repo.create_batch_with_fk(bills_list.data)
-            print(message)
-        except CrudDataMSSQLError as e:
-            # print(str(e))   # if DEBUG
-            # already in DB
-            print(f"Already in DB:\n{message}")
-            pass
+        store_bills_page(bills_list, bills_repo)
 
         if not bills_list.next_page:
             break
         source_id = bills_list.next_page
 
 
+def iter_bills_pages(source_id: SourceId):
+    """ fetch & parse stage: page bytes are parsed once to BillsList, its nextPage is
+    requested while the writer stores the page
+
+    :raises: httpx.HTTPStatusError, pydantic.ValidationError if the body is not a page
+    """
+
+    bills_list_repo = BillsListAPI()
+
+    while source_id is not None:
+        response = bills_list_repo.get_story_api_response(source_id)
+        response.raise_for_status()  # error body must not end the chain (and drop checkpoint)
+        bills_list = BillsList.model_validate_json(response.content)
+        yield bills_list.check_place_id(place_id=source_id.place_id)
+
+        source_id = bills_list.next_page
+
+
+def iter_bills_chunks(source_id: SourceId, size: int = settings.story_api_stream_chunk):
+    """ fetch & parse stage of streamed pages: BillsList of at most size bills, memory does not
+    depend on page limit. nextPage of chunk is resume point: the same page for all but last chunk
+    """
+
+    bills_list_repo = BillsListAPI()
+
+    while source_id is not None:
+        with bills_list_repo.stream_bills(source_id) as page:
+            chunk = []
+            for bll in page:
+                chunk.append(bll)
+                if len(chunk) >= size:
+                    yield BillsList(data=chunk, nextPage=source_id)
+                    chunk = []
+        yield BillsList(data=chunk, nextPage=page.next_page)
+
+        source_id = page.next_page
+
+
+def get_bills_stages(source_id: SourceId) -> Tuple[Iterable, Tuple]:
+    """ pipeline source & stages producing BillsList: pages are parsed in fetch stage """
+
+    if settings.story_api_stream_pages:
+        return iter_bills_chunks(source_id), ()
+
+    return iter_bills_pages(source_id), ()
+
+
+def store_bills_page(
+        bills_list: BillsList,
+        bills_repo: BillsRepositorySQL,
+        checkpoint_key: str | None = None
+):
+    """ DB writer stage: BillsList page to DB. Ignored if exists.
+    nextPage checkpoint is committed in the same transaction with the page
+    """
+
+    with_cursor = None
+    if checkpoint_key is not None:
+        with_cursor = functools.partial(
+            SyncCheckpointRepositorySQL.shared().save_with_cursor, checkpoint_key, bills_list.next_page
+        )
+
+    res = bills_repo.upsert_batch_with_fk(bills_list.data, with_cursor=with_cursor)
+    inserted = set(res[INSERTED_FIELD])
+    print("\n".join([
+        f"{bll.bill_id} {bll.created_at} {'imported' if bll.bill_id in inserted else 'already in DB'}"
+        for bll in bills_list.data
+    ]))
+
+
+def get_store_bills_pipeline(
+        source_id: SourceId,
+        maxsize: int = settings.story_api_prefetch_pages,
+        resume: bool = settings.story_api_checkpoints
+) -> PipelineStats:
+    """ get BillsList from API & store in DB with overlapped fetch / parse / write stages
+
+    :param resume: start from last committed nextPage of the same request (stream & date window)
+    """
+
+    bills_repo = BillsRepositorySQL.shared()
+    checkpoint_key = None
+    if resume:
+        checkpoint_key = source_id.get_checkpoint_key()
+        if (next_page := SyncCheckpointRepositorySQL.shared().get_next_page(checkpoint_key)) is not None:
+            print(f"Resume {checkpoint_key} from {next_page.last_bill_id=}")
+            source_id = next_page
+
+    source, stages = get_bills_stages(source_id)
+    stats = Pipeline(maxsize=maxsize).run(
+        source,
+        *stages,
+        ("write", functools.partial(
+            store_bills_page, bills_repo=bills_repo, checkpoint_key=checkpoint_key
+        )),
+    )
+    print(f"Pipeline stats {source_id.get_source_id()} refunded={source_id.refunded}:\n{stats}")
+
+    return stats
+
+
+def print_source_progress(task_result: TaskResult, done: int, total: int):
+    source = task_result.task
+    state = (
+        f"pages={task_result.result.stages[0].items}" if task_result.ok
+        else f"FAILED after {task_result.attempts} attempts: {task_result.error}"
+    )
+    print(
+        f"[{done}/{total}] {source.get_source_id()} refunded={source.refunded} "
+        f"{source.from_date} - {source.till_date} {state}"
+    )
+
+
+def get_store_bills_sharded(
+        source_id: SourceId,
+        shards: int = settings.story_api_shards,
+        retries: int = settings.story_api_shard_retries
+) -> List[TaskResult]:
+    """ historical backfill: split source_id date range to shards,
+    every shard pagination chain runs in own process & retried independently.
+    Checkpoints: restarted backfill reuses date window of unfinished run (same shards)
+    """
+
+    if settings.story_api_checkpoints:
+        source_id = SyncCheckpointRepositorySQL.shared().resume_window(source_id)
+    results = run_parallel(
+        get_store_bills_pipeline,
+        source_id.split_by_date(shards),
+        max_workers=shards,
+        retries=retries,
+        progress=print_source_progress
+    )
+    pages = sum(r.result.stages[0].items for r in results if r.ok)
+    failed = [r.task for r in results if not r.ok]
+    print(f"Backfill {source_id.get_source_id()} {pages=} shards={len(results)} failed={len(failed)}")
+    if settings.story_api_checkpoints and not failed:
+        SyncCheckpointRepositorySQL.shared().finish_window(source_id)
+
+    return results
+
+
+def unique_bills(*bills_lists: Iterable[Dict]) -> List[Dict]:
+    """ bills of all lists, first one of the same bill_id: details are requested once per bill """
+
+    bills = {}
+    for bll in itertools.chain(*bills_lists):
+        bills.setdefault(bll["bill_id"], bll)
+
+    return list(bills.values())
+
+
+def get_store_bills_stream(source_id: SourceId) -> PipelineStats:
+    """ BillsList and Bill details of one (merchant, place, refunded) stream """
+
+    updated_ids = []
+    if settings.story_api_incremental_sync:
+        stats, updated_ids = get_store_bills_incremental(source_id)
+    elif settings.story_api_checkpoints:
+        # restarted run resumes date window & checkpoint of unfinished one
+        source_id = SyncCheckpointRepositorySQL.shared().resume_window(source_id)
+        stats = get_store_bills_pipeline(source_id)
+        SyncCheckpointRepositorySQL.shared().finish_window(source_id)
+    else:
+        stats = get_store_bills_pipeline(source_id)
+    # get list of imported bills from DB & changed ones
+    bills = unique_bills(
+        BillsRepositorySQL.shared().get_wo_items(source_id),
+        ({"bill_id": bill_id} for bill_id in updated_ids)
+    )
+    get_store_bill_details_concurrent(bills, source_id)
+    # stream runs in own process: requests of this process against API quota
+    print(f"API quota {source_id.get_source_id()}: {get_limiter(settings.story_api_client_id)}")
+
+    return stats
+
+
+def get_store_merchants(
+        sources: List[SourceId],
+        max_streams: int = settings.story_api_streams,
+        max_per_merchant: int = settings.story_api_streams_per_merchant
+) -> List[TaskResult]:
+    """ fan-out: all streams concurrently, each in own process,
+    at most max_per_merchant streams of the same merchant at a time
+    """
+
+    if settings.story_api_checkpoints:
+        SyncCheckpointRepositorySQL.shared().delete_stale(timedelta(days=settings.story_api_checkpoint_max_age))
+    results = run_parallel(
+        get_store_bills_stream,
+        sources,
+        max_workers=max_streams,
+        retries=settings.story_api_shard_retries,
+        progress=print_source_progress,
+        key=operator.attrgetter("merchant_id"),
+        max_per_key=max_per_merchant
+    )
+    failed = [r.task for r in results if not r.ok]
+    print(f"Streams done={len(results) - len(failed)} failed={len(failed)}")
+
+    return results
+
+
+def get_store_bills_incremental(source_id: SourceId) -> Tuple[PipelineStats, List[str]]:
+    """ get only bills modified since last run (per stream watermark) & upsert them in DB
+
+    :return: pipeline stats, bill_id's of updated bills: details must be requested again
+    """
+
+    sync_repo = SyncStateRepositorySQL.shared()
+    bills_repo = BillsRepositorySQL.shared()
+    if (watermark := sync_repo.get_watermark(source_id)) is not None:
+        source_id = source_id.model_copy(update=dict(modified_since=watermark))
+
+    updated_ids = []
+    modified = []
+
+    def upsert_bills_page(bills_list: BillsList):
+        created, updated = bills_repo.insert_update_batch_with_fk(bills_list.data)
+        updated_ids.extend(updated)
+        modified.extend(
+            to_naive_utc(bll.last_modified_at) for bll in bills_list.data if bll.last_modified_at
+        )
+        print(f"{source_id.get_sync_key()} created={len(created)} updated={len(updated)}")
+
+    source, stages = get_bills_stages(source_id)
+    stats = Pipeline(maxsize=settings.story_api_prefetch_pages).run(
+        source,
+        *stages,
+        ("write", upsert_bills_page),
+    )
+
+    # whole chain stored: move watermark forward
+    if modified:
+        sync_repo.set_watermark(source_id, max(modified))
+
+    return stats, updated_ids
+
+
+def store_bill_details(bills_repo: BillsRepositorySQL, bll_details: Bills):
+    """ bill will be updated; other dependencies -> delete/insert """
+
+    bills_pk = BillsRepositorySQL.primary_key
+    bills_repo.update_with_fk(
+        bll_details, query={bills_pk: getattr(bll_details, bills_pk)}
+    )
+    print(
+        f"{bll_details.bill_id} {bll_details.created_at} "
+        f"add items: {','.join([i.name for i in bll_details.items])}"
+    )
+
+
 def get_store_bill_details(bill_ids_list: List[Dict], source_id: SourceId):
     """ request Bill details from API & store in DB """
 
     bills_api = BillsAPI()
-    bills_repo = BillsRepositorySQL()
+    bills_repo = BillsRepositorySQL.shared()
 
     for bll in bill_ids_list:
         # bet Detailed Bill
@@ -95,48 +374,53 @@ def get_store_bill_details(bill_ids_list: List[Dict], source_id: SourceId):
         if not bll_details:
             print(f"Unable to get details for bill {bll.get('bill_id')}")
             continue
-        # bill will be updated; other dependencies -> delete/insert
-        bills_pk = BillsRepositorySQL.primary_key
-        bills_repo.update_with_fk(
-            bll_details, query={bills_pk: getattr(bll_details, bills_pk)}
-        )
-        print(
-            f"{bll_details.bill_id} {bll_details.created_at} "
-            f"add items: {','.join([i.name for i in bll_details.items])}"
-        )
+        store_bill_details(bills_repo, bll_details)
+
+
+async def aget_store_bill_details(
+        bill_ids_list: List[Dict],
+        source_id: SourceId,
+        max_in_flight: int = settings.story_api_max_in_flight
+):
+    """ request Bill details concurrently & store in DB each one as soon as it arrives """
+
+    bills_api = BillsAPI()
+    bills_repo = BillsRepositorySQL.shared()
+
+    args_list = ((source_id, bll.get("bill_id")) for bll in bill_ids_list)
+    async for (_, bill_id), bll_details in bills_api.aiter_story_api_data(args_list, max_in_flight):
+        if not bll_details:
+            print(f"Unable to get details for bill {bill_id}")
+            continue
+        # DB writer in thread: requests in flight are not blocked by MSSQL
+        await asyncio.to_thread(store_bill_details, bills_repo, bll_details)
+
+
+def get_store_bill_details_concurrent(
+        bill_ids_list: List[Dict],
+        source_id: SourceId,
+        max_in_flight: int = settings.story_api_max_in_flight
+):
+    """ sync entry point for aget_store_bill_details """
+
+    asyncio.run(aget_store_bill_details(bill_ids_list, source_id, max_in_flight))
 
 
 if __name__ == '__main__':
 
     # check parameters
 
-    # take merchant_id, place_id from API by ID
-    merchant_id, place_id = get_merchant(settings.story_api_merchant_id)
-
-    # prepare data for request
-    source = SourceId(**dict(
-        merchant_id=merchant_id,
-        place_id=place_id,
+    # take all places of merchants from API by ID: comma separated merchant IDs
+    # and prepare data for request: every place, not refunded & refunded bills
+    sources_list = get_sources(
+        settings.story_api_merchant_id.split(','),
         from_date=datetime.utcnow() - timedelta(
             days=2  # week == 1 return 7 bills
         ),  # ISO format,
         till_date=datetime.utcnow(),
-        limit=10,
-        refunded=False
-    ))
+        limit=10
+    )
 
     # get all bill_id's from data range and ignore it on importing before send to DB
-    # get_store_bills(source)
-    get_store_bills_batch(source)
-
-    # get list of imported bills from DB
-    bills = BillsRepositorySQL().get_wo_items(source)
-    get_store_bill_details(bills, source)
-
-    source.refunded = True
-    source.last_bill_id = None
-
-    # get_store_bills(source)
-    get_store_bills_batch(source)
-    bills = BillsRepositorySQL().get_wo_items(source)
-    get_store_bill_details(bills, source)
+    # & get bill details for imported bills w/o items
+    get_store_merchants(sources_list)
@@ -1,5 +1,5 @@
 import re
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Any
 from urllib.parse import quote
 
@@ -66,3 +66,12 @@ def convert_datetime(v: str) -> datetime | str:
         return datetime.strptime(v, ISO_FORMAT)
 
     return v
+
+
+def to_naive_utc(v: datetime) -> datetime:
+    """ MSSQL datetime column & SourceId serializer expect naive UTC """
+
+    if v.tzinfo is not None:
+        return v.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return v
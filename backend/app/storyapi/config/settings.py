@@ -12,6 +12,28 @@ class Settings(BaseSettings):
     story_api_client_id: Optional[str]
     story_api_client_secret: Optional[str]
     story_api_merchant_id: Optional[str]
+    story_api_max_in_flight: int = 10  # concurrent API requests
+    story_api_max_connections: int = 20  # shared HTTP client pool (keep-alive)
+    story_api_keepalive_expiry: float = 30.  # sec, idle connection kept open
+    story_api_connect_timeout: float = 10.  # sec
+    story_api_read_timeout: float = 30.  # sec
+    story_api_http2: bool = True  # if h2 package installed
+    story_api_rate_limit: float = 10.  # requests per sec per client_id (token bucket)
+    story_api_rate_burst: int = 20
+    story_api_min_concurrency: int = 1  # AIMD concurrency: min .. story_api_max_in_flight
+    story_api_target_latency: float = 2.  # sec, slower response halves concurrency
+    story_api_error_pause: float = 10.  # sec, all requests paused after connection error
+    story_api_token_refresh_before: float = 60.  # sec before expires_at: background token refresh
+    story_api_prefetch_pages: int = 2  # bounded queue size between fetch / parse / write stages
+    story_api_stream_pages: bool = False  # parse bills while page is read (large limit): memory is flat
+    story_api_stream_chunk: int = 100  # bills per DB write of streamed page
+    story_api_shards: int = 4  # parallel date windows for historical backfill
+    story_api_shard_retries: int = 2
+    story_api_streams: int = 4  # parallel (merchant, place, refunded) streams
+    story_api_streams_per_merchant: int = 2
+    story_api_incremental_sync: bool = False  # modifiedSince from storyous.sync_state table
+    story_api_checkpoints: bool = False  # resume pagination from storyous.sync_checkpoint table
+    story_api_checkpoint_max_age: float = 7.  # days, checkpoints of abandoned runs are deleted
 
 
 settings = Settings()
@@ -1,12 +1,15 @@
 from datetime import datetime
+from typing import List
 from urllib.parse import unquote
 
 from fastapi_utils.api_model import APIModel
 from pydantic import Field, field_serializer, model_validator
 
-from storyapi.config import ISO_FORMAT
+from storyapi.config import ISO_FORMAT, to_naive_utc
 
 source_set = {"merchant_id", 'place_id'}
+CHECKPOINT_FORMAT = '%Y%m%d%H%M%S'
+RUN_KEY = 'run'
 
 
 class SourceId(APIModel):
@@ -27,6 +30,22 @@ class SourceId(APIModel):
         source_id = self.model_dump(include=source_set, by_alias=True)
         return '-'.join(list(source_id.values()))
 
+    def get_sync_key(self) -> str:
+        """ (merchant, place, refunded) stream key for incremental sync state """
+        return f"{self.get_source_id()}-{int(bool(self.refunded))}"
+
+    def get_checkpoint_key(self) -> str:
+        """ stream & date window: same backfill request after restart has same key """
+        window = '-'.join(
+            to_naive_utc(d).strftime(CHECKPOINT_FORMAT) if d else ''
+            for d in (self.from_date, self.till_date)
+        )
+        return f"{self.get_sync_key()}-{window}"
+
+    def get_run_key(self) -> str:
+        """ stream key of unfinished run date window: restarted run reuses the window (and checkpoints) """
+        return f"{self.get_sync_key()}-{RUN_KEY}"
+
     @staticmethod
     def parse_source_id(url_encoded: str):
         """ Parse url encoded string to SourceId
@@ -41,6 +60,34 @@ class SourceId(APIModel):
 
         return SourceId(sourceId=source_id, **param_dict)  # Ignore
 
+    def get_run_window(self) -> 'SourceId':
+        """ date window in whole seconds (serialized precision): saved & resumed window are equal,
+        so shards & their checkpoint keys are the same after restart
+        """
+        return self.model_copy(update={
+            field: value.replace(microsecond=0)
+            for field in ('from_date', 'till_date') if (value := getattr(self, field)) is not None
+        })
+
+    def split_by_date(self, shards: int) -> List['SourceId']:
+        """ Split [from_date, till_date] to contiguous date windows: window ends where the next one
+        starts, so no bill falls between them (bill at boundary is in both: upsert ignores it).
+        from_date & till_date are kept as they are; window is at least 1 sec long
+
+        :return: list of SourceId without lastBillId cursor, one per window
+        """
+        if self.from_date is None or self.till_date is None:
+            raise ValueError(f"{self.from_date=} and {self.till_date=} must be defined")
+
+        span = self.till_date - self.from_date
+        shards = max(1, min(shards, int(span.total_seconds())))
+        bounds = [self.from_date + span * i / shards for i in range(shards)] + [self.till_date]
+
+        return [
+            self.model_copy(update=dict(from_date=start, till_date=end, last_bill_id=None))
+            for start, end in zip(bounds, bounds[1:])
+        ]
+
     @field_serializer('from_date', 'till_date', 'modified_since', when_used='always')
     def dump_datetime(self, v):
         return v.strftime(ISO_FORMAT)
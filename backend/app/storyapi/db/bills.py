@@ -1,8 +1,9 @@
 import json
-from typing import List, Any
+from datetime import datetime
+from typing import List
 
 from fastapi_utils.api_model import APIModel
-from pydantic import Field, model_validator
+from pydantic import AliasChoices, Field, ValidationInfo, field_validator, model_validator
 
 from storyapi.db import SourceId
 from storyapi.db.bills_sql import (
@@ -12,7 +13,8 @@ from storyapi.db.bills_sql import (
 
 
 class Taxes(TaxesSQL):
-    """ Same as TaxesSQL """
+    """ Same as TaxesSQL, bill_id is set by Bills """
+    bill_id: str | None = Field(default=None, alias='billId')
 
 
 class Person(PersonSQL):
@@ -20,23 +22,28 @@ class Person(PersonSQL):
 
 
 class Payments(PaymentsSQL):
-    """ Same as PaymentSQL """
+    """ Same as PaymentSQL, bill_id is set by Bills """
+    bill_id: str | None = Field(default=None, alias='billId')
 
 
 class OrderProvider(OrderProviderSQL):
-    """ same as OrderProviderSQL """
+    """ same as OrderProviderSQL, bill_id is set by Bills """
+    bill_id: str | None = Field(default=None, alias='billId')
 
 
 class FiscalData(FiscalDataSQL):
-    """ Same as FiscalData """
+    """ Same as FiscalData, bill_id is set by Bills """
+    bill_id: str | None = Field(default=None, alias='billId')
 
 
 class InvoiceData(InvoiceDataSQL):
-    """ same as InvoiceDataSQL """
+    """ same as InvoiceDataSQL, bill_id is set by Bills """
+    bill_id: str | None = Field(default=None, alias='billId')
 
 
 class Items(ItemsSQL):
-    """ same as ItemsSQL """
+    """ same as ItemsSQL, bill_id is set by Bills """
+    bill_id: str | None = Field(default=None, alias='billId')
 
 
 class Bills(BillsSQL):
@@ -92,49 +99,54 @@ class Bills(BillsSQL):
         json_schema_extra=dict(foreign_key="bill_id")
     )
 
-    @model_validator(mode="before")
-    def fill_empty_fields(cls, v):
-        if lma := v.get("_lastModifiedAt"):
-            v["lastModifiedAt"] = lma
+    last_modified_at: datetime | None = Field(
+        default=None,
+        alias='lastModifiedAt',
+        validation_alias=AliasChoices('_lastModifiedAt', 'lastModifiedAt', 'last_modified_at')
+    )
 
-        bill_id = v.get("billId", None)
-        if bill_id and v.get("taxes", None):
-            for i in range(len(v["taxes"])):
-                v["taxes"][i]["bill_id"] = bill_id
+    @field_validator('fiscal_data', 'order_provider', mode='before')
+    def to_list(cls, v):
+        """ API sends one object, DB stores 1:M """
+        if isinstance(v, dict):
+            return [v]
+        return v
 
-        if bill_id and v.get("payments", None):
-            for i in range(len(v["payments"])):
-                v["payments"][i]["bill_id"] = bill_id
+    @field_validator('invoice_data', mode='before')
+    def invoice_to_list(cls, v, info: ValidationInfo):
+        """ whole invoice is stored as json in data field, invoice fields are kept """
+        if isinstance(v, dict):
+            if bill_id := info.data.get("bill_id"):
+                v["bill_id"] = bill_id
+            return [v | dict(data=json.dumps(v, default=str))]
+        return v
 
-        if bill_id and v.get("items", None):
-            for i in range(len(v["items"])):
-                v["items"][i]["bill_id"] = bill_id
+    @model_validator(mode="after")
+    def set_bill_id(self):
+        """ 1:M records get bill_id of parent bill (API does not send it) """
+        for field in (self.taxes, self.payments, self.items, self.fiscal_data, self.order_provider, self.invoice_data):
+            for record in field or ():
+                record.bill_id = self.bill_id
 
-        if (fiskd := v.get("fiscalData")) is not None and isinstance(fiskd, dict):
-            if bill_id:
-                fiskd["bill_id"] = bill_id
-            v["fiscalData"] = [fiskd]
+        return self
 
-        if (ordprov := v.get("orderProvider")) is not None and isinstance(ordprov, dict):
-            if bill_id:
-                ordprov["bill_id"] = bill_id
-            v["orderProvider"] = [ordprov]
 
-        if (idata := v.get("invoiceData")) is not None and isinstance(idata, dict):
-            if bill_id:
-                idata["bill_id"] = bill_id
-            idata["data"] = json.dumps(idata, default=str)
-            v["invoiceData"] = [idata]
+class NextPage(APIModel):
+    """ BillsList w/o data: other fields of page are skipped by JSON parser """
+    next_page: SourceId | None = Field(default=None, alias='nextPage')
 
+    @field_validator('next_page', mode='before')
+    def parse_next_page(cls, v):
+        if isinstance(v, str):
+            return SourceId.parse_source_id(v)
         return v
 
 
-class BillsList(APIModel):
+class BillsList(NextPage):
     """
     nextPage: "/bills/5a75b658f60a3c15009312f1-5a75b658f60a3c15009312f2?lastBillId=BA2018000001"
     """
     data: List[Bills] = Field(default_factory=list, alias='data')
-    next_page: Any | None = Field(default=None, alias='nextPage')
     ok: bool | None = Field(default=None)
 
     def check_place_id(self, place_id: str):
@@ -144,12 +156,11 @@ class BillsList(APIModel):
 
         return self
 
-    @model_validator(mode="before")
-    def fill_empty_fields(cls, v):
-        if (next_page := v.get("nextPage", None)) is not None and isinstance(next_page, str):
-            source = SourceId.parse_source_id(next_page)
-            for i in range(len(v["data"])):
-                v["data"][i]["place_id"] = source.place_id
-            v["nextPage"] = source
+    @model_validator(mode="after")
+    def set_place_id(self):
+        if isinstance(self.next_page, SourceId):
+            for bill in self.data:
+                bill.place_id = self.next_page.place_id
+
+        return self
 
-        return v
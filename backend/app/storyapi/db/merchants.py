@@ -66,7 +66,7 @@ class Merchant(MerchantsSQL):
             client_id = settings.story_api_client_id
 
         if settings.mssql_server and client_id is not None:
-            values["client_id"] = ClientsAndAuthRepositorySQL().view({
+            values["client_id"] = ClientsAndAuthRepositorySQL.shared().view({
                 "client_id": client_id
             })
             values["client_id"].secret = ''
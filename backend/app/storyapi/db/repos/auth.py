@@ -7,6 +7,7 @@ class ClientsAndAuthRepositorySQL(RepositoryMSSQL[AuthSQL]):
     primary_key = "client_id"
     pk_remove_on_create = False
     encrypt_secret = False
+    cache_view = True
 
     def insert_update(self, data: AuthSQL):
         if self.encrypt_secret and (secret := getattr(data, 'secret', None)) is not None:
@@ -1,13 +1,16 @@
-from typing import Union, List, Dict
+from __future__ import annotations
 
-from pymssql import Cursor as pymssql_Cursor
-from pyodbc import Cursor as pyodbc_Cursor
+from typing import TYPE_CHECKING, Union, List, Dict
 
 from common.db.mssql import RepositoryMSSQL
 from storyapi.db import SourceId
 from storyapi.db.bills_sql import TaxesSQL, PersonSQL, PaymentsSQL, OrderProviderSQL, FiscalDataSQL, InvoiceDataSQL, \
     ItemsSQL, BillsSQL
 
+if TYPE_CHECKING:
+    from pymssql import Cursor as pymssql_Cursor
+    from pyodbc import Cursor as pyodbc_Cursor
+
 
 class TaxesRepositorySQL(RepositoryMSSQL[TaxesSQL]):
     """ Use DB_PRIMARY_KEY as default primary key """
@@ -17,6 +20,8 @@ class PersonRepositorySQL(RepositoryMSSQL[PersonSQL]):
     """ External primary key: do not pointed it """
     pk_remove_on_create = False
     primary_key = "person_id"
+    cache_view = True
+    known_keys_index = True
 
 
 class PaymentsRepositorySQL(RepositoryMSSQL[PaymentsSQL]):
@@ -71,8 +76,10 @@ class BillsRepositorySQL(RepositoryMSSQL[BillsSQL]):
         """ + f"""
             AND {self.json_to_sql.field_value_parser(source.from_date, div='')} <= bills.created_at
             AND {self.json_to_sql.field_value_parser(source.till_date, div='')} >= bills.created_at
+            AND bills.place_id = {self.json_to_sql.field_value_parser(source.place_id)}
+            AND ISNULL(bills.refunded, 0) = {int(bool(source.refunded))}
         """ if source else ""
 
-        data = self.exec_fetch_all(sql_query)
+        data = self.exec_fetch_all(sql_query) or []
 
-        return data
+        return [dict(row) for row in data]
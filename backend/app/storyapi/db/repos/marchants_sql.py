@@ -11,6 +11,8 @@ class PlacesRepositorySQL(RepositoryMSSQL[PlacesSQL]):
     primary_key = "place_id"
     pk_remove_on_create = False
     excluded_fields = {"address_parts"}
+    cache_view = True
+    known_keys_index = True
 
 
 class MerchantsRepositorySQL(RepositoryMSSQL[MerchantsSQL]):
@@ -18,3 +20,4 @@ class MerchantsRepositorySQL(RepositoryMSSQL[MerchantsSQL]):
     primary_key = "merchant_id"
     pk_remove_on_create = False
     excluded_fields = {"places"}
+    cache_view = True
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+from common.db.mssql import RepositoryMSSQL, with_transaction, reconnect_on_exception
+from storyapi.config import to_naive_utc
+from storyapi.db import SourceId
+from storyapi.db.sync_sql import SyncStateSQL, SyncCheckpointSQL
+
+
+class SyncStateRepositorySQL(RepositoryMSSQL[SyncStateSQL]):
+    """ External primary key: do not pointed it """
+    primary_key = "source_key"
+    pk_remove_on_create = False
+
+    def get_watermark(self, source: SourceId) -> datetime | None:
+        """ modifiedSince for the next incremental request of source stream """
+
+        if (state := self.view(source.get_sync_key())) is None:
+            return None
+
+        return state.modified_since
+
+    def set_watermark(self, source: SourceId, modified_since: datetime):
+        """ store as naive UTC: MSSQL datetime column has no time zone.
+        Watermark only moves forward: older value is ignored (None returned)
+        """
+
+        modified_since = to_naive_utc(modified_since)
+        if (current := self.get_watermark(source)) is not None and to_naive_utc(current) >= modified_since:
+            return None
+
+        return self.insert_update(SyncStateSQL(
+            source_key=source.get_sync_key(),
+            merchant_id=source.merchant_id,
+            place_id=source.place_id,
+            refunded=bool(source.refunded),
+            modified_since=modified_since,
+            updated_at=datetime.utcnow()
+        ))
+
+
+class SyncCheckpointRepositorySQL(RepositoryMSSQL[SyncCheckpointSQL]):
+    """ External primary key: do not pointed it """
+    primary_key = "checkpoint_key"
+    pk_remove_on_create = False
+
+    def resume_window(self, source: SourceId) -> SourceId:
+        """ date window (whole seconds) of unfinished run of source stream; saved on the first start """
+
+        source = source.get_run_window()
+        if (run := self.get_next_page(source.get_run_key())) is not None:
+            print(f"Resume run {source.get_sync_key()} {run.from_date} - {run.till_date}")
+            return source.model_copy(update=dict(from_date=run.from_date, till_date=run.till_date))
+        self.save(source.get_run_key(), source)
+
+        return source
+
+    def finish_window(self, source: SourceId):
+        self.save(source.get_run_key(), None)
+
+    def delete_stale(self, max_age: timedelta):
+        """ checkpoints & run windows of abandoned runs """
+
+        return self.delete(query={"updated_at": {"$lt": datetime.utcnow() - max_age}})
+
+    def get_next_page(self, checkpoint_key: str) -> SourceId | None:
+        if (checkpoint := self.view(checkpoint_key)) is None:
+            return None
+
+        return SourceId.model_validate_json(checkpoint.next_page)
+
+    def save_with_cursor(self, checkpoint_key: str, next_page: SourceId | None, cursor):
+        """ replace checkpoint inside caller transaction; next_page None: chain finished """
+
+        self.delete_with_cursor(cursor, query={self.primary_key: checkpoint_key})
+        if next_page is not None:
+            self.create_with_cursor(SyncCheckpointSQL(
+                checkpoint_key=checkpoint_key,
+                next_page=next_page.model_dump_json(by_alias=True, exclude_none=True),
+                updated_at=datetime.utcnow()
+            ), cursor)
+
+    @with_transaction
+    @reconnect_on_exception
+    def save(self, checkpoint_key: str, next_page: SourceId | None):
+        with self.client.cursor() as cursor:
+            self.save_with_cursor(checkpoint_key, next_page, cursor)
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from fastapi_utils.api_model import APIModel
+from pydantic import Field
+
+
+class SyncStateSQL(APIModel):
+    """ Incremental sync high-water mark of (merchant, place, refunded) stream """
+    source_key: str = Field(..., alias='sourceKey')  # SourceId.get_sync_key()
+    merchant_id: str = Field(..., alias='merchantId')
+    place_id: str = Field(..., alias='placeId')
+    refunded: bool = Field(default=False, alias='refunded')
+    modified_since: datetime | None = Field(default=None, alias='modifiedSince')  # UTC
+    updated_at: datetime | None = Field(default=None, alias='updatedAt')
+
+
+class SyncCheckpointSQL(APIModel):
+    """ Last committed BillsList nextPage of pagination chain: resume point after crash """
+    checkpoint_key: str = Field(..., alias='checkpointKey')  # SourceId.get_checkpoint_key()
+    next_page: str = Field(..., alias='nextPage')  # SourceId json
+    updated_at: datetime | None = Field(default=None, alias='updatedAt')
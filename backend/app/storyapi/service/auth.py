@@ -1,17 +1,20 @@
-import functools
+import asyncio
+import json
 import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Generic, get_args
+from typing import Generic, get_args, Iterable, Iterator, AsyncIterator, Tuple
 
+import httpx
 import pydantic
-import requests
 
 from common.config import T
 from storyapi.config import param_to_str
 from storyapi.config.settings import settings
 from storyapi.db.auth import BearerToken, AuthSQL
-if settings.mssql_server:
-    from storyapi.db.repos.auth import ClientsAndAuthRepositorySQL
+from storyapi.service.client import get_http_client, get_async_client
+from storyapi.service.limiter import get_limiter, RateLimiter
+from storyapi.service.token import TokenManager
 
 headers: dict = {
     "Content-Type": "application/x-www-form-urlencoded"
@@ -24,58 +27,39 @@ payload: dict = {
 }
 
 
-def sql_enabled_decorator(func):
-    """ parameter if MSSQL_SERVER defined """
-    @functools.wraps(func)
-    def wrapper(token: BearerToken = None):
-        # Check token in DB
-        # token = token or wrapper.token
-        if (old_token := token) is None and settings.mssql_server:
-            repos = ClientsAndAuthRepositorySQL()
-            if (old_token := repos.view(
-                {repos.primary_key: payload.get(repos.primary_key)}
-            )) is not None:
-                token = BearerToken(**old_token.model_dump())
-
-        token = func(token=token)
-
-        # extra ignored by def AND is token changed
-        if token and (old_token is None or token.access_token != old_token.access_token):
-            # wrapper.token = token
-            if settings.mssql_server:
-                update_client_with_token(token)
+def load_db_token() -> BearerToken | None:
+    """ token stored by other process / previous run """
+    from storyapi.db.repos.auth import ClientsAndAuthRepositorySQL
 
-        return token
+    repos = ClientsAndAuthRepositorySQL.shared()
+    if (client := repos.view({repos.primary_key: payload.get(repos.primary_key)})) is None:
+        return None
 
-    # wrapper.token = None
-    return wrapper
+    return BearerToken(**client.model_dump())
 
 
 def update_client_with_token(token):
+    from storyapi.db.repos.auth import ClientsAndAuthRepositorySQL
+
     client_and_auth = AuthSQL(**(token.model_dump() | payload))
-    ClientsAndAuthRepositorySQL().insert_update(client_and_auth)
+    ClientsAndAuthRepositorySQL.shared().insert_update(client_and_auth)
 
 
 def is_token_expired(token) -> bool:
     return token is None or token.expires_at < datetime.now(timezone.utc)
 
 
-@sql_enabled_decorator
-def get_token(token: BearerToken = None) -> BearerToken | None:
-    """the tokens have to be cached on the OAuth client side"""
-
-    if not is_token_expired(token):
-        return token
+def login_token() -> BearerToken | None:
+    """ OAuth client credentials login: API call on every call """
 
     response = None
     while True:
         try:
             # may return not valid token
-            response = requests.request(
-                "POST",
+            response = get_http_client().post(
                 settings.story_api_login,
                 headers=headers,
-                data=param_to_str(payload)
+                content=param_to_str(payload)
             )
 
             token = BearerToken(**response.json())
@@ -85,21 +69,42 @@ def get_token(token: BearerToken = None) -> BearerToken | None:
             print(str(response.json()))
             time.sleep(10)
             continue
-        except requests.exceptions.JSONDecodeError:
-            if response and response.status_code != 200:
-                raise requests.HTTPError(response=response)
+        except json.JSONDecodeError:
+            if response is not None and response.status_code != 200:
+                raise httpx.HTTPStatusError(
+                    f"Token request failed: {response.status_code}",
+                    request=response.request,
+                    response=response
+                )
             return None
         else:
-            print(f"token changed {token.expires_at=}")
             return token
 
 
+# the tokens have to be cached on the OAuth client side: DB copy is shared with other processes
+token_manager = TokenManager(
+    login=login_token,
+    load=load_db_token if settings.mssql_server else None,
+    store=update_client_with_token if settings.mssql_server else None,
+    refresh_before=settings.story_api_token_refresh_before
+)
+
+
+def get_token(token: BearerToken = None) -> BearerToken | None:
+    """ in memory token, refreshed ahead of expiry: API login only if there is no valid one
+
+    :param token: caller copy; replaced by current one
+    """
+
+    return token_manager.get()
+
+
 class ABCStoryService(Generic[T]):
     """Abstract class for story service"""
 
     method: str = "GET"
     endpoint: str | None = None
-    token: BearerToken = get_token()
+    token: BearerToken | None = None  # acquired on first request
 
     def __init__(self):
         # super(ABCStoryService, self).__init__()
@@ -113,7 +118,7 @@ class ABCStoryService(Generic[T]):
 
     def get_url(self, *args, **kwargs) -> str:
         if not args:
-            raise requests.exceptions.InvalidURL(f"{args=} for {self.endpoint=} are not defined")
+            raise httpx.InvalidURL(f"{args=} for {self.endpoint=} are not defined")
 
         url = f"{settings.story_api_url}{self.endpoint}/{'/'.join(args)}"
         if kwargs:
@@ -121,36 +126,187 @@ class ABCStoryService(Generic[T]):
 
         return url
 
-    def get_story_api_data(self, *args, **kwargs) -> T | None:
+    def parse_story_api_data(self, data: bytes | dict | list | None) -> T | None:
+        """ API json to model; None if API answered with not expected structure
+
+        :param data: raw response body is validated by pydantic-core w/o intermediate dicts
+        """
+        if data is None:
+            return None
+        try:
+            if isinstance(data, (bytes, str)):
+                return self.model.model_validate_json(data)
+            return self.model(**data)
+        except TypeError as e:
+            print(str(e))
+            print(str(data))
+            return None
+        except pydantic.ValidationError as e:
+            if not any(error["type"] == "json_invalid" for error in e.errors()):
+                raise
+            print(str(data[:1000]))
+            return None
+
+    @property
+    def client(self) -> httpx.Client:
+        """ shared keep-alive connections pool """
+        return get_http_client()
+
+    @property
+    def limiter(self) -> RateLimiter:
+        """ API quota of client_id shared by all services & fetchers """
+        return get_limiter(settings.story_api_client_id)
+
+    def on_transport_error(self, e: Exception):
+        print(f"Error {e}; pause {settings.story_api_error_pause} sec")
+        self.limiter.pause(settings.story_api_error_pause)
+
+    def get_story_api_response(self, *args, stream: bool = False, **kwargs) -> httpx.Response:
         """Authorization:Bearer token
-        :raises: TypeError, ValueError, requests.exceptions.InvalidURL
+        :param stream: body is not read, caller must close response
+        :raises: ValueError, httpx.InvalidURL
         """
         url = self.get_url(*args, **kwargs)
-        response = None
+        unauthorized = False
         while True:
             try:
                 token = get_token(token=self.token)
-                response = requests.request(
+                request = self.client.build_request(
                     self.method,
                     url,
                     headers={"Authorization": f"{token.token_type} {token.access_token}"}
                 )
-                res = self.model(**response.json())
+                with self.limiter.request() as ticket:
+                    response = self.client.send(request, stream=stream)
+                    ticket.done(response.status_code, response.headers.get("Retry-After"))
+                if ticket.throttled:
+                    print(f"Throttled {response.status_code}: {self.limiter}")
+                    response.close()
+                    continue
+                if response.status_code == 401 and not unauthorized:
+                    # token revoked before expires_at: login once again
+                    unauthorized = True
+                    token_manager.invalidate(token)
+                    response.close()
+                    continue
                 self.token = token
 
-            except TypeError as e:
-                print(str(e))
-                if response and response.status_code == 200:
-                    print(str(response.json()))
-                return None
-            except requests.exceptions.JSONDecodeError:
-                if response and response.status_code == 200:
-                    print(str(response.text))
-                return None
-            except (requests.exceptions.ConnectionError,
-                    requests.exceptions.SSLError) as e:
+            except httpx.TransportError as e:
                 # start from last bill
-                print(f"Error {e}; sleep 10 sec")
-                time.sleep(10)
+                self.on_transport_error(e)
             else:
-                return res
+                return response
+
+    def get_story_api_json(self, *args, **kwargs) -> dict | list | None:
+        """Authorization:Bearer token
+        :raises: ValueError, httpx.InvalidURL
+        """
+        response = self.get_story_api_response(*args, **kwargs)
+        try:
+            return response.json()
+        except json.JSONDecodeError:
+            if response.status_code == 200:
+                print(str(response.text))
+            return None
+
+    def get_story_api_content(self, *args, **kwargs) -> bytes | None:
+        """ raw (decompressed) response body for parse_story_api_data
+        :raises: ValueError, httpx.InvalidURL
+        """
+        return self.get_story_api_response(*args, **kwargs).content or None
+
+    @contextmanager
+    def stream_story_api_content(self, *args, **kwargs) -> Iterator[Iterator[bytes]]:
+        """ response body (decompressed) chunks while they arrive: body is never buffered whole
+        :raises: ValueError, httpx.InvalidURL, httpx.HTTPStatusError (not 2xx: error body is not a page)
+        """
+        response = self.get_story_api_response(*args, stream=True, **kwargs)
+        try:
+            response.raise_for_status()
+            yield response.iter_bytes()
+        finally:
+            response.close()
+
+    def get_story_api_data(self, *args, **kwargs) -> T | None:
+        """Authorization:Bearer token
+        :raises: TypeError, ValueError, httpx.InvalidURL
+        """
+        return self.parse_story_api_data(self.get_story_api_content(*args, **kwargs))
+
+    async def aget_story_api_data(self, client: httpx.AsyncClient, *args, **kwargs) -> T | None:
+        """ Same as get_story_api_data over shared httpx.AsyncClient; None if API answered with error status
+        :raises: TypeError, ValueError, httpx.InvalidURL
+        """
+        url = self.get_url(*args, **kwargs)
+        unauthorized = False
+        while True:
+            try:
+                token = await token_manager.aget()
+                async with self.limiter.arequest() as ticket:
+                    response = await client.request(
+                        self.method,
+                        url,
+                        headers={"Authorization": f"{token.token_type} {token.access_token}"}
+                    )
+                    ticket.done(response.status_code, response.headers.get("Retry-After"))
+                if ticket.throttled:
+                    print(f"Throttled {response.status_code}: {self.limiter}")
+                    continue
+                if response.status_code == 401 and not unauthorized:
+                    # token revoked before expires_at: login once again
+                    unauthorized = True
+                    token_manager.invalidate(token)
+                    continue
+                self.token = token
+
+            except httpx.TransportError as e:
+                self.on_transport_error(e)
+            else:
+                if response.is_error:
+                    print(f"Error {response.status_code} {url}")
+                    return None
+                return self.parse_story_api_data(response.content or None)
+
+    async def aiter_story_api_data(
+            self,
+            args_list: Iterable[Tuple],
+            max_in_flight: int = settings.story_api_max_in_flight
+    ) -> AsyncIterator[Tuple[Tuple, T | None]]:
+        """ Request API for every args in args_list with at most max_in_flight requests at a time.
+
+        :return: (args, result) pairs in order of responses arrival;
+            result None if request failed (error status, not expected body): other requests go on
+        """
+        args_iter = iter(args_list)
+        results: asyncio.Queue = asyncio.Queue(maxsize=max_in_flight)
+        async with get_async_client(max_connections=max_in_flight) as client:
+
+            async def worker():
+                try:
+                    # one shared iterator: the next args is taken only when worker is free
+                    for args in args_iter:
+                        try:
+                            res = await self.aget_story_api_data(client, *args)
+                        except (pydantic.ValidationError, TypeError, ValueError) as e:
+                            print(f"Unexpected response for {args}: {e}")
+                            res = None
+                        await results.put((args, res))
+                except Exception as e:
+                    await results.put(e)
+                else:
+                    await results.put(None)
+
+            workers = [asyncio.create_task(worker()) for _ in range(max_in_flight)]
+            active = len(workers)
+            try:
+                while active:
+                    if (item := await results.get()) is None:
+                        active -= 1
+                        continue
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
@@ -1,5 +1,9 @@
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from common.services.json_stream import ArrayItems
 from storyapi.db import source_set, SourceId
-from storyapi.db.bills import Bills, BillsList
+from storyapi.db.bills import Bills, BillsList, NextPage
 from storyapi.service.auth import ABCStoryService
 
 
@@ -11,6 +15,29 @@ class BillsAPI(ABCStoryService[Bills]):
         return super().get_url(source_id, bill_id)
 
 
+class BillsPageStream:
+    """ Bills of one BillsList page, parsed one by one while the page is read:
+    memory does not depend on page limit. next_page is known when all bills are consumed
+
+    :raises: pydantic.ValidationError if the rest of body is not a page (chain must not end silently)
+    """
+
+    def __init__(self, chunks: Iterable[bytes], place_id: str | None = None):
+        self.chunks = chunks
+        self.place_id = place_id
+        self.items = ArrayItems("data")
+        self.next_page: SourceId | None = None
+
+    def __iter__(self) -> Iterator[Bills]:
+        for item in self.items.feed_all(self.chunks):
+            bill = Bills.model_validate_json(item)
+            if self.place_id is not None:
+                bill.place_id = self.place_id
+            yield bill
+
+        self.next_page = NextPage.model_validate_json(bytes(self.items.rest)).next_page
+
+
 class BillsListAPI(ABCStoryService[BillsList]):
     endpoint = "/bills"
 
@@ -18,3 +45,14 @@ class BillsListAPI(ABCStoryService[BillsList]):
         source_id = source.get_source_id()
         source_dump = source.model_dump(exclude=source_set, by_alias=True, exclude_none=True)
         return super(BillsListAPI, self).get_url(source_id, **source_dump)
+
+    @contextmanager
+    def stream_bills(self, source: SourceId) -> Iterator[BillsPageStream]:
+        """ usage:
+
+            with BillsListAPI().stream_bills(source_id) as page:
+                for bill in page: ...
+            source_id = page.next_page
+        """
+        with self.stream_story_api_content(source) as chunks:
+            yield BillsPageStream(chunks, place_id=source.place_id)
@@ -0,0 +1,51 @@
+"""
+Shared HTTP clients for Storyous API: connection pool, keep-alive,
+compressed responses, HTTP/2 if server (and h2 package) supports it
+"""
+import os
+from functools import lru_cache
+from importlib.util import find_spec
+
+import httpx
+
+from storyapi.config.settings import settings
+
+HTTP2 = settings.story_api_http2 and find_spec("h2") is not None
+# br is advertised only if httpx can decode it
+ACCEPT_ENCODING = "br, gzip, deflate" if find_spec("brotli") or find_spec("brotlicffi") else "gzip, deflate"
+API_TIMEOUT = httpx.Timeout(
+    settings.story_api_read_timeout,
+    connect=settings.story_api_connect_timeout,
+    pool=settings.story_api_read_timeout
+)
+API_HEADERS = {"Accept-Encoding": ACCEPT_ENCODING, "Accept": "application/json"}
+
+
+def get_limits(max_connections: int = settings.story_api_max_connections) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=settings.story_api_keepalive_expiry
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_http_client(pid: int) -> httpx.Client:
+    return httpx.Client(http2=HTTP2, limits=get_limits(), timeout=API_TIMEOUT, headers=API_HEADERS)
+
+
+def get_http_client() -> httpx.Client:
+    """ thread safe client shared by process (new one in forked child) """
+
+    return _get_http_client(os.getpid())
+
+
+def get_async_client(max_connections: int = settings.story_api_max_connections) -> httpx.AsyncClient:
+    """ async client is bound to event loop: one per asyncio.run """
+
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        limits=get_limits(max_connections),
+        timeout=API_TIMEOUT,
+        headers=API_HEADERS
+    )
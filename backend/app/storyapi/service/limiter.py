@@ -0,0 +1,219 @@
+"""
+Client side rate limiter for Storyous API (one per client_id):
+token bucket for request rate + AIMD concurrency limit.
+
+429 / 503 with Retry-After pauses the bucket for every fetcher of the client;
+slow or failed responses halve concurrency, fast ones add one slot per window.
+"""
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Optional
+
+from storyapi.config.settings import settings
+
+POLL = 0.05  # sec, max sleep while waiting for concurrency slot
+THROTTLE_STATUSES = {429, 503}
+RETRY_AFTER_DEFAULT = 1.  # sec, if 429 comes without Retry-After
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """ Retry-After: seconds or HTTP date """
+
+    if not value:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0., (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class LimiterStats:
+    requests: int = 0
+    throttled: int = 0
+    errors: int = 0
+    wait: float = 0.
+    started_at: float = 0.
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.requests / elapsed if elapsed > 0 else 0.
+
+
+class RateLimiter:
+    """ usage:
+
+        with limiter.request() as ticket:
+            response = client.get(url)
+            ticket.done(response.status_code, response.headers.get("Retry-After"))
+
+        async with limiter.arequest() as ticket: ...
+
+    :param rate: requests per sec (bucket refill), burst: bucket size
+    :param target_latency: sec, slower response is congestion signal
+    """
+
+    def __init__(
+            self,
+            name: str,
+            rate: float,
+            burst: int,
+            min_concurrency: int = 1,
+            max_concurrency: int = 10,
+            target_latency: float = 2.
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.target_latency = target_latency
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.stats = LimiterStats(started_at=time.monotonic())
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_till = 0.
+        self._decreased_at = 0.
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> float:
+        """ :return: 0 if slot & token taken, else sec to wait """
+
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_till:
+                return self._paused_till - now
+            if self.in_flight >= int(self.limit):
+                return POLL
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+            self.in_flight += 1
+            self.stats.requests += 1
+
+        return 0.
+
+    def acquire(self):
+        started = time.monotonic()
+        while wait := self._try_acquire():
+            time.sleep(wait)
+        self.stats.wait += time.monotonic() - started
+
+    async def aacquire(self):
+        started = time.monotonic()
+        while wait := self._try_acquire():
+            await asyncio.sleep(wait)
+        self.stats.wait += time.monotonic() - started
+
+    def pause(self, seconds: float):
+        """ nobody sends request for seconds (Retry-After, server down) """
+
+        with self._lock:
+            self._paused_till = max(self._paused_till, time.monotonic() + seconds)
+
+    def _decrease(self, now: float):
+        """ multiplicative decrease, once per target_latency window """
+
+        if now - self._decreased_at >= self.target_latency:
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self._decreased_at = now
+
+    def release(
+            self,
+            latency: float,
+            status_code: Optional[int] = None,
+            retry_after: Optional[str] = None
+    ):
+        """ status_code None: transport error """
+
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if status_code in THROTTLE_STATUSES:
+                self.stats.throttled += 1
+                delay = parse_retry_after(retry_after)
+                self._paused_till = max(
+                    self._paused_till, now + (RETRY_AFTER_DEFAULT if delay is None else delay)
+                )
+                self._decrease(now)
+            elif status_code is None or status_code >= 500:
+                self.stats.errors += 1
+                self._decrease(now)
+            elif latency > self.target_latency:
+                self._decrease(now)
+            else:
+                # additive increase: +1 slot per limit successful responses
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    @contextmanager
+    def request(self):
+        self.acquire()
+        ticket = Ticket(self)
+        try:
+            yield ticket
+        finally:
+            ticket.close()
+
+    @asynccontextmanager
+    async def arequest(self):
+        await self.aacquire()
+        ticket = Ticket(self)
+        try:
+            yield ticket
+        finally:
+            ticket.close()
+
+    def __str__(self):
+        return (
+            f"{self.name}: requests={self.stats.requests} ({self.stats.rate():.1f}/s) "
+            f"throttled={self.stats.throttled} errors={self.stats.errors} "
+            f"wait={self.stats.wait:.1f}s concurrency={int(self.limit)}/{self.max_concurrency}"
+        )
+
+
+class Ticket:
+    """ one acquired request: done() with response, otherwise counted as transport error """
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+        self.started = time.monotonic()
+        self.status_code: Optional[int] = None
+        self.retry_after: Optional[str] = None
+
+    def done(self, status_code: int, retry_after: Optional[str] = None):
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self) -> bool:
+        return self.status_code in THROTTLE_STATUSES
+
+    def close(self):
+        self.limiter.release(time.monotonic() - self.started, self.status_code, self.retry_after)
+
+
+@lru_cache(maxsize=None)
+def get_limiter(client_id: Optional[str]) -> RateLimiter:
+    """ API quota is per client_id: one limiter per client in process """
+
+    return RateLimiter(
+        name=f"story_api[{client_id}]",
+        rate=settings.story_api_rate_limit,
+        burst=settings.story_api_rate_burst,
+        min_concurrency=settings.story_api_min_concurrency,
+        max_concurrency=settings.story_api_max_in_flight,
+        target_latency=settings.story_api_target_latency
+    )
@@ -0,0 +1,135 @@
+"""
+In memory bearer token: refreshed in background before expires_at,
+one login call for all concurrent callers, DB copy written behind
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from storyapi.db.auth import BearerToken
+
+
+class TokenManager:
+    """ usage:
+
+        manager = TokenManager(login=login_token, load=load_db_token, store=update_client_with_token)
+        token = manager.get()           # threads
+        token = await manager.aget()    # asyncio: event loop is not blocked
+
+    :param login: API login call, None if API answered without token
+    :param load: token stored in DB (read once, on first use)
+    :param store: save new token to DB (background writer thread)
+    :param refresh_before: sec before expires_at to refresh in background
+    """
+
+    def __init__(
+            self,
+            login: Callable[[], Optional[BearerToken]],
+            load: Optional[Callable[[], Optional[BearerToken]]] = None,
+            store: Optional[Callable[[BearerToken], None]] = None,
+            refresh_before: float = 60.
+    ):
+        self.login = login
+        self.load = load
+        self.store = store
+        self.refresh_before = refresh_before
+        self._token: Optional[BearerToken] = None
+        self._loaded = False
+        self._lock = threading.Lock()  # single flight login
+        self._state_lock = threading.Lock()  # never held during I/O
+        self._refreshing = False
+        self._timer: Optional[threading.Timer] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def token(self) -> Optional[BearerToken]:
+        return self._token
+
+    @staticmethod
+    def expires_in(token: Optional[BearerToken]) -> float:
+        if token is None:
+            return 0.
+        return (token.expires_at - datetime.now(timezone.utc)).total_seconds()
+
+    def get(self) -> Optional[BearerToken]:
+        """ blocks only if there is no valid token at all """
+
+        token = self._token
+        expires_in = self.expires_in(token)
+        if expires_in > self.refresh_before:
+            return token
+        if expires_in > 0:
+            self.refresh_in_background()
+            return token
+
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                if self.load is not None and (loaded := self.load()) is not None:
+                    self._set(loaded, store=False)
+            if self.expires_in(self._token) > self.refresh_before:
+                return self._token  # loaded from DB or refreshed by other thread
+            return self._refresh()
+
+    async def aget(self) -> Optional[BearerToken]:
+        token = self._token
+        if self.expires_in(token) > 0:
+            if self.expires_in(token) <= self.refresh_before:
+                self.refresh_in_background()
+            return token
+
+        return await asyncio.to_thread(self.get)
+
+    def invalidate(self, token: Optional[BearerToken] = None):
+        """ API rejected token (401): next get() logs in again """
+
+        with self._lock:
+            if token is None or self._token is token:
+                self._token = None
+
+    def refresh_in_background(self):
+        with self._state_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="token-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                if self.expires_in(self._token) <= self.refresh_before:
+                    self._refresh()
+        except Exception as e:
+            print(f"Token refresh failed: {e}")
+        finally:
+            self._refreshing = False
+
+    def _refresh(self) -> Optional[BearerToken]:
+        """ called with self._lock """
+
+        if (token := self.login()) is not None:
+            self._set(token)
+            print(f"token changed {token.expires_at=}")
+
+        return self._token
+
+    def _set(self, token: BearerToken, store: bool = True):
+        self._token = token
+        if self._timer is not None:
+            self._timer.cancel()
+        if (delay := self.expires_in(token) - self.refresh_before) > 0:
+            self._timer = threading.Timer(delay, self.refresh_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+        if store and self.store is not None:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-writer")
+            self._writer.submit(self._write_behind, token)
+
+    def _write_behind(self, token: BearerToken):
+        try:
+            self.store(token)
+        except Exception as e:
+            print(f"Token is not stored in DB: {e}")
@@ -0,0 +1,31 @@
+import time
+
+from common.db.cache import EntityCache, MISSING
+
+
+def test_lru_eviction_and_stats():
+    cache = EntityCache("test", max_size=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # b is least recently used now
+    cache.put("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("c") == 3
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (2, 1, 1)
+    assert "hits=2" in str(cache)
+
+
+def test_ttl_and_invalidate():
+    cache = EntityCache("test", ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is MISSING
+
+    cache.ttl = 60
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.invalidate("a")
+    assert cache.get("a") is MISSING and cache.get("b") == 2
+    cache.invalidate()
+    assert len(cache) == 0
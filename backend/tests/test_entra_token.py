@@ -0,0 +1,58 @@
+import threading
+import time
+
+from azure.core.credentials import AccessToken
+
+from common.db.connect_sql import EntraTokenCache
+
+SCOPE = "https://database.windows.net/.default"
+
+
+class FakeCredential:
+    def __init__(self, expires_in: float = 3600., delay: float = 0.):
+        self.calls = 0
+        self.expires_in = expires_in
+        self.delay = delay
+
+    def get_token(self, scope: str) -> AccessToken:
+        self.calls += 1
+        time.sleep(self.delay)
+        return AccessToken(f"token-{self.calls}", int(time.time() + self.expires_in))
+
+
+def test_token_cached_by_scope():
+    credential = FakeCredential()
+    factory_calls = []
+    cache = EntraTokenCache(lambda: factory_calls.append(1) or credential, refresh_before=60)
+
+    assert cache.get_token(SCOPE).token == cache.get_token(SCOPE).token == "token-1"
+    assert cache.get_token("other/.default").token == "token-2"
+    assert len(factory_calls) == 1
+
+
+def test_token_single_flight():
+    credential = FakeCredential(delay=0.1)
+    cache = EntraTokenCache(lambda: credential, refresh_before=60)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(cache.get_token(SCOPE))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert credential.calls == 1
+    assert {t.token for t in tokens} == {"token-1"}
+
+
+def test_token_refreshed_ahead_of_expiry():
+    credential = FakeCredential(expires_in=30)
+    cache = EntraTokenCache(lambda: credential, refresh_before=60)
+
+    assert cache.get_token(SCOPE).token == "token-1"
+    assert cache.get_token(SCOPE).token == "token-2"  # expires within refresh_before
+
+    def fail(scope):
+        raise ConnectionError("IMDS unavailable")
+
+    credential.get_token = fail
+    assert cache.get_token(SCOPE).token == "token-2"  # still valid: kept
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime, timezone
+
+import httpx
+from fastapi_utils.api_model import APIModel
+from pydantic import Field
+
+from storyapi.db.auth import BearerToken
+from storyapi.service import auth
+from storyapi.service.auth import ABCStoryService
+from storyapi.service.client import get_http_client, get_async_client, ACCEPT_ENCODING, HTTP2
+
+
+def test_http_client_shared():
+    client = get_http_client()
+
+    assert client is get_http_client()
+    assert client.headers["Accept-Encoding"] == ACCEPT_ENCODING
+    assert "gzip" in ACCEPT_ENCODING
+    assert client.timeout.connect is not None and client.timeout.read is not None
+
+
+def test_async_client():
+    async def check():
+        async with get_async_client(max_connections=2) as client:
+            assert isinstance(client, httpx.AsyncClient)
+            assert client.headers["Accept-Encoding"] == ACCEPT_ENCODING
+
+    asyncio.run(check())
+
+
+def test_clients_http2():
+    """ HTTP/2 is negotiated only if enabled in settings & h2 is installed """
+
+    assert get_http_client()._transport._pool._http2 is HTTP2
+    assert get_async_client()._transport._pool._http2 is HTTP2
+
+
+class Detail(APIModel):
+    bill_id: str = Field(..., alias='billId')
+
+
+class DetailAPI(ABCStoryService[Detail]):
+    endpoint = "/bills"
+
+    def get_url(self, bill_id: str) -> str:
+        return f"https://api.test{self.endpoint}/{bill_id}"
+
+
+def test_aiter_story_api_data(monkeypatch):
+    in_flight, peak = 0, 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        bill_id = request.url.path.rsplit("/", 1)[-1]
+        if bill_id == "b3":
+            return httpx.Response(404, json={"error": "Bill not found"})
+        if bill_id == "b5":
+            return httpx.Response(200, json={"unexpected": True})
+        return httpx.Response(200, json={"billId": bill_id})
+
+    async def aget_token():
+        return BearerToken(token_type="Bearer", access_token="token", expires_at=datetime.now(timezone.utc))
+
+    monkeypatch.setattr(auth.token_manager, "aget", aget_token)
+    monkeypatch.setattr(
+        auth, "get_async_client",
+        lambda max_connections: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    bill_ids = [f"b{i}" for i in range(20)]
+
+    async def fetch():
+        return [item async for item in DetailAPI().aiter_story_api_data(((b,) for b in bill_ids), 5)]
+
+    results = dict(asyncio.run(fetch()))
+
+    assert 1 <= peak <= 5
+    assert set(results) == {(b,) for b in bill_ids}  # result for every input
+    assert results[("b3",)] is None and results[("b5",)] is None  # failed bills do not stop the batch
+    assert all(results[(b,)].bill_id == b for b in bill_ids if b not in ("b3", "b5"))
@@ -0,0 +1,34 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+IMPORT_BUDGET = 3.  # sec, generous for slow CI runners
+APP_DIR = Path(__file__).resolve().parents[1] / "app"
+SCRIPT = """
+import json, socket, sys, time
+
+def no_network(*args, **kwargs):
+    raise AssertionError("network call on import")
+
+socket.socket.connect = no_network
+started = time.perf_counter()
+import storyapi.service.auth, storyapi.service.bills, common.db.connect_sql, common.db.sql_params
+print(json.dumps({
+    "elapsed": time.perf_counter() - started,
+    "modules": [m for m in ("pyodbc", "pymssql", "azure.identity") if m in sys.modules],
+}))
+"""
+
+
+def test_import_is_lazy_and_fast():
+    env = os.environ | {"PYTHONPATH": os.pathsep.join(filter(None, [str(APP_DIR), os.environ.get("PYTHONPATH")]))}
+    res = subprocess.run(
+        [sys.executable, "-c", SCRIPT], cwd=APP_DIR, env=env, capture_output=True, text=True, timeout=60
+    )
+
+    assert res.returncode == 0, res.stderr
+    report = json.loads(res.stdout.strip().splitlines()[-1])
+    assert report["modules"] == []
+    assert report["elapsed"] < IMPORT_BUDGET
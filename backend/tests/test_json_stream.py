@@ -0,0 +1,46 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from common.services.json_stream import ArrayItems
+from storyapi.service.bills import BillsPageStream
+
+
+def chunked(content: bytes, size: int):
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+def test_array_items_any_chunk_size():
+    doc = {
+        "ok": True,
+        "tags": [1, [2]],
+        "data": [{"a": "x\"]}[{\\", "b": [{"c": 1}]}, {"d": "\\"}, [1, 2]],
+        "nextPage": "/bills/a-b?lastBillId=X1"
+    }
+    content = json.dumps(doc).encode()
+
+    for size in range(1, len(content) + 1):
+        items = ArrayItems("data")
+        assert [json.loads(i) for i in items.feed_all(chunked(content, size))] == doc["data"]
+        assert json.loads(bytes(items.rest)) == doc | {"data": []}
+
+
+def test_bills_page_stream():
+    with open("./source/json/bills_list.json", "rb") as f:
+        content = f.read()
+
+    page = BillsPageStream(chunked(content, 512), place_id="p1")
+    bills = list(page)
+
+    assert len(bills) == len(json.loads(content)["data"])
+    assert all(b.place_id == "p1" for b in bills)
+    assert page.next_page is not None
+    assert page.next_page.last_bill_id == "TM2024023161"
+
+
+def test_bills_page_stream_error_body():
+    page = BillsPageStream(chunked(b"<html>502 Bad Gateway</html>", 8))
+
+    with pytest.raises(ValidationError):
+        list(page)
@@ -0,0 +1,72 @@
+import pytest
+
+from common.db.known_keys import KnownKeys, transaction_keys
+
+
+def test_seed_once_and_unknown():
+    known = KnownKeys("test", max_size=10)
+    known.seed(count=lambda: 2, load=lambda: ["a", "b"])
+    known.seed(count=lambda: 3, load=lambda: ["c"])  # seeded already
+
+    assert known.seeded and len(known) == 2
+    assert known.unknown(["a", "c", "b", "d"]) == ["c", "d"]
+    assert known.stats() == (2, 2)
+
+    big = KnownKeys("big", max_size=1)
+    big.seed(count=lambda: 2, load=lambda: pytest.fail("table is too big to load"))
+    assert not big.seeded and len(big) == 0
+
+
+def test_keys_known_after_commit_only():
+    known = KnownKeys("test")
+    known.add_after_commit(["x"])  # no transaction: commit is not seen
+    assert "x" not in known
+
+    with transaction_keys() as pending:
+        known.add_after_commit(["a", None])
+        with transaction_keys() as nested:
+            assert nested is pending
+            known.add_after_commit(["b"])
+        assert "a" not in known
+        pending.commit()
+    assert "a" in known and "b" in known and None not in known
+
+    with transaction_keys() as pending:
+        known.add_after_commit(["c"])
+        pending.rollback()
+    assert "c" not in known
+
+    known.discard("a")
+    assert "a" not in known and "b" in known
+    known.discard()
+    assert len(known) == 0 and not known.seeded
+
+
+def test_seed_retried_after_error():
+    known = KnownKeys("test", max_size=10)
+
+    def broken():
+        raise ConnectionError("DB is down")
+
+    with pytest.raises(ConnectionError):
+        known.seed(count=lambda: 1, load=broken)
+    assert not known.seeded
+
+    known.seed(count=lambda: 1, load=lambda: ["a"])
+    assert known.seeded and "a" in known
+
+
+def test_callbacks_after_commit_only():
+    calls = []
+
+    with transaction_keys() as pending:
+        pending.on_commit(lambda: calls.append("invalidate"))
+        assert not calls
+        pending.commit()
+    assert calls == ["invalidate"]
+
+    with transaction_keys() as pending:
+        pending.on_commit(lambda: calls.append("rolled back"))
+        pending.rollback()
+        pending.commit()
+    assert calls == ["invalidate"]
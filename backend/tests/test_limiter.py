@@ -0,0 +1,50 @@
+import time
+
+from storyapi.service.limiter import RateLimiter, parse_retry_after
+
+
+def get_limiter(**kwargs):
+    return RateLimiter(name="test", **({"rate": 1000., "burst": 10, "max_concurrency": 4} | kwargs))
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.
+    assert parse_retry_after("soon") is None
+
+
+def test_token_bucket_rate():
+    limiter = get_limiter(rate=20., burst=1)
+    started = time.monotonic()
+    for _ in range(3):
+        with limiter.request() as ticket:
+            ticket.done(200)
+
+    assert time.monotonic() - started >= 0.09
+    assert limiter.stats.requests == 3
+
+
+def test_throttled_pause_and_decrease():
+    limiter = get_limiter()
+    with limiter.request() as ticket:
+        ticket.done(429, "0.1")
+
+    assert ticket.throttled
+    assert limiter.limit == 2 and limiter.stats.throttled == 1
+    started = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - started >= 0.05
+
+
+def test_aimd_concurrency():
+    limiter = get_limiter(target_latency=10.)
+    with limiter.request():
+        pass  # no response: transport error
+    assert limiter.limit == 2 and limiter.stats.errors == 1
+
+    for _ in range(10):
+        with limiter.request() as ticket:
+            ticket.done(200)
+    assert 2 < limiter.limit <= 4
+    assert limiter.in_flight == 0
@@ -1,3 +1,4 @@
+import itertools
 import json
 from datetime import datetime, timedelta
 
@@ -7,7 +8,8 @@ from migrations import get_merchant
 from storyapi.config.settings import settings
 from storyapi.db import SourceId
 from storyapi.db.auth import AuthSQL
-from storyapi.db.bills import BillsList
+from common.db.mssql import get_model_plan
+from storyapi.db.bills import Bills, BillsList
 from storyapi.db.merchants import Merchant
 from storyapi.db.merchants_sql import MerchantsSQL
 from storyapi.db.repos.auth import ClientsAndAuthRepositorySQL
@@ -90,6 +92,16 @@ def get_test_json(source_id_work, json_filename):
     return test_json
 
 
+def test_model_plan_and_shared_repository():
+    plan = get_model_plan(Bills)
+
+    assert plan.foreign_keys["items"] == "bill_id"
+    assert plan.converted == {"place_id": "place_id", "created_by": "person_id", "paid_by": "person_id"}
+    assert get_model_plan(Bills) is plan
+    assert BillsRepositorySQL.shared() is BillsRepositorySQL.shared()
+    assert "bill_id" in BillsRepositorySQL.param_sql.columns
+
+
 def test_client_and_auth():
     repos = ClientsAndAuthRepositorySQL()
     auth_list = repos.index()
@@ -103,6 +115,28 @@ def test_client_and_auth():
     assert isinstance(client, AuthSQL)
 
 
+def test_iter_index():
+    repos = BillsRepositorySQL.shared()
+    bills = repos.iter_index(array_size=2)
+    first = list(itertools.islice(bills, 3))
+    bills.close()
+
+    assert all(isinstance(b, repos.model) for b in first)
+    assert sum(1 for _ in repos.iter_index({repos.primary_key: first[0].bill_id})) == 1
+
+
+def test_index_keyset():
+    repos = BillsRepositorySQL.shared()
+    page = repos.index_keyset(limit=5)
+    ids = [b.bill_id for b in page.data]
+    while page.after is not None and len(ids) < 20:
+        page = repos.index_keyset(limit=5, after=page.after)
+        ids.extend(b.bill_id for b in page.data)
+
+    assert ids == sorted(ids) and len(ids) == len(set(ids))
+    assert page.count == repos.count()
+
+
 def test_merchant(merchant_sql):
     repos = MerchantsRepositorySQL()
     if (merchant := repos.view({
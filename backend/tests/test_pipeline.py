@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+from common.services.pipeline import Pipeline, PipelineStats
+
+
+def test_pipeline_order_and_stats():
+    written = []
+
+    def slow_write(item):
+        time.sleep(0.01)
+        written.append(item)
+
+    stats = Pipeline(maxsize=2).run(
+        iter(range(10)),
+        ("parse", lambda x: x * 2),
+        ("write", slow_write),
+    )
+
+    assert written == [x * 2 for x in range(10)]
+    assert isinstance(stats, PipelineStats)
+    assert [s.name for s in stats.stages] == ["source", "parse", "write"]
+    assert stats.stages[-1].items == 10
+    assert max(s.depth_max for s in stats.stages) <= 2
+
+
+def test_pipeline_stage_error():
+    def fail(item):
+        if item == 3:
+            raise ValueError("bad page")
+        return item
+
+    with pytest.raises(ValueError) as e:
+        Pipeline(maxsize=1).run(iter(range(100)), ("parse", fail), ("write", lambda x: None))
+
+    assert "bad page" in str(e.value)
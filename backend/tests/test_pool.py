@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+from common.db.drivers import is_disconnect
+from common.db.pool import ConnectionPool, PoolTimeout, NoConnectionBorrowed
+from common.db.retry import RetryPolicy, retry_call
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.dead = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, *args):
+        if self.dead:
+            raise ConnectionError("socket closed")
+
+    def fetchall(self):
+        return [(1,)]
+
+    def rollback(self):
+        self.execute()
+
+    def close(self):
+        self.closed = True
+
+
+def test_borrow_reentrant():
+    pool = ConnectionPool(FakeConnection, max_size=2)
+
+    with pool.borrow() as conn:
+        with pool.borrow() as nested:
+            assert nested is conn
+            assert pool.current() is conn
+        assert pool.size == 1 and pool.idle == 0
+    assert pool.idle == 1
+
+    with pytest.raises(NoConnectionBorrowed):
+        pool.current()
+
+
+def test_threads_use_own_connections():
+    pool = ConnectionPool(FakeConnection, max_size=4)
+    started = threading.Barrier(3)
+    used = []
+
+    def work():
+        with pool.borrow() as conn:
+            used.append(conn)
+            started.wait(timeout=5)
+
+    threads = [threading.Thread(target=work) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len({id(c) for c in used}) == 3
+    assert pool.size == pool.idle == 3
+
+
+def test_max_size_timeout():
+    pool = ConnectionPool(FakeConnection, max_size=1, timeout=0.1)
+
+    with pool.borrow():
+        holder = pool.current()
+        errors = []
+        thread = threading.Thread(target=lambda: errors.append(pytest.raises(PoolTimeout, pool.acquire)))
+        thread.start()
+        thread.join()
+        assert errors and pool.current() is holder
+
+
+def test_dead_connection_replaced_on_checkout():
+    pool = ConnectionPool(FakeConnection, max_size=2, check_idle=0)
+
+    with pool.borrow() as conn:
+        pass
+    conn.dead = True
+    with pool.borrow() as fresh:
+        assert fresh is not conn
+    assert conn.closed and pool.size == 1 and pool.stats.checks_failed == 1
+
+
+def test_max_age_and_replace():
+    pool = ConnectionPool(FakeConnection, max_size=2, max_age=0.01)
+
+    with pool.borrow() as conn:
+        pass
+    time.sleep(0.02)
+    with pool.borrow() as fresh:
+        assert fresh is not conn
+        replaced = pool.replace()
+        assert pool.current() is replaced and fresh.closed
+    assert pool.stats.expired >= 1 and pool.size <= 1
+
+
+def test_is_disconnect():
+    assert is_disconnect(Exception(20006, b"DB-Lib error message 20006, severity 9: Write to server failed"))
+    assert is_disconnect(Exception(b"DB-Lib error message 20047, severity 9: DBPROCESS is dead"))
+    assert is_disconnect(Exception("08S01", "[08S01] Communication link failure"))
+    assert not is_disconnect(Exception(1205, b"Transaction was deadlocked"))
+    assert not is_disconnect(Exception(8152, b"String or binary data would be truncated"))
+    assert not is_disconnect(Exception("22018", "Conversion failed"))
+
+
+    class OperationalError(Exception):
+        """ pymssql: deadlocks & conversion errors are OperationalError too """
+
+    calls = []
+
+    def deadlock():
+        calls.append(1)
+        raise OperationalError(1205, b"Transaction was deadlocked")
+
+    replaced = []
+    with pytest.raises(OperationalError):
+        retry_call(
+            deadlock, (OperationalError,), RetryPolicy(attempts=5, base=0.001),
+            on_retry=replaced.append, retry_if=is_disconnect
+        )
+    assert len(calls) == 1 and not replaced  # raised at once, connection kept
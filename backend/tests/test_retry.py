@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from common.db.retry import RetryPolicy, CircuitBreaker, CircuitOpen, retry_call, CLOSED, OPEN, HALF_OPEN
+
+
+def test_delays_backoff_with_jitter():
+    delays = list(RetryPolicy(attempts=6, base=0.5, cap=2., budget=100.).delays())
+
+    assert len(delays) == 6
+    assert all(0 <= d <= min(2., 0.5 * 2 ** n) for n, d in enumerate(delays))
+    assert list(RetryPolicy(attempts=10, base=10., cap=10., budget=0.).delays()) == []
+
+
+def test_retry_call_recovers():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("failover")
+        return "ok"
+
+    replaced = []
+    res = retry_call(
+        flaky, (ConnectionError,), RetryPolicy(attempts=5, base=0.001), on_retry=replaced.append
+    )
+
+    assert res == "ok" and len(calls) == 3 and len(replaced) == 2
+
+
+def test_retry_budget_spent():
+    def down():
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        retry_call(down, (ConnectionError,), RetryPolicy(attempts=2, base=0.001))
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failures=2, reset_timeout=0.05)
+    policy = RetryPolicy(attempts=10, base=0.001)
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(CircuitOpen):
+        retry_call(down, (ConnectionError,), policy, breaker)
+    assert breaker.state == OPEN and len(calls) == 2
+
+    with pytest.raises(CircuitOpen):
+        retry_call(down, (ConnectionError,), policy, breaker)
+    assert len(calls) == 2  # failed fast
+
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()  # one probe at a time
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_circuit_breaker_probe_other_error():
+    breaker = CircuitBreaker(failures=1, reset_timeout=0.01)
+    policy = RetryPolicy(attempts=0, base=0.001)
+    breaker.record_failure()
+    time.sleep(0.02)
+
+    def bad_config():
+        raise ValueError("no credential")
+
+    with pytest.raises(ValueError):
+        retry_call(bad_config, (ConnectionError,), policy, breaker)
+    assert breaker.state == OPEN  # probe ended: circuit is not stuck half open
+
+    time.sleep(0.02)
+    assert retry_call(lambda: "ok", (ConnectionError,), policy, breaker) == "ok"
+    assert breaker.state == CLOSED
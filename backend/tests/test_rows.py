@@ -0,0 +1,31 @@
+from common.db.rows import Row, RowSet
+from storyapi.db.bills_sql import PersonSQL
+
+
+class FakeCursor:
+    description = (("person_id", int), ("full_name", str), ("user_name", str))
+
+
+def get_rows() -> RowSet:
+    return RowSet.from_cursor(FakeCursor(), [(1, "George", "g"), (2, "Slide", "s")])
+
+
+def test_row_access():
+    rows = get_rows()
+    row = rows[1]
+
+    assert isinstance(row, Row)
+    assert row["full_name"] == row.full_name == "Slide"
+    assert dict(row) == {"person_id": 2, "full_name": "Slide", "user_name": "s"}
+    assert row.get("missing") is None
+    assert [r.person_id for r in rows] == rows.column("person_id") == [1, 2]
+    assert len(rows[:1]) == 1 and rows[:1].columns == rows.columns
+
+
+def test_row_set_models():
+    rows = get_rows()
+    models = rows.models(PersonSQL)
+
+    assert models == [PersonSQL.model_validate(d) for d in rows.dicts()]
+    assert models[0].user_name == "g"
+    assert not RowSet(("person_id",), [])
@@ -0,0 +1,49 @@
+from common.services.scheduler import run_parallel
+
+attempts = {}
+
+
+def flaky(task):
+    attempts[task] = attempts.get(task, 0) + 1
+    if task == "flaky" and attempts[task] < 2:
+        raise ConnectionError(task)
+    if task == "broken":
+        raise ValueError(task)
+    return task.upper()
+
+
+def test_run_parallel_retries():
+    results = run_parallel(flaky, ["ok", "flaky", "broken"], max_workers=2, retries=1, processes=False)
+
+    assert [r.task for r in results] == ["ok", "flaky", "broken"]
+    assert results[0].ok and results[0].result == "OK"
+    assert results[1].ok and results[1].attempts == 2
+    assert not results[2].ok and isinstance(results[2].error, ValueError)
+    assert results[2].attempts == 2
+
+
+def test_run_parallel_max_per_key():
+    import threading
+    import time
+
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+
+    def task(t):
+        merchant, _ = t
+        with lock:
+            running[merchant] = running.get(merchant, 0) + 1
+            peak[merchant] = max(peak.get(merchant, 0), running[merchant])
+        time.sleep(0.01)
+        with lock:
+            running[merchant] -= 1
+        return t
+
+    tasks = [("m1", i) for i in range(6)] + [("m2", i) for i in range(2)]
+    results = run_parallel(
+        task, tasks, max_workers=4, processes=False, key=lambda t: t[0], max_per_key=2
+    )
+
+    assert all(r.ok for r in results)
+    assert peak["m1"] <= 2 and peak["m2"] <= 2
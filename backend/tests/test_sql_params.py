@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta, timezone
+
+from common.db.sql_params import (
+    ParamSQL, chunk_rows, largest_in, param_value, split_in, where_shape, MAX_PARAMS, MAX_ROWS
+)
+
+
+def get_param_sql():
+    return ParamSQL(
+        table="[storyous].[person]",
+        primary_key="person_id",
+        columns=["person_id", "full_name", "user_name"]
+    )
+
+
+def test_merge_many_skip_existing():
+    sql_query = get_param_sql().merge_many(rows_count=2, marker="?", update=False)
+
+    assert sql_query.count("?") == 6
+    assert "WITH (HOLDLOCK)" in sql_query
+    assert "WHEN NOT MATCHED BY TARGET THEN INSERT" in sql_query
+    assert "WHEN MATCHED" not in sql_query
+    assert "OUTPUT $action" in sql_query
+
+
+def test_merge_many_update_existing():
+    sql_query = get_param_sql().merge_many(rows_count=1, marker="%s", update=True)
+
+    assert sql_query.count("%s") == 3
+    assert "WHEN MATCHED THEN UPDATE SET target.[full_name] = source.[full_name]" in sql_query
+    assert "target.[person_id] = source.[person_id]," not in sql_query
+
+
+def test_chunk_rows():
+    rows = [(i, "name", "user") for i in range(5000)]
+    chunks = list(chunk_rows(rows, columns_count=3))
+
+    assert sum(len(c) for c in chunks) == len(rows)
+    assert all(len(c) <= MAX_ROWS and len(c) * 3 <= MAX_PARAMS for c in chunks)
+
+    chunks = list(chunk_rows(rows, columns_count=22))
+    assert all(len(c) * 22 <= MAX_PARAMS for c in chunks)
+
+
+def test_insert_many():
+    param_sql = get_param_sql()
+
+    assert param_sql.insert_many(1, "?") == (
+        "INSERT INTO [storyous].[person] ([person_id], [full_name], [user_name]) VALUES (?, ?, ?);"
+    )
+    assert param_sql.insert_many(3, "%s").count("%s") == 9
+
+
+def test_where_shape():
+    shape, params = where_shape({"place_id": "p1", "refunded": None, "pid": {"$in": [1, 2, 3]}})
+
+    assert shape == (("place_id", "=", 1), ("refunded", "IS NULL", 0), ("pid", "IN", 4))
+    assert params == ("p1", 1, 2, 3, 3)
+    assert where_shape({"pid": {"$in": []}})[0] == (("pid", "IN", 0),)
+    assert where_shape({"$or": [{"pid": 1}]}) is None
+    assert where_shape({"name": {"$regex": "a"}}) is None
+
+
+def test_select_statement_cached_by_shape():
+    param_sql = get_param_sql()
+    first = param_sql.select({"person_id": 1}, marker="?")
+    second = param_sql.select({"person_id": 2}, marker="?")
+
+    assert first.sql == second.sql == "EXEC sp_executesql ?, ?, ?"
+    assert first.params[0] is second.params[0]  # same template: one plan in MSSQL cache
+    assert first.params == (
+        "SELECT * FROM [storyous].[person] WHERE [person_id] = @p1", "@p1 bigint", 1
+    )
+    assert param_sql.select({"person_id": {"$in": [1, 2, 3]}}, marker="%s").params[0] == (
+        param_sql.select({"person_id": {"$in": [4, 5, 6, 7]}}, marker="%s").params[0]
+    )
+    assert "COUNT(*) AS [count]" in param_sql.select({}, marker="?", count=True).params[0]
+
+
+def test_insert_statement():
+    param_sql = ParamSQL(
+        table="[storyous].[person]",
+        primary_key="person_id",
+        columns=["person_id", "full_name", "user_name"],
+        types={"person_id": "bigint", "full_name": "nvarchar(max)", "user_name": "nvarchar(max)"}
+    )
+    statement = param_sql.insert({"person_id": 1, "full_name": None, "user_name": "u"}, marker="?")
+
+    assert statement.sql == "EXEC sp_executesql ?, ?, ?, ?"
+    assert statement.params[1] == "@p1 bigint, @p2 nvarchar(max)"
+    assert statement.params[2:] == (1, "u")
+    assert "([person_id], [user_name])" in statement.params[0]  # NULL: column default is used
+    assert "@p1 AS [person_id]" in statement.params[0]
+
+    identity = ParamSQL(table="[storyous].[taxes]", primary_key="pid", columns=["bill_id", "vat"])
+    assert "SCOPE_IDENTITY()" in identity.insert({"bill_id": "b", "vat": 21.}, marker="?").params[0]
+
+
+def test_update_delete_statement():
+    param_sql = get_param_sql()
+    statement = param_sql.update(
+        {"full_name": "name", "items": [], "person_id": 1}, {"person_id": 1}, marker="%s"
+    )
+
+    assert "SET [full_name] = @p1 WHERE [person_id] = @p2" in statement.params[0]
+    assert statement.params[1:] == ("@p1 varchar(8000), @p2 bigint", "name", 1)
+    assert param_sql.update({"items": []}, {"person_id": 1}, marker="?") is None
+    assert "DELETE FROM [storyous].[person] WHERE [person_id] = @p1" in (
+        param_sql.delete({"person_id": 1}, marker="?").params[0]
+    )
+    assert param_sql.delete({}, marker="?") is None
+
+
+def test_page_statement():
+    param_sql = get_param_sql()
+    first = param_sql.page({"full_name": "a"}, marker="?", limit=10, total=True)
+    nxt = param_sql.page({"full_name": "b"}, marker="?", limit=10, after=(5,))
+
+    assert first.params[0] == (
+        "SELECT TOP (@p2) *, COUNT(*) OVER() AS [__total] FROM [storyous].[person] "
+        "WHERE [full_name] = @p1 ORDER BY [person_id]"
+    )
+    assert nxt.params[0].endswith("WHERE [full_name] = @p1 AND (([person_id] > @p2)) ORDER BY [person_id]")
+    assert nxt.params[2:] == ("b", 5, 10)
+
+    by_name = param_sql.page({}, marker="?", limit=10, after=("a", 5), keys=("full_name", "person_id"))
+    assert "(([full_name] > @p1) OR ([full_name] = @p1 AND [person_id] > @p2))" in by_name.params[0]
+
+    offset = param_sql.page({}, marker="?", limit=10, skip=20, total=True)
+    assert offset.params[0].endswith("ORDER BY [person_id] OFFSET @p1 ROWS FETCH NEXT @p2 ROWS ONLY")
+    assert offset.params[2:] == (20, 10)
+
+
+def test_page_seek_string_key_types():
+    param_sql = ParamSQL(
+        table="[storyous].[bills]",
+        primary_key="bill_id",
+        columns=["bill_id", "place_id"],
+        types={"bill_id": "nvarchar(max)", "place_id": "nvarchar(max)"}
+    )
+    statement = param_sql.page({"place_id": "p1"}, marker="?", limit=10, after=("BA2018000001",))
+
+    # nvarchar parameter against varchar key would convert the column: index scan on every page
+    assert statement.params[1] == "@p1 varchar(8000), @p2 varchar(8000), @p3 bigint"
+
+
+def test_select_in_table_projection():
+    param_sql = get_param_sql()
+    sql_query, params = param_sql.select(
+        {"person_id": {"$in": list(range(50000))}, "user_name": "g"},
+        marker="?",
+        columns=("person_id",),
+        in_table="person_id"
+    )
+
+    assert params[0] == (
+        "SELECT [person_id] FROM [storyous].[person] "
+        "WHERE [person_id] IN (SELECT [key] FROM #in_keys) AND [user_name] = @p1"
+    )
+    assert params[2:] == ("g",)
+    assert "INTO #in_keys" in param_sql.keys_table("person_id")
+    assert ParamSQL.keys_insert(3, "%s").count("%s") == 3
+
+
+def test_split_largest_in():
+    query = {"person_id": {"$in": [3, 1, 3, 2, 1]}, "user_name": {"$in": ["g"]}}
+    field, values = largest_in(query)
+
+    assert (field, values) == ("person_id", [3, 1, 2])
+    chunks = list(split_in(query, field, values, size=2))
+    assert [c["person_id"]["$in"] for c in chunks] == [[3, 1], [2]]
+    assert all(c["user_name"] == {"$in": ["g"]} for c in chunks)
+    assert largest_in({"person_id": 1}) is None
+
+
+def test_param_value_aware_datetime_to_utc():
+    aware = datetime(2024, 3, 1, 14, 30, tzinfo=timezone(timedelta(hours=2)))
+
+    assert param_value(aware) == datetime(2024, 3, 1, 12, 30)
+    assert param_value(datetime(2024, 3, 1, 14, 30)) == datetime(2024, 3, 1, 14, 30)
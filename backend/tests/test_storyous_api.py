@@ -1,10 +1,14 @@
+import json
+from datetime import timedelta
+
 import pytest
+from pydantic import ValidationError
 
 from storyapi.config import param_to_str
 from storyapi.db.repos.bills_sql import BillsRepositorySQL
 from storyapi.service.auth import ABCStoryService
 from storyapi.db.bills import (
-    BillsList, Bills
+    BillsList, Bills, NextPage
 )
 from storyapi.service.bills import BillsAPI, BillsListAPI
 from storyapi.db import source_set, SourceId
@@ -250,3 +254,56 @@ def test_bill_details(source_id, bill_detail):
 
     bill.place_id = source_id.place_id
     BillsRepositorySQL().create_with_fk(bill)
+
+
+def test_bill_details_json(bill_detail):
+    bill = Bills.model_validate_json(json.dumps(bill_detail).encode())
+
+    assert bill.model_dump() == Bills(**bill_detail).model_dump()
+    assert bill.fiscal_data[0].bill_id == bill.bill_id
+    assert bill.order_provider[0].bill_id == bill.bill_id
+    assert {r.bill_id for r in bill.taxes + bill.payments + bill.items} == {bill.bill_id}
+
+
+def test_bills_json(bills_list):
+    content = json.dumps(bills_list).encode()
+    bills = BillsList.model_validate_json(content)
+
+    assert bills.next_page == NextPage.model_validate_json(content).next_page
+    assert all(b.place_id == bills.next_page.place_id for b in bills.data)
+    assert bills.data[0].last_modified_at is not None
+    with pytest.raises(ValidationError):
+        BillsList.model_validate_json(b"Bad Gateway")
+
+
+def test_source_id_split_by_date(source_id: SourceId):
+    shards = source_id.split_by_date(4)
+    assert len(shards) == 4
+    assert shards[0].from_date == source_id.from_date
+    assert shards[-1].till_date == source_id.till_date
+    assert all(s.last_bill_id is None for s in shards)
+    for prev, nxt in zip(shards, shards[1:]):
+        assert nxt.from_date == prev.till_date
+
+    source_id = source_id.model_copy(update=dict(
+        from_date=source_id.from_date.replace(microsecond=250000),
+        till_date=source_id.till_date.replace(microsecond=750000)
+    ))
+    shards = source_id.split_by_date(3)
+    assert shards[0].from_date == source_id.from_date
+    assert shards[-1].till_date == source_id.till_date
+    assert all(prev.till_date == nxt.from_date for prev, nxt in zip(shards, shards[1:]))
+
+
+def test_source_id_checkpoint_key(source_id: SourceId):
+    next_page = source_id.model_copy(update=dict(last_bill_id="BA2018000002"))
+    assert next_page.get_checkpoint_key() == source_id.get_checkpoint_key()
+    assert source_id.get_checkpoint_key().startswith(source_id.get_sync_key())
+
+    restored = SourceId.model_validate_json(next_page.model_dump_json(by_alias=True, exclude_none=True))
+    assert restored.last_bill_id == next_page.last_bill_id
+    assert restored.get_checkpoint_key() == source_id.get_checkpoint_key()
+
+    later = source_id.model_copy(update=dict(till_date=source_id.till_date + timedelta(hours=1)))
+    assert later.get_checkpoint_key() != source_id.get_checkpoint_key()
+    assert later.get_run_key() == source_id.get_run_key() != source_id.get_checkpoint_key()
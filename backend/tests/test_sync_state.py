@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from migrations import unique_bills
+from storyapi.db import SourceId
+from storyapi.db.repos.sync_sql import SyncStateRepositorySQL, SyncCheckpointRepositorySQL
+from storyapi.db.sync_sql import SyncStateSQL
+
+
+@pytest.fixture(name="sync_repo")
+def get_sync_repo(monkeypatch):
+    """ sync_state table in memory """
+
+    rows = {}
+    repo = SyncStateRepositorySQL()
+    monkeypatch.setattr(repo, "view", lambda key: rows.get(key))
+    monkeypatch.setattr(repo, "insert_update", lambda data: rows.update({data.source_key: data}) or data)
+
+    return repo
+
+
+@pytest.fixture(name="source")
+def get_source():
+    return SourceId(merchant_id="m1", place_id="p1", refunded=True)
+
+
+def test_get_set_watermark(sync_repo: SyncStateRepositorySQL, source: SourceId):
+    assert sync_repo.get_watermark(source) is None
+
+    aware = datetime(2024, 3, 1, 14, 30, tzinfo=timezone(timedelta(hours=2)))
+    state = sync_repo.set_watermark(source, aware)
+
+    assert isinstance(state, SyncStateSQL)
+    assert state.source_key == source.get_sync_key()
+    assert sync_repo.get_watermark(source) == datetime(2024, 3, 1, 12, 30)  # naive UTC
+    assert sync_repo.get_watermark(source.model_copy(update=dict(refunded=False))) is None
+
+
+def test_watermark_moves_forward_only(sync_repo: SyncStateRepositorySQL, source: SourceId):
+    sync_repo.set_watermark(source, datetime(2024, 3, 1, 12, 30))
+
+    assert sync_repo.set_watermark(source, datetime(2024, 2, 1)) is None
+    assert sync_repo.set_watermark(source, datetime(2024, 3, 1, 12, 30)) is None
+    assert sync_repo.get_watermark(source) == datetime(2024, 3, 1, 12, 30)
+
+    assert sync_repo.set_watermark(source, datetime(2024, 3, 2)) is not None
+    assert sync_repo.get_watermark(source) == datetime(2024, 3, 2)
+
+
+def test_unique_bills():
+    wo_items = [{"bill_id": "b1"}, {"bill_id": "b2"}, {"bill_id": "b1"}]
+    updated = ({"bill_id": bill_id} for bill_id in ["b2", "b3", "b3"])
+
+    assert unique_bills(wo_items, updated) == [{"bill_id": "b1"}, {"bill_id": "b2"}, {"bill_id": "b3"}]
+
+
+def test_resume_window_same_shards(monkeypatch):
+    rows = {}
+    repo = SyncCheckpointRepositorySQL()
+    monkeypatch.setattr(repo, "get_next_page", lambda key: rows.get(key))
+    monkeypatch.setattr(repo, "save", lambda key, next_page: rows.update({
+        key: SourceId.model_validate_json(next_page.model_dump_json(by_alias=True, exclude_none=True))
+    }))
+    source = SourceId(
+        merchant_id="m1",
+        place_id="p1",
+        from_date=datetime(2024, 3, 1, 10, 0, 0, 900000),
+        till_date=datetime(2024, 3, 1, 12, 0, 1, 900000)
+    )
+
+    first = [s.get_checkpoint_key() for s in repo.resume_window(source).split_by_date(4)]
+    restarted = source.model_copy(update=dict(till_date=source.till_date + timedelta(minutes=5)))
+    resumed = [s.get_checkpoint_key() for s in repo.resume_window(restarted).split_by_date(4)]
+
+    assert len(set(first)) == 4
+    assert resumed == first
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from storyapi.db.auth import BearerToken
+from storyapi.service.token import TokenManager
+
+
+def make_token(expires_in: float, n: int = 0) -> BearerToken:
+    return BearerToken(
+        token_type="Bearer",
+        access_token=f"token-{n}",
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+    )
+
+
+class FakeLogin:
+    def __init__(self, expires_in: float = 3600., delay: float = 0.):
+        self.calls = 0
+        self.expires_in = expires_in
+        self.delay = delay
+
+    def __call__(self) -> BearerToken:
+        self.calls += 1
+        time.sleep(self.delay)
+        return make_token(self.expires_in, self.calls)
+
+
+def test_single_flight_login_and_write_behind():
+    login = FakeLogin(delay=0.1)
+    stored = []
+    manager = TokenManager(login=login, store=stored.append)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(manager.get())) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    manager._writer.shutdown(wait=True)
+
+    assert login.calls == 1
+    assert {t.access_token for t in tokens} == {"token-1"}
+    assert [t.access_token for t in stored] == ["token-1"]
+
+
+def test_db_token_loaded_once():
+    login = FakeLogin()
+    loads = []
+    manager = TokenManager(login=login, load=lambda: loads.append(1) or make_token(3600))
+
+    assert manager.get().access_token == "token-0"
+    assert manager.get().access_token == "token-0"
+    assert login.calls == 0 and len(loads) == 1
+
+
+def test_refresh_ahead_of_expiry_in_background():
+    login = FakeLogin(expires_in=30, delay=0.05)
+    manager = TokenManager(login=login, refresh_before=60)
+
+    first = manager.get()  # no token: blocking login
+    assert first.access_token == "token-1"
+    assert manager.get() is first  # still valid: refresh in background, caller not blocked
+    time.sleep(0.2)
+    assert manager.token.access_token == "token-2"
+    assert asyncio.run(manager.aget()).access_token in ("token-2", "token-3")
+
+    manager.invalidate(manager.token)
+    assert asyncio.run(manager.aget()) is not None
@@ -0,0 +1,35 @@
+USE [story_api_local]
+GO
+/****** Object:  Table [storyous].[sync_state]    Incremental sync high-water marks ******/
+SET ANSI_NULLS ON
+GO
+SET QUOTED_IDENTIFIER ON
+GO
+CREATE TABLE [storyous].[sync_state](
+	[source_key] [varchar](350) NOT NULL,
+	[merchant_id] [varchar](150) NOT NULL,
+	[place_id] [varchar](150) NOT NULL,
+	[refunded] [bit] NOT NULL,
+	[modified_since] [datetime] NULL,
+	[updated_at] [datetime] NULL,
+ CONSTRAINT [PK_sync_state] PRIMARY KEY CLUSTERED 
+(
+	[source_key] ASC
+)WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON, OPTIMIZE_FOR_SEQUENTIAL_KEY = OFF) ON [PRIMARY]
+) ON [PRIMARY]
+GO
+/****** Object:  Table [storyous].[sync_checkpoint]    Last committed nextPage of pagination chain ******/
+SET ANSI_NULLS ON
+GO
+SET QUOTED_IDENTIFIER ON
+GO
+CREATE TABLE [storyous].[sync_checkpoint](
+	[checkpoint_key] [varchar](400) NOT NULL,
+	[next_page] [nvarchar](2000) NOT NULL,
+	[updated_at] [datetime] NULL,
+ CONSTRAINT [PK_sync_checkpoint] PRIMARY KEY CLUSTERED 
+(
+	[checkpoint_key] ASC
+)WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON, OPTIMIZE_FOR_SEQUENTIAL_KEY = OFF) ON [PRIMARY]
+) ON [PRIMARY]
+GO